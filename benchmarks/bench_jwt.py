@@ -0,0 +1,38 @@
+"""
+Microbenchmark of kkp.utils.jwt.JWT.
+
+Usage: python -m benchmarks.bench_jwt [iterations]
+"""
+
+import sys
+from os import urandom
+from timeit import timeit
+
+from kkp.utils.jwt import JWT
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    key = urandom(16)
+    payload = {"u": 123456, "s": 654321, "n": urandom(8).hex()}
+    token = JWT.encode(payload, key, expires_in=3600)
+
+    def decode_cold() -> None:
+        JWT._VERIFIED_CACHE.clear()
+        JWT.decode(token, key)
+
+    def decode_cached() -> None:
+        JWT.decode(token, key)
+
+    benchmarks = [
+        ("encode", lambda: JWT.encode(payload, key, expires_in=3600)),
+        ("decode (not cached)", decode_cold),
+        ("decode (cached)", decode_cached),
+    ]
+    for name, func in benchmarks:
+        seconds = timeit(func, number=iterations)
+        print(f"{name:<24}{seconds / iterations * 1_000_000:8.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Throughput of sending emails through single shared smtp connection vs kkp.utils.smtp_pool.SmtpPool.
+Needs smtp server, e.g. mailcatcher: docker run --rm -p 1025:1025 -p 1080:1080 schickling/mailcatcher
+
+Usage: python -m benchmarks.bench_smtp [messages] [host] [port]
+"""
+
+import sys
+from asyncio import gather, run
+from email.message import EmailMessage
+from time import perf_counter
+
+from aiosmtplib import SMTP
+
+from kkp.utils.smtp_pool import SmtpPool
+
+
+def _message(idx: int) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = "kkp@example.com"
+    message["To"] = f"bench{idx}@example.com"
+    message["Subject"] = f"Benchmark {idx}"
+    message.set_content("Benchmark message " * 32)
+    return message
+
+
+async def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    host = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 1025
+
+    async with SMTP(hostname=host, port=port) as smtp:
+        start = perf_counter()
+        await gather(*(smtp.send_message(_message(idx), timeout=5) for idx in range(count)))
+        seconds = perf_counter() - start
+    print(f"{'single connection':<24}{count / seconds:8.1f} messages/s")
+
+    for size in (2, 4, 8):
+        async with SmtpPool(host, port, size=size, max_pending=count) as pool:
+            start = perf_counter()
+            await gather(*(pool.send_message(_message(idx), timeout=5) for idx in range(count)))
+            seconds = perf_counter() - start
+        print(f"{f'pool ({size} connections)':<24}{count / seconds:8.1f} messages/s")
+
+
+if __name__ == "__main__":
+    run(main())
@@ -4,5 +4,25 @@ POETRY_VENV="$(poetry env info -p)"
 export PATH="${PATH}:${POETRY_VENV}/bin"
 
 export PYTHONUNBUFFERED=1
+
+if [ "$1" = "worker" ]; then
+  exec poetry run python -m kkp.worker
+fi
+
+if [ "$1" = "media-gc" ]; then
+  shift
+  exec poetry run python -m kkp.media_gc "$@"
+fi
+
+if [ "$1" = "rollup-backfill" ]; then
+  shift
+  exec poetry run python -m kkp.rollup_backfill "$@"
+fi
+
+if [ "$1" = "phash-backfill" ]; then
+  shift
+  exec poetry run python -m kkp.phash_backfill "$@"
+fi
+
 poetry run python -m kkp.migrate
 poetry run gunicorn kkp.main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 --preload --enable-stdio-inheritance
\ No newline at end of file
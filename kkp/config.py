@@ -1,14 +1,19 @@
 from base64 import b64decode
 from functools import partial
-from os import urandom
+from os import urandom, environ
 from pathlib import Path
+from typing import Literal
 
+import aiocache
 from aiofcm import FCM as FCMClient
-from aiosmtplib import SMTP as SMTPClient
 from pydantic import Field, field_validator, RedisDsn
 from pydantic_core.core_schema import ValidationInfo
 from pydantic_settings import BaseSettings
-from s3lite import Client
+from redis.asyncio import Redis
+from tortoise import generate_config
+
+from kkp.utils.s3_client import S3Client
+from kkp.utils.smtp_pool import SmtpPool
 
 
 class _Config(BaseSettings):
@@ -17,15 +22,43 @@ class _Config(BaseSettings):
     db_connection_string: str = ""
     redis_connection_string: RedisDsn = "redis://127.0.0.1:6379"
     fcm_config_path: Path = "fcm_config.json"
+    fcm_concurrency: int = 16
+    subscribers_chunk_size: int = 500
+    timeline_max_length: int = 1000
+    timeline_ttl: int = 86400 * 30
     bcrypt_rounds: int = 12
+    bcrypt_workers: int = 2
+    bcrypt_max_pending: int = 32
     public_host: str = "http://127.0.0.1:8080"
     migrations_dir: str = "data/migrations"
 
     max_photo_size: int = 8 * 1024 * 1024
-    max_video_size: int = 64 * 1024 * 104
+    max_video_size: int = 64 * 1024 * 1024
+    media_variant_widths: list[int] = [160, 480, 1080]
+    media_variant_quality: int = 80
+    media_placeholder_size: int = 16
+    media_placeholder_quality: int = 40
+    media_processing_workers: int = 2
+    media_max_pixels: int = 50_000_000
+    # Objects of deduplicated media are kept for some time, because their urls may still be used by clients
+    media_dedup_delete_delay: int = 60 * 60 * 24
+    # S3 requires all parts except the last one to be at least 5mb
+    multipart_part_size: int = 8 * 1024 * 1024
+    multipart_upload_ttl: int = 60 * 60 * 24
+    # Finalized media that is not attached to anything for this long is deleted
+    media_gc_grace: int = 60 * 60 * 24
+    # Interval of periodic gc run by kkp.worker, 0 disables it
+    media_gc_interval: int = 60 * 60
+    media_gc_batch_size: int = 500
+    # Max hamming distance between photo hashes of animals suggested for new reports (at most 11)
+    similar_animals_max_distance: int = 10
+    similar_animals_limit: int = 10
 
     jwt_key: bytes = Field(default_factory=partial(urandom, 16))
     jwt_ttl: int = 86400 * 7
+    session_cache_ttl: int = 60 * 5
+    jwt_refresh_tokens: bool = False
+    jwt_access_ttl: int = 60 * 15
 
     s3_endpoint: str = "http://127.0.0.1:9000"
     s3_endpoint_public: str = None
@@ -33,10 +66,20 @@ class _Config(BaseSettings):
     s3_access_secret_key: str = None
     s3_bucket_name: str = "kkp"
 
+    # "public" - unsigned urls to objects in public-read bucket (bucket policy is set on startup),
+    #  "presigned" - bucket is private (bucket policy is deleted on startup) and media urls are signed
+    media_url_mode: Literal["public", "presigned"] = "public"
+    # Base url of public media urls (e.g. cdn in front of the bucket), "<s3_endpoint_public>/<bucket>" by default
+    media_url_base: str | None = None
+    media_url_ttl: int = 86400
+    media_url_cache_size: int = 50000
+
     smtp_host: str = "127.0.0.1"
     smtp_port: int = 10025
     smtp_username: str | None = None
     smtp_password: str | None = None
+    smtp_pool_size: int = 4
+    smtp_max_pending: int = 256
 
     oauth_google_client_id: str = ""
     oauth_google_client_secret: str = ""
@@ -44,10 +87,34 @@ class _Config(BaseSettings):
 
     paypal_id: str = ""
     paypal_secret: str = ""
+    paypal_connect_timeout: float = 5
+    paypal_read_timeout: float = 20
+    paypal_max_connections: int = 16
+    paypal_keepalive_expiry: float = 60
+    # Retries of idempotent requests (and of requests that failed to connect), backoff doubles every attempt
+    paypal_retries: int = 2
+    paypal_retry_backoff: float = .5
 
     redis_host: str = "127.0.0.1"
     redis_port: int = 6379
 
+    rate_limit_enabled: bool = True
+    rate_limit_ip_header: str | None = None
+
+    duplicate_report_radius: int = 150
+    duplicate_report_minutes: int = 30
+
+    chat_push_window: int = 30
+    chat_email_delay: int = 60 * 15
+
+    outbox_embedded_worker: bool = False
+    outbox_concurrency: int = 8
+    outbox_poll_interval: float = 1
+    outbox_job_timeout: int = 60
+    outbox_max_attempts: int = 8
+    outbox_backoff_base: int = 10
+    outbox_backoff_max: int = 60 * 60
+
     @field_validator("jwt_key", mode="before")
     def decode_jwt_key(cls, value: str | bytes) -> bytes:
         if not isinstance(value, bytes) or len(value) != 16:
@@ -67,12 +134,39 @@ class _Config(BaseSettings):
 
 config = _Config()
 
-S3 = Client(config.s3_access_key_id, config.s3_access_secret_key, config.s3_endpoint)
-S3_PUBLIC = Client(config.s3_access_key_id, config.s3_access_secret_key, config.s3_endpoint_public)
-SMTP = SMTPClient(
+S3 = S3Client(config.s3_access_key_id, config.s3_access_secret_key, config.s3_endpoint)
+S3_PUBLIC = S3Client(config.s3_access_key_id, config.s3_access_secret_key, config.s3_endpoint_public)
+SMTP = SmtpPool(
     hostname=config.smtp_host,
     port=config.smtp_port,
     username=config.smtp_username,
     password=config.smtp_password,
+    size=config.smtp_pool_size,
+    max_pending=config.smtp_max_pending,
 )
-FCM = FCMClient(str(config.fcm_config_path))
\ No newline at end of file
+FCM = FCMClient(str(config.fcm_config_path))
+REDIS = Redis.from_url(str(config.redis_connection_string))
+
+
+def is_testing() -> bool:
+    return environ.get("KKP_TESTING") == "1"
+
+
+def setup_cache() -> None:
+    aiocache.caches.set_config({
+        "default": {
+            "cache": "aiocache.RedisCache",
+            "endpoint": config.redis_host,
+            "port": config.redis_port,
+            "serializer": {"class": "aiocache.serializers.JsonSerializer"},
+            "plugins": [],
+        },
+    })
+
+
+def orm_config() -> dict:
+    return generate_config(
+        config.db_connection_string,
+        app_modules={"models": ["kkp.models"]},
+        testing=is_testing(),
+    )
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import struct
+from array import array
+from typing import Iterable, Sequence
 
 from pypika_tortoise import CustomFunction
 from tortoise import fields
@@ -13,6 +15,7 @@ class Point:
     #  e.g. SRID (4 bytes) + BYTE ORDER (1 byte) + TYPE (4 bytes int) + X (8 bytes double) + Y (8 bytes double)
     #  https://dev.mysql.com/doc/refman/5.7/en/gis-data-formats.html
     MYSQL_GEOM_BIN_FMT = "<ibidd"
+    MYSQL_GEOM_BIN = struct.Struct(MYSQL_GEOM_BIN_FMT)
 
     __slots__ = ("lon", "lat",)
 
@@ -21,11 +24,11 @@ class Point:
         self.lat = lat
 
     def to_sql_wkb_bin(self) -> bytes:
-        return struct.pack(self.MYSQL_GEOM_BIN_FMT, 0, 1, 1, self.lon, self.lat)
+        return self.MYSQL_GEOM_BIN.pack(0, 1, 1, self.lon, self.lat)
 
     @classmethod
     def from_sql_wkb_bin(cls, wkb: bytes) -> Point:
-        _, _, _, lon, lat = struct.unpack(cls.MYSQL_GEOM_BIN_FMT, wkb)
+        _, _, _, lon, lat = cls.MYSQL_GEOM_BIN.unpack(wkb)
         return cls(lon, lat)
 
     def __repr__(self) -> str:
@@ -60,6 +63,29 @@ class PointField(fields.Field[Point]):
         return Point.from_sql_wkb_bin(value)
 
 
+def decode_points(values: Iterable[bytes | str]) -> array:
+    # Decodes many wkb points at once into flat lon/lat array ([lon0, lat0, lon1, lat1, ...])
+    #  without creating Point object for every value, result can be passed directly to kkp.utils.geo functions.
+    values = [value if isinstance(value, bytes) else bytes.fromhex(value) for value in values]
+    point_size = Point.MYSQL_GEOM_BIN.size
+    if any(len(value) != point_size for value in values):
+        raise FieldError("Invalid wkb point value.")
+
+    result = array("d")
+    for _, byte_order, _, lon, lat in Point.MYSQL_GEOM_BIN.iter_unpack(b"".join(values)):
+        if byte_order != 1:
+            raise FieldError(f"Unsupported byte order: '{byte_order}', only '1' is supported now.")
+        result.append(lon)
+        result.append(lat)
+
+    return result
+
+
+def encode_points(coords: Sequence[float]) -> list[bytes]:
+    pack = Point.MYSQL_GEOM_BIN.pack
+    return [pack(0, 1, 1, coords[i], coords[i + 1]) for i in range(0, len(coords) - 1, 2)]
+
+
 class STDistanceSphere(Function):
     database_func = CustomFunction("ST_Distance_Sphere", ["point_a", "point_b"])
 
@@ -1,10 +1,12 @@
 from typing import Annotated
 
-from fastapi import Header, Depends
+from fastapi import Header, Depends, Request, Response
 
 from kkp.models import Session, User, UserRole, Animal, AnimalReport, TreatmentReport, VetClinic, VolunteerRequest, \
     Media, DonationGoal
+from kkp.config import config
 from kkp.utils.custom_exception import CustomMessageException
+from kkp.utils.rate_limit import RateLimiter
 
 
 async def jwt_auth_session(
@@ -70,6 +72,32 @@ JwtMaybeAuthUserDepN = Depends(jwt_auth_user_maybe)
 JwtMaybeAuthUserDep = Annotated[User | None, JwtMaybeAuthUserDepN]
 
 
+def client_ip(request: Request) -> str:
+    if config.rate_limit_ip_header and (ip := request.headers.get(config.rate_limit_ip_header)):
+        return ip
+    return request.client.host if request.client is not None else "unknown"
+
+
+class RateLimitIp:
+    def __init__(self, name: str, capacity: int, period: int):
+        self._name = name
+        self._capacity = capacity
+        self._period = period
+
+    async def _hit(self, key: str, response: Response) -> None:
+        result = await RateLimiter.hit_or_raise(f"{self._name}:{key}", self._capacity, self._period)
+        if result is not None:
+            response.headers.update(result.headers())
+
+    async def __call__(self, request: Request, response: Response) -> None:
+        await self._hit(f"ip-{client_ip(request)}", response)
+
+
+class RateLimitUser(RateLimitIp):
+    async def __call__(self, request: Request, response: Response, user: JwtMaybeAuthUserDep) -> None:
+        await self._hit(f"user-{user.id}" if user is not None else f"ip-{client_ip(request)}", response)
+
+
 async def animal_dep(animal_id: int) -> Animal:
     if (animal := await Animal.get_or_none(id=animal_id)) is None:
         raise CustomMessageException("Unknown animal.", 404)
@@ -1,35 +1,50 @@
+from asyncio import create_task
 from contextlib import asynccontextmanager
-from os import environ
 
-import aiocache
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from httpx import RemoteProtocolError
+from s3lite.exceptions import S3Exception
 from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
-from tortoise import generate_config
 from tortoise.contrib.fastapi import RegisterTortoise
 
-from .config import config, S3, SMTP
+from .config import config, S3, SMTP, REDIS, setup_cache, orm_config, is_testing
 from .routes import auth, animals, media, users, subscriptions, animal_reports, admin, messages, treatment_reports, \
-    vet_clinics, volunteer_requests, donations
+    vet_clinics, volunteer_requests, donations, geofences
 from .utils.custom_exception import CustomMessageException
+from .utils.google_id_token import GOOGLE_CERTS
+from .utils.media_gc import MediaGc
+from .utils.media_processing import MediaProcessor
+from .utils.outbox import OutboxWorker
+from .utils.password import PasswordHasher
+from .utils.paypal import PayPal
 
 
 @asynccontextmanager
 async def migrate_and_connect_orm(app_: FastAPI):
+    # Public-read policy is needed only for unsigned media urls, in presigned mode
+    #  policy that was set while public mode was used is removed, so the bucket is actually private
     policy_retries = 3
     for i in range(policy_retries):
         try:
-            await S3.put_bucket_policy(config.s3_bucket_name, {
-                "Version": "2012-10-17",
-                "Statement": [{
-                    "Effect": "Allow",
-                    "Principal": {"AWS": ["*"]},
-                    "Action": ["s3:GetObject"],
-                    "Resource": [f"arn:aws:s3:::{config.s3_bucket_name}/*"]
-                }]
-            })
+            if config.media_url_mode == "public":
+                await S3.put_bucket_policy(config.s3_bucket_name, {
+                    "Version": "2012-10-17",
+                    "Statement": [{
+                        "Effect": "Allow",
+                        "Principal": {"AWS": ["*"]},
+                        "Action": ["s3:GetObject"],
+                        "Resource": [f"arn:aws:s3:::{config.s3_bucket_name}/*"]
+                    }]
+                })
+            else:
+                try:
+                    await S3.delete_bucket_policy(config.s3_bucket_name)
+                except S3Exception as e:
+                    # Policy was never set
+                    if e.code != "NoSuchBucketPolicy":
+                        raise
             break
         except RemoteProtocolError:  # pragma: no cover
             if i == policy_retries - 1:
@@ -38,31 +53,38 @@ async def migrate_and_connect_orm(app_: FastAPI):
             from asyncio import sleep
             await sleep(1)
 
-    aiocache.caches.set_config({
-        "default": {
-            "cache": "aiocache.RedisCache",
-            "endpoint": config.redis_host,
-            "port": config.redis_port,
-            "serializer": {"class": "aiocache.serializers.JsonSerializer"},
-            "plugins": [],
-        },
-    })
-
-    is_testing = environ.get("KKP_TESTING") == "1"
-    orm_config = generate_config(
-        config.db_connection_string,
-        app_modules={"models": ["kkp.models"]},
-        testing=is_testing,
-    )
+    setup_cache()
+    PayPal.open()
+
+    if config.oauth_google_client_id:
+        GOOGLE_CERTS.refresh()
 
     async with RegisterTortoise(
             app=app_,
-            config=orm_config,
+            config=orm_config(),
             generate_schemas=True,
-            _create_db=is_testing,
+            _create_db=is_testing(),
     ), SMTP:
+        # Outbox jobs are normally executed by separate worker process (kkp.worker),
+        #  embedded worker is used in tests and in small deployments
+        worker = worker_task = gc_task = None
+        if config.outbox_embedded_worker:
+            gc_task = create_task(MediaGc.supervise())
+            worker = OutboxWorker()
+            worker_task = create_task(worker.run())
+
         yield
 
+        if worker is not None:
+            gc_task.cancel()
+            worker.stop()
+            await worker_task
+
+    await REDIS.aclose()
+    await PayPal.close()
+    PasswordHasher.shutdown()
+    MediaProcessor.shutdown()
+
 
 app = FastAPI(
     lifespan=migrate_and_connect_orm,
@@ -91,6 +113,7 @@ app.include_router(treatment_reports.router)
 app.include_router(vet_clinics.router)
 app.include_router(volunteer_requests.router)
 app.include_router(donations.router)
+app.include_router(geofences.router)
 
 
 @app.get("/health", status_code=200)
@@ -116,4 +139,4 @@ async def validation_exception_handler(_, exc: RequestValidationError) -> JSONRe
 async def custom_message_exception_handler(_, exc: CustomMessageException) -> JSONResponse:
     return JSONResponse({
         "errors": exc.messages,
-    }, status_code=exc.status_code)
+    }, status_code=exc.status_code, headers=exc.headers)
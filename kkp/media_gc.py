@@ -0,0 +1,26 @@
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+
+from tortoise import Tortoise
+
+from .config import setup_cache, orm_config
+from .utils.media_gc import MediaGc
+
+
+async def run_media_gc(dry_run: bool, batch_size: int | None) -> None:
+    setup_cache()
+    await Tortoise.init(config=orm_config())
+    try:
+        stats = await MediaGc.run(dry_run=dry_run, batch_size=batch_size)
+        print(stats)
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Deletes orphaned media rows and their s3 objects")
+    parser.add_argument("--dry-run", action="store_true", help="only count orphaned media, do not delete anything")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    get_event_loop().run_until_complete(run_media_gc(args.dry_run, args.batch_size))
@@ -5,9 +5,12 @@ from .dialog import Dialog
 from .donation import Donation, DonationStatus
 from .donation_goal import DonationGoal
 from .external_auth import ExternalAuth, ExtAuthType
+from .geofence import Geofence, GeofenceCell, GeofenceType
 from .geo_point import GeoPoint
 from .media import Media, MediaType, MediaStatus
 from .message import Message
+from .notification_job import NotificationJob, NotificationJobStatus
+from .report_rollup import ReportRollup
 from .session import Session
 from .treatment_report import TreatmentReport, PayoutStatus
 from .user import User, UserRole
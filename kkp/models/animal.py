@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import IntEnum
+from typing import AsyncIterator
 
 from tortoise import fields
 
@@ -66,6 +67,33 @@ class Animal(CustomModel):
             "subscribed": subscribed,
         }
 
+    @classmethod
+    async def subscriber_ids(cls, animal_id: int, chunk_size: int) -> AsyncIterator[list[int]]:
+        """
+        Yields ids of users subscribed to animal in chunks (ordered by user id), read directly from m2m table,
+        so animals with a lot of subscribers do not load all of them at once.
+        """
+
+        subscriptions = models.User._meta.fields_map["subscriptions"]
+        db = cls._choose_db()
+        last_user_id = 0
+        while True:
+            rows = await db.execute_query_dict(f"""
+                SELECT `{subscriptions.backward_key}` `user_id` FROM `{subscriptions.through}`
+                WHERE `{subscriptions.forward_key}`=%s AND `{subscriptions.backward_key}`>%s
+                ORDER BY `{subscriptions.backward_key}`
+                LIMIT %s
+            """, [animal_id, last_user_id, chunk_size])
+            if not rows:
+                return
+
+            user_ids = [row["user_id"] for row in rows]
+            yield user_ids
+
+            if len(rows) < chunk_size:
+                return
+            last_user_id = user_ids[-1]
+
     def cache_key(self) -> str:
         return f"animal-{self.id}"
 
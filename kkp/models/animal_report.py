@@ -18,10 +18,14 @@ class AnimalReport(CustomModel):
     notes: str = fields.TextField(default="")
     media: fields.ManyToManyRelation[models.Media] = fields.ManyToManyField("models.Media")
     location: models.GeoPoint = fields.ForeignKeyField("models.GeoPoint")
+    duplicate_of: AnimalReport | None = fields.ForeignKeyField(
+        "models.AnimalReport", null=True, default=None, related_name="duplicates", on_delete=fields.SET_NULL,
+    )
 
     reported_by: int | None
     assigned_to: int | None
     location: int
+    duplicate_of_id: int | None
 
     @Cache.decorator()
     async def to_json(self) -> dict:
@@ -39,6 +43,7 @@ class AnimalReport(CustomModel):
                 for media in await self.media.all()
             ],
             "location": self.location.to_json(),
+            "duplicate_of": self.duplicate_of_id,
         }
 
     def cache_key(self) -> str:
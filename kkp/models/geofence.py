@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from datetime import datetime
+from enum import IntEnum
+
+from tortoise import Model, fields
+
+from kkp import models
+from kkp.utils.geo import geohash_cover, circle_bbox, polygon_bbox, polygon_contains, haversine, geohash_encode, \
+    geohash_prefixes
+
+
+class GeofenceType(IntEnum):
+    CIRCLE = 1
+    POLYGON = 2
+
+
+class Geofence(Model):
+    id: int = fields.BigIntField(pk=True)
+    user: models.User = fields.ForeignKeyField("models.User")
+    name: str = fields.CharField(max_length=128, default="")
+    type: GeofenceType = fields.IntEnumField(GeofenceType)
+    latitude: float = fields.FloatField()
+    longitude: float = fields.FloatField()
+    radius: int = fields.IntField(default=0)
+    polygon: list[list[float]] | None = fields.JSONField(null=True, default=None)
+    created_at: datetime = fields.DatetimeField(auto_now_add=True)
+
+    user_id: int
+
+    def bbox(self) -> tuple[float, float, float, float]:
+        if self.type is GeofenceType.POLYGON:
+            return polygon_bbox(self.polygon)
+        return circle_bbox(self.latitude, self.longitude, self.radius)
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        if self.type is GeofenceType.POLYGON:
+            return polygon_contains(self.polygon, latitude, longitude)
+        return haversine(self.longitude, self.latitude, (longitude, latitude))[0] < self.radius
+
+    async def index_cells(self) -> None:
+        await GeofenceCell.bulk_create([
+            GeofenceCell(geofence=self, cell=cell)
+            for cell in geohash_cover(*self.bbox())
+        ])
+
+    @classmethod
+    async def get_matching(cls, latitude: float, longitude: float) -> list[Geofence]:
+        # Every geofence is indexed by geohash cells (of different precisions) that cover it,
+        #  so candidates are geofences whose cells are prefixes of point's geohash
+        cells = geohash_prefixes(geohash_encode(latitude, longitude))
+        geofence_ids = await GeofenceCell.filter(cell__in=cells).distinct().values_list("geofence_id", flat=True)
+        if not geofence_ids:
+            return []
+
+        return [
+            geofence
+            for geofence in await cls.filter(id__in=geofence_ids)
+            if geofence.contains(latitude, longitude)
+        ]
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "type": self.type,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "radius": self.radius,
+            "polygon": [
+                {"latitude": lat, "longitude": lon}
+                for lat, lon in self.polygon
+            ] if self.polygon is not None else None,
+            "created_at": int(self.created_at.timestamp()),
+        }
+
+
+class GeofenceCell(Model):
+    id: int = fields.BigIntField(pk=True)
+    geofence: Geofence = fields.ForeignKeyField("models.Geofence", related_name="cells")
+    cell: str = fields.CharField(max_length=12, index=True)
+
+    geofence_id: int
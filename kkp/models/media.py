@@ -2,12 +2,14 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import IntEnum
+from math import ceil
 from uuid import UUID, uuid4
 
 from tortoise import Model, fields
 
 from kkp import models
 from kkp.config import S3_PUBLIC, config
+from kkp.utils.media_urls import MediaUrls
 
 
 class MediaType(IntEnum):
@@ -26,18 +28,58 @@ class Media(Model):
     uploaded_by: models.User | None = fields.ForeignKeyField("models.User", null=True, default=None)
     type: MediaType = fields.IntEnumField(MediaType)
     status: MediaStatus = fields.IntEnumField(MediaStatus, default=MediaStatus.CREATED)
-    media_id: UUID = fields.UUIDField(default=uuid4)
+    # Media with the same content share media_id and therefore s3 objects
+    media_id: UUID = fields.UUIDField(default=uuid4, index=True)
+    size: int | None = fields.BigIntField(null=True, default=None)
+    sha256: str | None = fields.CharField(max_length=64, null=True, default=None, index=True)
+    # Id of s3 multipart upload, set until upload is finalized
+    upload_id: str | None = fields.CharField(max_length=256, null=True, default=None)
+    content_type: str | None = fields.CharField(max_length=64, null=True, default=None)
+    width: int | None = fields.IntField(null=True, default=None)
+    height: int | None = fields.IntField(null=True, default=None)
+    # Widths of generated resized variants (see kkp.utils.media_processing)
+    variants: list[int] = fields.JSONField(default=list)
+    # Data uri of tiny blurred version of photo that can be shown while photo is loading
+    placeholder: str | None = fields.CharField(max_length=1024, null=True, default=None)
+    # 64-bit difference hash of photo and its 16-bit chunks used for similarity lookups (see kkp.utils.phash)
+    phash: int | None = fields.BigIntField(null=True, default=None)
+    phash_0: int | None = fields.IntField(null=True, default=None, index=True)
+    phash_1: int | None = fields.IntField(null=True, default=None, index=True)
+    phash_2: int | None = fields.IntField(null=True, default=None, index=True)
+    phash_3: int | None = fields.IntField(null=True, default=None, index=True)
 
     def upload_url(self, ttl: int = 60 * 60) -> str:
         return S3_PUBLIC.share(config.s3_bucket_name, self.object_key(), ttl, True)
 
+    def parts_count(self) -> int:
+        return max(ceil(self.size / config.multipart_part_size), 1)
+
     def object_key(self) -> str:
         return f"{self.type.name.lower()}s/{self.media_id}"
 
+    def variant_key(self, width: int) -> str:
+        return f"variants/{self.media_id}/{width}.webp"
+
+    def object_keys(self) -> list[str]:
+        return [self.object_key(), *(self.variant_key(width) for width in self.variants or [])]
+
+    async def objects_shared(self) -> bool:
+        return await Media.filter(media_id=self.media_id).exclude(id=self.id).exists()
+
     def to_json(self) -> dict:
         return {
             "id": self.id,
             "uploaded_at": int(self.uploaded_at.timestamp()),
             "type": self.type,
-            "url": S3_PUBLIC.share(config.s3_bucket_name, self.object_key()),
+            "url": MediaUrls.get(self.object_key()),
+            "width": self.width,
+            "height": self.height,
+            "placeholder": self.placeholder,
+            "variants": [
+                {
+                    "width": width,
+                    "url": MediaUrls.get(self.variant_key(width)),
+                }
+                for width in sorted(self.variants or [])
+            ],
         }
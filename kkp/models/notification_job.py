@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from datetime import datetime
+from enum import IntEnum
+
+from tortoise import Model, fields
+
+
+class NotificationJobStatus(IntEnum):
+    PENDING = 0
+    RUNNING = 1
+    DEAD = 2
+
+
+class NotificationJob(Model):
+    id: int = fields.BigIntField(pk=True)
+    task: str = fields.CharField(max_length=64)
+    payload: dict = fields.JSONField(default=dict)
+    status: NotificationJobStatus = fields.IntEnumField(NotificationJobStatus, default=NotificationJobStatus.PENDING)
+    attempts: int = fields.IntField(default=0)
+    # For pending jobs - time when job should be executed,
+    #  for running jobs - time when job is considered abandoned (e.g. worker was killed) and can be claimed again
+    run_at: datetime = fields.DatetimeField()
+    created_at: datetime = fields.DatetimeField(auto_now_add=True)
+    last_error: str | None = fields.TextField(null=True, default=None)
+
+    class Meta:
+        indexes = (
+            ("status", "run_at"),
+        )
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime, date
+
+from pytz import UTC
+from tortoise import Model, fields
+from tortoise.transactions import in_transaction
+
+from kkp import models
+from kkp.utils.geo import geohash_encode
+
+
+class ReportRollup(Model):
+    PRECISION = 6
+
+    id: int = fields.BigIntField(pk=True)
+    day: date = fields.DateField()
+    cell: str = fields.CharField(max_length=PRECISION)
+    reports: int = fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (
+            ("day", "cell"),
+        )
+
+    @classmethod
+    def _day_and_cell(cls, latitude: float, longitude: float, created_at: datetime) -> tuple[date, str]:
+        day = datetime.fromtimestamp(created_at.timestamp(), UTC).date()
+        return day, geohash_encode(latitude, longitude, cls.PRECISION)
+
+    @classmethod
+    async def increment(cls, latitude: float, longitude: float, created_at: datetime, delta: int = 1) -> None:
+        day, cell = cls._day_and_cell(latitude, longitude, created_at)
+
+        db = cls._choose_db(True)
+        await db.execute_query(f"""
+            INSERT INTO `{cls._meta.db_table}` (`day`, `cell`, `reports`) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE `reports` = GREATEST(`reports` + %s, 0)
+        """, [day, cell, max(delta, 0), delta])
+
+    @classmethod
+    async def rebuild(cls, batch_size: int = 1000) -> int:
+        """
+        Recomputes all rollups from existing animal reports (e.g. reports created before rollups were added).
+        Reports that are created while it runs may be missed, so it should be run while api is stopped.
+        Returns number of rollup rows.
+        """
+
+        counts: dict[tuple[date, str], int] = defaultdict(int)
+        last_id = 0
+        while True:
+            reports = await models.AnimalReport.filter(
+                id__gt=last_id, duplicate_of=None,
+            ).order_by("id").limit(batch_size).select_related("location")
+            for report in reports:
+                counts[cls._day_and_cell(report.location.latitude, report.location.longitude, report.created_at)] += 1
+
+            if len(reports) < batch_size:
+                break
+            last_id = reports[-1].id
+
+        async with in_transaction():
+            await cls.all().delete()
+            await cls.bulk_create([
+                cls(day=day, cell=cell, reports=count)
+                for (day, cell), count in counts.items()
+            ], batch_size=batch_size)
+
+        return len(counts)
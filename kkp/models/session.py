@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 from os import urandom
+from time import time
 from typing import Any
 
 from pytz import UTC
@@ -10,8 +11,9 @@ from tortoise.contrib.mysql.indexes import SpatialIndex
 from tortoise.models import MODEL
 
 from kkp import models
-from kkp.config import config
+from kkp.config import config, REDIS
 from kkp.db.point import PointField, Point
+from kkp.utils.cache import Cache
 from kkp.utils.jwt import JWT
 
 
@@ -28,6 +30,8 @@ class Session(Model):
     location: Point = PointField()
     location_time: datetime = fields.DatetimeField()
 
+    user_id: int
+
     class Meta:
         indexes = [
             SpatialIndex(fields=("location",))
@@ -44,6 +48,17 @@ class Session(Model):
         return await super().create(using_db=using_db, **kwargs)
 
     def to_jwt(self) -> str:
+        if config.jwt_refresh_tokens:
+            return JWT.encode(
+                {
+                    "u": self.user_id,
+                    "s": self.id,
+                    "t": "access",
+                },
+                config.jwt_key,
+                expires_in=config.jwt_access_ttl,
+            )
+
         return JWT.encode(
             {
                 "u": self.user.id,
@@ -54,6 +69,32 @@ class Session(Model):
             expires_in=config.jwt_ttl,
         )
 
+    def to_refresh_jwt(self) -> str:
+        return JWT.encode(
+            {
+                "u": self.user_id,
+                "s": self.id,
+                "n": self.nonce,
+                "t": "refresh",
+            },
+            config.jwt_key,
+            expires_in=config.jwt_ttl,
+        )
+
+    def to_token_response(self) -> dict:
+        if not config.jwt_refresh_tokens:
+            return {
+                "token": self.to_jwt(),
+                "expires_at": int(time() + config.jwt_ttl),
+            }
+
+        return {
+            "token": self.to_jwt(),
+            "expires_at": int(time() + config.jwt_access_ttl),
+            "refresh_token": self.to_refresh_jwt(),
+            "refresh_expires_at": int(time() + config.jwt_ttl),
+        }
+
     @classmethod
     async def from_jwt(cls, token: str) -> Session | None:
         if (payload := JWT.decode(token, config.jwt_key)) is None:
@@ -62,9 +103,102 @@ class Session(Model):
             return None
         if "u" not in payload or not isinstance(payload["u"], int):
             return None
+        if payload.get("t") == "access":
+            return await cls._from_access_payload(payload)
+        if "t" in payload:
+            return None
         if "n" not in payload or not isinstance(payload["n"], str):
             return None
 
-        return await Session.get_or_none(
+        # Session and user rows are cached in user's namespace,
+        #  so every Cache.delete_obj(user) (and every User.save) also invalidates user's sessions
+        cache_ns, cache_key = cls._auth_cache_key(payload["u"], payload["s"], payload["n"])
+        if (cached := await Cache.get(cache_ns, cache_key)) is not None:
+            return cls._from_auth_cache(cached)
+
+        session = await Session.get_or_none(
             id=payload["s"], user__id=payload["u"], nonce=payload["n"]
-        ).select_related("user")
\ No newline at end of file
+        ).select_related("user")
+        if session is not None:
+            await Cache.set(cache_ns, cache_key, session._to_auth_cache(), config.session_cache_ttl)
+
+        return session
+
+    @classmethod
+    async def _from_access_payload(cls, payload: dict) -> Session | None:
+        # Access tokens of logged out sessions are found in denylist of revoked sessions. Other removed sessions
+        #  (e.g. deleted with the user) are not found in session table, cached entry is dropped
+        #  with user's cache namespace by User.delete.
+        if not config.jwt_refresh_tokens or await REDIS.exists(cls._revoked_key(payload["s"])):
+            return None
+
+        cache_ns, cache_key = cls._access_cache_key(payload["u"], payload["s"])
+        if (cached := await Cache.get(cache_ns, cache_key)) is not None:
+            return cls._from_auth_cache(cached)
+
+        session = await Session.get_or_none(id=payload["s"], user__id=payload["u"]).select_related("user")
+        if session is not None:
+            await Cache.set(cache_ns, cache_key, session._to_auth_cache(), config.session_cache_ttl)
+
+        return session
+
+    @staticmethod
+    def _revoked_key(session_id: int) -> str:
+        return f"revoked-session-{session_id}"
+
+    @staticmethod
+    def _auth_cache_key(user_id: int, session_id: int, nonce: str) -> tuple[str, str]:
+        return f"user-{user_id}", f"session-{session_id}-{nonce}"
+
+    @staticmethod
+    def _access_cache_key(user_id: int, session_id: int) -> tuple[str, str]:
+        return f"user-{user_id}", f"access-session-{session_id}"
+
+    def _to_auth_cache(self) -> dict:
+        return {
+            "session": {
+                "id": self.id,
+                "nonce": self.nonce,
+                "active": self.active,
+                "created_at": self.created_at.timestamp(),
+            },
+            "user": _user_to_row(self.user),
+        }
+
+    @classmethod
+    def _from_auth_cache(cls, data: dict) -> Session:
+        user = models.User._init_from_db(**data["user"])
+        session_data = data["session"]
+        # Only columns needed for authentication are cached, so session is partial
+        #  and must be saved with update_fields
+        session = cls._init_from_db(
+            id=session_data["id"],
+            user_id=user.id,
+            nonce=session_data["nonce"],
+            active=session_data["active"],
+            created_at=datetime.fromtimestamp(session_data["created_at"], UTC),
+        )
+        session.user = user
+        return session
+
+    async def invalidate_auth_cache(self) -> None:
+        await Cache.delete(*self._auth_cache_key(self.user_id, self.id, self.nonce))
+        await Cache.delete(*self._access_cache_key(self.user_id, self.id))
+
+    async def revoke(self) -> None:
+        """Drops cached session and makes already issued access tokens of this session invalid."""
+        await self.invalidate_auth_cache()
+        if config.jwt_refresh_tokens:
+            await REDIS.set(self._revoked_key(self.id), 1, ex=config.jwt_access_ttl)
+
+
+# Only columns needed for authentication and permission checks are cached, password hash and mfa key never leave
+#  the database, users created from cache are partial and load other columns with User.load_fields
+_AUTH_USER_FIELDS = ("id", "first_name", "last_name", "email", "role")
+
+
+def _user_to_row(user: models.User) -> dict:
+    return {
+        user._meta.fields_db_projection[field]: user._meta.fields_map[field].to_db_value(getattr(user, field), user)
+        for field in _AUTH_USER_FIELDS
+    }
\ No newline at end of file
@@ -2,11 +2,11 @@ from __future__ import annotations
 
 from enum import IntEnum
 
-import bcrypt
 from tortoise import Model, fields
 
 from kkp import models
 from kkp.utils.cache import Cache
+from kkp.utils.password import PasswordHasher
 
 
 class UserRole(IntEnum):
@@ -30,13 +30,39 @@ class User(Model):
     viber_phone: str | None = fields.CharField(max_length=64, null=True, default=None)
     whatsapp_phone: str | None = fields.CharField(max_length=64, null=True, default=None)
 
-    def check_password(self, password: str) -> bool:
+    async def save(self, *args, **kwargs) -> None:
+        await super().save(*args, **kwargs)
+        # Cached json and authentication data (see Session.from_jwt) are dropped on every change of the row,
+        #  changes made with queryset .update() must call Cache.delete_obj themselves
+        await Cache.delete_obj(self)
+
+    async def delete(self, *args, **kwargs) -> None:
+        await super().delete(*args, **kwargs)
+        await Cache.delete_obj(self)
+
+    async def load_fields(self) -> None:
+        """Loads all columns of user that was authenticated from cache (only some columns are cached)."""
+
+        if self._partial:
+            await self.refresh_from_db()
+            self._partial = False
+
+    async def check_password(self, password: str) -> bool:
+        await self.load_fields()
         if self.password is None:
             return False
-        return bcrypt.checkpw(password.encode("utf8"), self.password.encode("utf8"))
+        if not await PasswordHasher.verify(password, self.password):
+            return False
+
+        if PasswordHasher.needs_rehash(self.password):
+            self.password = await PasswordHasher.hash(password)
+            await self.save(update_fields=["password"])
+
+        return True
 
     @Cache.decorator(key_suffix="basic")
     async def to_json_base(self) -> dict:
+        await self.load_fields()
         photo = await models.UserProfilePhoto.get_or_none(user=self).select_related("photo")
 
         return {
@@ -51,6 +77,7 @@ class User(Model):
 
     @Cache.decorator(key_suffix="full")
     async def to_json(self) -> dict:
+        await self.load_fields()
         photo = await models.UserProfilePhoto.get_or_none(user=self).select_related("photo")
 
         return {
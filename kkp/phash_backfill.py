@@ -0,0 +1,25 @@
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+
+from tortoise import Tortoise
+
+from .config import orm_config
+from .utils.media_processing import MediaProcessor
+
+
+async def run_phash_backfill(batch_size: int) -> None:
+    await Tortoise.init(config=orm_config())
+    try:
+        hashed, failed = await MediaProcessor.backfill_phash(batch_size=batch_size)
+        print(f"Computed perceptual hashes of {hashed} photos, {failed} failed")
+    finally:
+        await Tortoise.close_connections()
+        MediaProcessor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Computes perceptual hashes of photos uploaded before they were introduced")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    get_event_loop().run_until_complete(run_phash_backfill(args.batch_size))
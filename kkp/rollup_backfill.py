@@ -0,0 +1,24 @@
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+
+from tortoise import Tortoise
+
+from .config import orm_config
+from .models import ReportRollup
+
+
+async def run_rollup_backfill(batch_size: int) -> None:
+    await Tortoise.init(config=orm_config())
+    try:
+        rows = await ReportRollup.rebuild(batch_size=batch_size)
+        print(f"Rebuilt {rows} report rollup rows")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Rebuilds daily report rollups (heatmap and timeline) from existing reports")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    get_event_loop().run_until_complete(run_rollup_backfill(args.batch_size))
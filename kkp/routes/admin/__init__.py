@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 
 from kkp.routes.admin import users, animals, vet_clinics, volunteer_requests, animal_reports, treatment_reports, media, \
-    donations
+    donations, report_stats
 
 router = APIRouter(prefix="/admin")
 router.include_router(users.router)
@@ -12,3 +12,4 @@ router.include_router(animal_reports.router)
 router.include_router(treatment_reports.router)
 router.include_router(media.router)
 router.include_router(donations.router)
+router.include_router(report_stats.router)
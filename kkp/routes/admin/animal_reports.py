@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Query
+from tortoise.transactions import in_transaction
 
 from kkp.dependencies import JwtAuthAdminDepN, AnimalReportDep
-from kkp.models import AnimalReport, User
+from kkp.models import AnimalReport, User, ReportRollup
 from kkp.schemas.admin.animal_reports import EditAnimalReportRequest, AnimalReportsQuery
 from kkp.schemas.animal_reports import AnimalReportInfo
 from kkp.schemas.common import PaginationResponse
@@ -69,5 +70,16 @@ async def edit_animal_report(report: AnimalReportDep, data: EditAnimalReportRequ
 
 @router.delete("/{report_id}", status_code=204)
 async def delete_animal_report(report: AnimalReportDep):
+    location = await report.location
     await Cache.delete_obj(report)
-    await report.delete()
\ No newline at end of file
+    async with in_transaction():
+        # Duplicates are not counted in rollups, but they become standalone reports (duplicate_of is set to null)
+        #  when original report is deleted, so they are counted instead of it
+        duplicates = await AnimalReport.filter(duplicate_of=report).select_for_update().select_related("location")
+        await report.delete()
+        if report.duplicate_of_id is None:
+            await ReportRollup.increment(location.latitude, location.longitude, report.created_at, -1)
+        for duplicate in duplicates:
+            await ReportRollup.increment(
+                duplicate.location.latitude, duplicate.location.longitude, duplicate.created_at,
+            )
\ No newline at end of file
@@ -50,7 +50,8 @@ async def get_media(media: AdminMediaDep):
 @router.delete("/{media_id}", status_code=204)
 async def delete_media(media: AdminMediaDep):
     try:
-        await S3.delete_object(config.s3_bucket_name, media.object_key())
+        if not await media.objects_shared():
+            await S3.delete_objects(config.s3_bucket_name, media.object_keys())
     except S3Exception as e:
         logger.opt(exception=e).warning(f"Failed to delete s3 object for media with {media.id!r} ({media.media_id!r})")
     await media.delete()
\ No newline at end of file
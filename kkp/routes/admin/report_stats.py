@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Query
+from pytz import UTC
+
+from kkp.dependencies import JwtAuthVetAdminDepN
+from kkp.models import ReportRollup
+from kkp.schemas.admin.report_stats import HeatmapQuery, HeatmapCellInfo, ReportStatsQuery, TimelineDayInfo
+from kkp.utils.custom_exception import CustomMessageException
+from kkp.utils.geo import GEOHASH_ALPHABET, geohash_decode
+
+router = APIRouter(prefix="/report-stats", dependencies=[JwtAuthVetAdminDepN])
+
+
+def _stats_filter(query: ReportStatsQuery) -> tuple[str, list]:
+    end = query.end or datetime.now(UTC).date()
+    start = query.start or (end - timedelta(days=30))
+    if start > end:
+        raise CustomMessageException("Start date must be before end date.", 400)
+    if (end - start).days > 366 * 2:
+        raise CustomMessageException("Date range is too big.", 400)
+    if len(query.prefix) > ReportRollup.PRECISION or any(char not in GEOHASH_ALPHABET for char in query.prefix):
+        raise CustomMessageException("Invalid cell prefix.", 400)
+
+    # Prefix consists only of geohash characters, so it can not contain LIKE wildcards
+    return "`day` BETWEEN %s AND %s AND `cell` LIKE %s", [start, end, f"{query.prefix}%"]
+
+
+@router.get("/heatmap", response_model=list[HeatmapCellInfo])
+async def get_reports_heatmap(query: HeatmapQuery = Query()):
+    precision = min(max(query.precision, 1), ReportRollup.PRECISION)
+    where, params = _stats_filter(query)
+
+    db = ReportRollup._choose_db()
+    rows = await db.execute_query_dict(f"""
+        SELECT LEFT(`cell`, %s) `prefix`, SUM(`reports`) `count`
+        FROM `{ReportRollup._meta.db_table}`
+        WHERE {where}
+        GROUP BY `prefix`
+        HAVING `count` > 0
+        ORDER BY `count` DESC
+        LIMIT 10000
+    """, [precision, *params])
+
+    result = []
+    for row in rows:
+        latitude, longitude = geohash_decode(row["prefix"])
+        result.append({
+            "cell": row["prefix"],
+            "latitude": latitude,
+            "longitude": longitude,
+            "count": int(row["count"]),
+        })
+
+    return result
+
+
+@router.get("/timeline", response_model=list[TimelineDayInfo])
+async def get_reports_timeline(query: ReportStatsQuery = Query()):
+    where, params = _stats_filter(query)
+
+    db = ReportRollup._choose_db()
+    rows = await db.execute_query_dict(f"""
+        SELECT `day`, SUM(`reports`) `count`
+        FROM `{ReportRollup._meta.db_table}`
+        WHERE {where}
+        GROUP BY `day`
+        ORDER BY `day`
+    """, params)
+
+    return [
+        {"day": row["day"], "count": int(row["count"])}
+        for row in rows
+    ]
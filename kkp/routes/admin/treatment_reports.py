@@ -11,7 +11,8 @@ from kkp.schemas.common import PaginationResponse
 from kkp.schemas.treatment_reports import TreatmentReportInfo
 from kkp.utils.cache import Cache
 from kkp.utils.custom_exception import CustomMessageException
-from kkp.utils.notification_util import send_notification
+from kkp.utils.notification_tasks import send_payout_approved_notification
+from kkp.utils.outbox import Outbox
 from kkp.utils.payouts import check_payout_maybe
 from kkp.utils.paypal import PayPal
 
@@ -83,11 +84,10 @@ async def create_treatment_report_payout(report: AdminTreatmentReportDep):
     report.payout_status = report_for_update.payout_status
     report.payout_last_checked = report_for_update.payout_last_checked
 
-    await send_notification(
-        await report.report.assigned_to,
-        "Payout approved",
-        "Payout for animal treatment report was approved",
-    )
+    # Payout is already created, so notification failures must not fail the request. Email and push are sent
+    #  by separate jobs, so failed email is retried without sending push again
+    await Outbox.enqueue(send_payout_approved_notification, treatment_report_id=report.id, fcm=False)
+    await Outbox.enqueue(send_payout_approved_notification, treatment_report_id=report.id, email=False)
 
     Cache.disable()
     return await report.to_json()
\ No newline at end of file
@@ -1,20 +1,26 @@
 from datetime import datetime
-from typing import Literal, cast
 
-from fastapi import APIRouter, Query, BackgroundTasks
+from fastapi import APIRouter, Query
 from pytz import UTC
 
 from kkp.dependencies import JwtAuthAdminDepN, AdminVolunteerRequestDep
-from kkp.models import UserRole, VolRequestStatus, VolunteerRequest, User
+from kkp.models import UserRole, VolRequestStatus, VolunteerRequest
 from kkp.schemas.admin.volunteer_requests import VolReqPaginationQuery, ApproveRejectVolunteerRequest
 from kkp.schemas.common import PaginationResponse
 from kkp.schemas.volunteer_requests import VolunteerRequestInfo
 from kkp.utils.cache import Cache
-from kkp.utils.notification_util import send_notification
+from kkp.utils.notification_tasks import send_volunteer_request_notification
+from kkp.utils.outbox import Outbox
 
 router = APIRouter(prefix="/volunteer-requests", dependencies=[JwtAuthAdminDepN])
 
 
+async def _notify(vol_request: VolunteerRequest) -> None:
+    # Email and push are sent by separate jobs, so failed email is retried without sending push again
+    await Outbox.enqueue(send_volunteer_request_notification, volunteer_request_id=vol_request.id, fcm=False)
+    await Outbox.enqueue(send_volunteer_request_notification, volunteer_request_id=vol_request.id, email=False)
+
+
 @router.get("", response_model=PaginationResponse[VolunteerRequestInfo])
 async def get_volunteer_requests(query: VolReqPaginationQuery = Query()):
     req_query = VolunteerRequest.filter()
@@ -50,20 +56,9 @@ async def get_volunteer_request(vol_request: AdminVolunteerRequestDep):
     return await vol_request.to_json()
 
 
-async def _send_approve_reject_notification(user: User, type_: Literal["approved", "rejected"], comment: str) -> None:
-    await send_notification(
-        user,
-        f"Volunteer request {type_}",
-        (
-                f"Your volunteer request has been {type_}!\n"
-                + (f"Comment: \n{comment}" if comment else "")
-        ),
-    )
-
-
 @router.post("/{volunteer_request_id}/approve", response_model=VolunteerRequestInfo)
 async def approve_volunteer_request(
-        vol_request: AdminVolunteerRequestDep, data: ApproveRejectVolunteerRequest, bg: BackgroundTasks,
+        vol_request: AdminVolunteerRequestDep, data: ApproveRejectVolunteerRequest,
 ):
     if vol_request.user.role < UserRole.VOLUNTEER:
         vol_request.user.role = UserRole.VOLUNTEER
@@ -90,17 +85,14 @@ async def approve_volunteer_request(
         await vol_request.user.save(update_fields=update_user)
         await Cache.delete_obj(vol_request.user)
 
-    bg.add_task(
-        _send_approve_reject_notification,
-        vol_request.user, cast("approved", Literal["approved"]), vol_request.review_text,
-    )
+    await _notify(vol_request)
 
     return await vol_request.to_json()
 
 
 @router.post("/{volunteer_request_id}/reject", response_model=VolunteerRequestInfo)
 async def reject_volunteer_request(
-        vol_request: AdminVolunteerRequestDep, data: ApproveRejectVolunteerRequest, bg: BackgroundTasks,
+        vol_request: AdminVolunteerRequestDep, data: ApproveRejectVolunteerRequest,
 ):
     vol_request.status = VolRequestStatus.REFUSED
     vol_request.review_text = data.text
@@ -108,9 +100,6 @@ async def reject_volunteer_request(
     await vol_request.save(update_fields=["status", "review_text", "reviewed_at"])
     await Cache.delete_obj(vol_request)
 
-    bg.add_task(
-        _send_approve_reject_notification,
-        vol_request.user, cast("rejected", Literal["rejected"]), vol_request.review_text,
-    )
+    await _notify(vol_request)
 
     return await vol_request.to_json()
\ No newline at end of file
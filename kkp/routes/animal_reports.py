@@ -1,72 +1,56 @@
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Query, BackgroundTasks
+from fastapi import APIRouter, Query, Depends
 from loguru import logger
 from pytz import UTC
 from tortoise.expressions import RawSQL
 from tortoise.transactions import in_transaction
 
-from kkp.config import FCM
 from kkp.db.point import Point, mbr_contains_sql
-from kkp.dependencies import JwtAuthVetDep, AnimalReportDep, JwtAuthVetDepN, JwtMaybeAuthUserDep
-from kkp.models import Animal, Media, AnimalStatus, GeoPoint, AnimalReport, UserRole, Session, MediaStatus, \
-    AnimalUpdate, AnimalUpdateType
+from kkp.dependencies import JwtAuthVetDep, AnimalReportDep, JwtAuthVetDepN, JwtMaybeAuthUserDep, RateLimitUser
+from kkp.models import Animal, Media, AnimalStatus, GeoPoint, AnimalReport, UserRole, MediaStatus, AnimalUpdate, \
+    AnimalUpdateType, ReportRollup
 from kkp.schemas.animal_reports import CreateAnimalReportsRequest, AnimalReportInfo, RecentReportsQuery, \
     MyAnimalReportsQuery
 from kkp.schemas.common import PaginationResponse
 from kkp.utils.cache import Cache
 from kkp.utils.custom_exception import CustomMessageException
+from kkp.utils.notification_tasks import send_animal_report_notification, send_animal_report_geofence_notification, \
+    send_animal_update_notification
+from kkp.utils.outbox import Outbox
+from kkp.utils.recent_reports import RecentReportsIndex
+from kkp.utils.timelines import SubscriptionTimeline
 
 router = APIRouter(prefix="/animal-reports")
 
 
-async def _send_notification_task(report: AnimalReport) -> None:
-    animal = report.animal
-    location = report.location
-
-    point = location.point
-    point_wkb = point.to_sql_wkb_bin().hex()
-    radius_m = 25000
-    before_time = int((datetime.now(UTC) - timedelta(days=14)).timestamp())
-
-    sessions = await Session.raw(f"""
-            SELECT 
-                `session`.`nonce`,`session`.`active`,`session`.`user_id`,`session`.`created_at`,`session`.`location`,
-                `session`.`location_time`,`session`.`fcm_token`,`session`.`id`,`session`.`fcm_token_time`,
-                ST_Distance_Sphere(`session`.`location`, x'{point_wkb}') `dist`
-            FROM `session`
-            LEFT OUTER JOIN `user` `session__user` ON `session__user`.`id`=`session`.`user_id`
-            WHERE {mbr_contains_sql(point, radius_m, 'location')} 
-                AND `session`.`location_time` > FROM_UNIXTIME({before_time}) 
-                AND `session`.`fcm_token` IS NOT NULL 
-                AND `session__user`.`role` IN ({UserRole.VET.value}, {UserRole.VOLUNTEER.value})
-            HAVING `dist` < {radius_m} 
-        """)
-
-    for session in sessions:  # pragma: no cover
-        try:
-            await FCM.send_notification(
-                "New animal needs your help!",
-                f"Name: {animal.name}\nBreed: {animal.breed}\nNotes: {report.notes}",
-                device_token=session.fcm_token,
-            )
-        except Exception as e:
-            logger.opt(exception=e).warning(
-                f"Failed to send notification to session {session.id} ({session.fcm_token!r})"
-            )
-
-
-@router.post("", response_model=AnimalReportInfo)
-async def create_animal_report(user: JwtMaybeAuthUserDep, data: CreateAnimalReportsRequest, bg: BackgroundTasks):
+@router.post("", response_model=AnimalReportInfo, dependencies=[Depends(RateLimitUser("animal-reports", 10, 60 * 10))])
+async def create_animal_report(user: JwtMaybeAuthUserDep, data: CreateAnimalReportsRequest):
     location = await GeoPoint.get_near(data.latitude, data.longitude)
     if location is None:
         location = await GeoPoint.create(name=None, latitude=data.latitude, longitude=data.longitude)
 
+    # Reports made by different people within short time and distance are flagged as probable duplicates
+    #  of the first one, notifications are sent only for the first one. Report is attached to the animal
+    #  of the first report only if client asks for it, otherwise submitted animal data is used
+    duplicate = None
+    duplicate_animal = None
+    if data.animal_id is None and data.name is not None and data.breed is not None:
+        duplicate = await RecentReportsIndex.find_duplicate(
+            data.latitude, data.longitude, exclude_reporter_id=user.id if user is not None else None,
+        )
+        if duplicate is not None and not await AnimalReport.filter(id=duplicate.report_id).exists():
+            duplicate = None
+        if duplicate is not None and data.link_duplicate:
+            duplicate_animal = await Animal.get_or_none(id=duplicate.animal_id)
+
     async with in_transaction():
         animal_created = False
         if data.animal_id is not None:
             if (animal := await Animal.get_or_none(id=data.animal_id)) is None:
                 raise CustomMessageException("Unknown animal!", 404)
+        elif duplicate_animal is not None:
+            animal = duplicate_animal
         elif data.name is not None and data.breed is not None:
             animal = await Animal.create(
                 name=data.name, breed=data.breed, status=AnimalStatus.FOUND, current_location=location,
@@ -75,7 +59,10 @@ async def create_animal_report(user: JwtMaybeAuthUserDep, data: CreateAnimalRepo
         else:
             raise CustomMessageException("You need to specify either animal id or name and breed!", 400)
 
-        report = await AnimalReport.create(reported_by=user, animal=animal, notes=data.notes, location=location)
+        report = await AnimalReport.create(
+            reported_by=user, animal=animal, notes=data.notes, location=location,
+            duplicate_of_id=duplicate.report_id if duplicate is not None else None,
+        )
         if data.media_ids:
             media = await Media.filter(id__in=data.media_ids, uploaded_by=user, status=MediaStatus.UPLOADED)
             await report.media.add(*media)
@@ -83,9 +70,22 @@ async def create_animal_report(user: JwtMaybeAuthUserDep, data: CreateAnimalRepo
         if not animal_created:
             await Cache.delete_obj(animal)
 
-        await AnimalUpdate.create(animal=animal, type=AnimalUpdateType.REPORT, animal_report=report)
+        update = await AnimalUpdate.create(animal=animal, type=AnimalUpdateType.REPORT, animal_report=report)
+        await Outbox.enqueue(send_animal_update_notification, update_id=update.id)
+        if duplicate is None:
+            await ReportRollup.increment(location.latitude, location.longitude, report.created_at)
+            await Outbox.enqueue(send_animal_report_notification, report_id=report.id)
+            await Outbox.enqueue(send_animal_report_geofence_notification, report_id=report.id)
 
-    bg.add_task(_send_notification_task, report)
+    await SubscriptionTimeline.append(update)
+    if duplicate is None:
+        try:
+            await RecentReportsIndex.add(
+                report.id, animal.id, user.id if user is not None else None, data.latitude, data.longitude,
+            )
+        except Exception as e:
+            # Report is already created, it just won't be detected as a duplicate target
+            logger.opt(exception=e).warning(f"Failed to add report {report.id} to recent reports index")
 
     return await report.to_json()
 
@@ -101,7 +101,7 @@ async def get_recent_unassigned_reports(query: RecentReportsQuery = Query()):
     SELECT 
         COUNT(*) `all_count`,
         ST_Distance_Sphere(`location`.`point`, x'{point_wkb}') `dist`,
-        `report`.`assigned_to_id`,`report`.`location_id`,`report`.`notes`,`report`.`created_at`,`report`.`animal_id`,`report`.`reported_by_id`,`report`.`id`,
+        `report`.`assigned_to_id`,`report`.`location_id`,`report`.`notes`,`report`.`created_at`,`report`.`animal_id`,`report`.`reported_by_id`,`report`.`duplicate_of_id`,`report`.`id`,
         `assigned_to`.`password` `animalreport__assigned_to.password`,`assigned_to`.`email` `animalreport__assigned_to.email`,`assigned_to`.`mfa_key` `animalreport__assigned_to.mfa_key`,`assigned_to`.`last_name` `animalreport__assigned_to.last_name`,`assigned_to`.`viber_phone` `animalreport__assigned_to.viber_phone`,`assigned_to`.`telegram_username` `animalreport__assigned_to.telegram_username`,`assigned_to`.`whatsapp_phone` `animalreport__assigned_to.whatsapp_phone`,`assigned_to`.`role` `animalreport__assigned_to.role`,`assigned_to`.`first_name` `animalreport__assigned_to.first_name`,`assigned_to`.`id` `animalreport__assigned_to.id`,
         `reported_by`.`password` `animalreport__reported_by.password`,`reported_by`.`email` `animalreport__reported_by.email`,`reported_by`.`mfa_key` `animalreport__reported_by.mfa_key`,`reported_by`.`last_name` `animalreport__reported_by.last_name`,`reported_by`.`viber_phone` `animalreport__reported_by.viber_phone`,`reported_by`.`telegram_username` `animalreport__reported_by.telegram_username`,`reported_by`.`whatsapp_phone` `animalreport__reported_by.whatsapp_phone`,`reported_by`.`role` `animalreport__reported_by.role`,`reported_by`.`first_name` `animalreport__reported_by.first_name`,`reported_by`.`id` `animalreport__reported_by.id`,
         `location`.`longitude` `animalreport__location.longitude`,`location`.`point` `animalreport__location.point`,`location`.`name` `animalreport__location.name`,`location`.`latitude` `animalreport__location.latitude`,`location`.`id` `animalreport__location.id`,
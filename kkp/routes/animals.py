@@ -1,18 +1,25 @@
 from datetime import datetime
 
-from fastapi import APIRouter, Query, BackgroundTasks
+from fastapi import APIRouter, Query, BackgroundTasks, Depends
 from pytz import UTC
+from tortoise.transactions import in_transaction
 
-from kkp.dependencies import AnimalDep, JwtAuthUserDepN, JwtAuthVetDepN, JwtMaybeAuthUserDep
+from kkp.config import config
+from kkp.dependencies import AnimalDep, JwtAuthUserDepN, JwtAuthVetDepN, JwtMaybeAuthUserDep, RateLimitUser
 from kkp.models import Animal, Media, AnimalReport, TreatmentReport, MediaStatus, GeoPoint, AnimalUpdateType, \
-    AnimalUpdate
+    AnimalUpdate, MediaType
 from kkp.schemas.admin.animals import AnimalQuery
 from kkp.schemas.animal_reports import AnimalReportInfo
-from kkp.schemas.animals import AnimalInfo, EditAnimalRequest
+from kkp.schemas.animals import AnimalInfo, EditAnimalRequest, SimilarAnimalsRequest, SimilarAnimalInfo
 from kkp.schemas.common import PaginationResponse, PaginationQuery
 from kkp.schemas.treatment_reports import TreatmentReportInfo
 from kkp.utils.cache import Cache
+from kkp.utils.media_processing import MediaProcessor
+from kkp.utils.notification_tasks import send_animal_update_notification
+from kkp.utils.outbox import Outbox
 from kkp.utils.payouts import check_payout_maybe
+from kkp.utils.phash import find_similar_animals
+from kkp.utils.timelines import SubscriptionTimeline
 
 router = APIRouter(prefix="/animals")
 
@@ -46,6 +53,36 @@ async def get_animals(user: JwtMaybeAuthUserDep, query: AnimalQuery = Query()):
     }
 
 
+@router.post(
+    "/similar", response_model=list[SimilarAnimalInfo],
+    dependencies=[Depends(RateLimitUser("similar-animals", 30, 60))],
+)
+async def get_similar_animals(user: JwtMaybeAuthUserDep, data: SimilarAnimalsRequest):
+    max_distance = data.max_distance if data.max_distance is not None else config.similar_animals_max_distance
+    medias = await Media.filter(
+        id__in=data.media_ids, uploaded_by=user, status=MediaStatus.UPLOADED, type=MediaType.PHOTO,
+    )
+
+    distances = {}
+    for media in medias:
+        if not await MediaProcessor.ensure_phash(media):
+            continue
+        for animal_id, distance in await find_similar_animals(media.phash, max_distance, config.similar_animals_limit):
+            distances[animal_id] = min(distance, distances.get(animal_id, distance))
+
+    closest = sorted(distances.items(), key=lambda item: item[1])[:config.similar_animals_limit]
+    animals = {animal.id: animal for animal in await Animal.filter(id__in=[animal_id for animal_id, _ in closest])}
+
+    return [
+        {
+            "animal": await animals[animal_id].to_json(user),
+            "distance": distance,
+        }
+        for animal_id, distance in closest
+        if animal_id in animals
+    ]
+
+
 @router.get("/{animal_id}", response_model=AnimalInfo)
 async def get_animal(animal: AnimalDep, user: JwtMaybeAuthUserDep):
     if user is not None:
@@ -83,10 +120,12 @@ async def edit_animal(animal: AnimalDep, data: EditAnimalRequest):
 
     update_data["updated_at"] = datetime.now(UTC)
     animal.update_from_dict(update_data)
-    await animal.save(update_fields=update_fields)
+    async with in_transaction():
+        await animal.save(update_fields=update_fields)
+        update = await AnimalUpdate.create(animal=animal, type=AnimalUpdateType.ANIMAL)
+        await Outbox.enqueue(send_animal_update_notification, update_id=update.id)
     await Cache.delete_obj(animal)
-
-    await AnimalUpdate.create(animal=animal, type=AnimalUpdateType.ANIMAL)
+    await SubscriptionTimeline.append(update)
 
     return await animal.to_json()
 
@@ -1,32 +1,34 @@
 from os import urandom
 from time import time
 
-import bcrypt
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, Depends, Response
 from starlette.responses import JSONResponse
 
 from kkp.config import config
-from kkp.dependencies import JwtSessionDep, JwtAuthUserDep
+from kkp.dependencies import JwtSessionDep, JwtAuthUserDep, RateLimitIp
 from kkp.models import User, Session, ExternalAuth, ExtAuthType
 from kkp.schemas.auth import RegisterResponse, RegisterRequest, LoginResponse, LoginRequest, MfaResponse, \
     MfaVerifyRequest, GoogleAuthUrlData, ConnectGoogleData, GoogleOAuthData, ResetPasswordRequest, \
-    RealResetPasswordRequest, GoogleIdOAuthData, GoogleClientIdData
+    RealResetPasswordRequest, GoogleIdOAuthData, GoogleClientIdData, RefreshTokenRequest
 from kkp.utils.custom_exception import CustomMessageException
 from kkp.utils.google_id_token import verify_oauth2_token
 from kkp.utils.google_oauth import authorize_google
 from kkp.utils.jwt import JWT
 from kkp.utils.mfa import Mfa
-from kkp.utils.notification_util import send_notification
+from kkp.utils.notification_tasks import send_password_reset_email
+from kkp.utils.outbox import Outbox
+from kkp.utils.password import PasswordHasher
+from kkp.utils.rate_limit import RateLimiter
 
 router = APIRouter(prefix="/auth")
 
 
-@router.post("/register", response_model=RegisterResponse)
+@router.post("/register", response_model=RegisterResponse, dependencies=[Depends(RateLimitIp("register", 10, 60 * 10))])
 async def register(data: RegisterRequest):
     if await User.filter(email=data.email).exists():
         raise CustomMessageException("User with this email already registered!")
 
-    password = bcrypt.hashpw(data.password.encode("utf8"), bcrypt.gensalt(config.bcrypt_rounds)).decode("utf8")
+    password = await PasswordHasher.hash(data.password)
     user = await User.create(
         email=data.email,
         password=password,
@@ -38,18 +40,16 @@ async def register(data: RegisterRequest):
         await user.save(update_fields=["role"])
     session = await Session.create(user=user)
 
-    return {
-        "token": session.to_jwt(),
-        "expires_at": int(time() + config.jwt_ttl),
-    }
+    return session.to_token_response()
 
 
-@router.post("/login", response_model=LoginResponse | MfaResponse)
-async def login(data: LoginRequest):
+@router.post("/login", response_model=LoginResponse | MfaResponse, dependencies=[Depends(RateLimitIp("login", 10, 60))])
+async def login(data: LoginRequest, response: Response):
+    await RateLimiter.hit_or_raise(f"login-email:{data.email.lower()}", 5, 60)
     if (user := await User.get_or_none(email=data.email)) is None:
         raise CustomMessageException("User with this credentials is not found!")
 
-    if not user.check_password(data.password):
+    if not await user.check_password(data.password):
         raise CustomMessageException("User with this credentials is not found!")
 
     session = await Session.create(user=user, active=user.mfa_key is None)
@@ -62,24 +62,28 @@ async def login(data: LoginRequest):
                 "n": session.nonce[:8],
             }, config.jwt_key, expires_in=mfa_ttl),
             "expires_at": int(time() + mfa_ttl),
-        }, 400)
+        }, 400, headers={
+            # Returned response replaces the injected one, so rate limit headers set on it are copied
+            name: value for name, value in response.headers.items() if name.startswith("x-ratelimit-")
+        })
 
-    return {
-        "token": session.to_jwt(),
-        "expires_at": int(time() + config.jwt_ttl),
-    }
+    return session.to_token_response()
 
 
 @router.post("/logout", status_code=204)
 async def logout_user(session: JwtSessionDep):
+    await session.revoke()
     await session.delete()
 
 
-@router.post("/login/mfa", response_model=LoginResponse)
+@router.post("/login/mfa", response_model=LoginResponse, dependencies=[Depends(RateLimitIp("login-mfa", 10, 60))])
 async def verify_mfa_login(data: MfaVerifyRequest):
     if (payload := JWT.decode(data.mfa_token, config.jwt_key)) is None:
         raise CustomMessageException("Invalid mfa token!")
 
+    # Limit code guesses per session regardless of ip
+    await RateLimiter.hit_or_raise(f"login-mfa-session:{payload['s']}", 5, 60)
+
     session = await Session.get_or_none(
         id=payload["s"], user__id=payload["u"], nonce__startswith=payload["n"], active=False,
     ).select_related("user")
@@ -89,14 +93,36 @@ async def verify_mfa_login(data: MfaVerifyRequest):
     if session.user.mfa_key is not None and data.mfa_code not in Mfa.get_codes(session.user.mfa_key):
         raise CustomMessageException("Invalid code.")
 
+    await session.invalidate_auth_cache()
     session.nonce = urandom(8).hex()
     session.active = True
     await session.save(update_fields=["nonce", "active"])
 
-    return {
-        "token": session.to_jwt(),
-        "expires_at": int(time() + config.jwt_ttl),
-    }
+    return session.to_token_response()
+
+
+@router.post("/refresh", response_model=LoginResponse)
+async def refresh_session(data: RefreshTokenRequest):
+    if not config.jwt_refresh_tokens:
+        raise CustomMessageException("Refresh tokens are disabled.")
+
+    payload = JWT.decode(data.refresh_token, config.jwt_key)
+    if payload is None or payload.get("t") != "refresh" or not isinstance(payload.get("n"), str):
+        raise CustomMessageException("Invalid refresh token!", 401)
+
+    session = await Session.get_or_none(id=payload["s"], user__id=payload["u"], active=True)
+    if session is None:
+        raise CustomMessageException("Invalid refresh token!", 401)
+
+    # Nonce is rotated on every refresh, so every refresh token can be used only once
+    new_nonce = urandom(8).hex()
+    if not await Session.filter(id=session.id, nonce=payload["n"]).update(nonce=new_nonce):
+        raise CustomMessageException("Invalid refresh token!", 401)
+
+    await session.invalidate_auth_cache()
+    session.nonce = new_nonce
+
+    return session.to_token_response()
 
 
 @router.get("/google", response_model=GoogleAuthUrlData)
@@ -189,8 +215,7 @@ async def google_auth_callback(data: GoogleOAuthData):
 
     session = await Session.create(user=user, active=True)
     return {
-        "token": session.to_jwt(),
-        "expires_at": int(time() + config.jwt_ttl),
+        **session.to_token_response(),
         "connect": False,
     }
 
@@ -231,35 +256,21 @@ async def google_auth_mobile_callback(data: GoogleIdOAuthData):
         raise RuntimeError("Unreachable")
 
     session = await Session.create(user=user, active=True)
-    return {
-        "token": session.to_jwt(),
-        "expires_at": int(time() + config.jwt_ttl),
-    }
-
-
-async def _send_password_reset_email_task(user: User, reset_token: str) -> None:
-    await send_notification(
-        user,
-        "Password reset",
-        (
-            f"Click the following link to reset your password: "
-            f"{config.public_host}/reset-password?reset_token={reset_token}\n"
-            f"Or enter this token in token field in reset password dialog window: {reset_token}"
-        ),
-        fcm=False,
-    )
+    return session.to_token_response()
 
 
-@router.post("/reset-password/request", status_code=204)
-async def request_reset_password(data: ResetPasswordRequest, bg: BackgroundTasks):
+@router.post(
+    "/reset-password/request", status_code=204, dependencies=[Depends(RateLimitIp("reset-password", 5, 60 * 10))],
+)
+async def request_reset_password(data: ResetPasswordRequest):
+    await RateLimiter.hit_or_raise(f"reset-password-email:{data.email.lower()}", 3, 60 * 10)
     if (user := await User.get_or_none(email=data.email)) is None:
         return
 
     if config.smtp_port <= 0:  # pragma: no cover
         raise CustomMessageException("Smtp is not configured!")
 
-    reset_token = JWT.encode({"u": user.id, "type": "password-reset"}, config.jwt_key, expires_in=60 * 30)
-    bg.add_task(_send_password_reset_email_task, user, reset_token)
+    await Outbox.enqueue(send_password_reset_email, user_id=user.id)
 
 
 @router.post("/reset-password/reset", status_code=204)
@@ -269,5 +280,5 @@ async def reset_password(data: RealResetPasswordRequest):
     if (user := await User.get_or_none(id=payload["u"])) is None:
         raise CustomMessageException("User not found!")
 
-    user.password = bcrypt.hashpw(data.new_password.encode("utf8"), bcrypt.gensalt(config.bcrypt_rounds)).decode("utf8")
+    user.password = await PasswordHasher.hash(data.new_password)
     await user.save(update_fields=["password"])
@@ -0,0 +1,63 @@
+from fastapi import APIRouter
+from tortoise.transactions import in_transaction
+
+from kkp.dependencies import JwtAuthUserDep
+from kkp.models import Geofence, GeofenceType
+from kkp.schemas.geofences import GeofenceInfo, CreateGeofenceRequest
+from kkp.utils.custom_exception import CustomMessageException
+from kkp.utils.geo import polygon_bbox
+
+router = APIRouter(prefix="/geofences")
+
+
+@router.get("", response_model=list[GeofenceInfo])
+async def get_geofences(user: JwtAuthUserDep):
+    return [
+        geofence.to_json()
+        for geofence in await Geofence.filter(user=user).order_by("-id")
+    ]
+
+
+@router.post("", response_model=GeofenceInfo)
+async def create_geofence(user: JwtAuthUserDep, data: CreateGeofenceRequest):
+    if await Geofence.filter(user=user).count() >= 10:
+        raise CustomMessageException("You cannot create more than 10 geofences", 400)
+
+    if data.type is GeofenceType.CIRCLE:
+        if data.latitude is None or data.longitude is None or data.radius is None:
+            raise CustomMessageException("You need to specify latitude, longitude and radius!", 400)
+        latitude, longitude = data.latitude, data.longitude
+        radius = data.radius
+        polygon = None
+    else:
+        if data.polygon is None or len(data.polygon) < 3:
+            raise CustomMessageException("You need to specify at least 3 polygon points!", 400)
+        polygon = [[point.latitude, point.longitude] for point in data.polygon]
+        min_lat, min_lon, max_lat, max_lon = polygon_bbox(polygon)
+        if max_lat - min_lat > 1 or max_lon - min_lon > 1:
+            raise CustomMessageException("Geofence is too big!", 400)
+        latitude = sum(lat for lat, _ in polygon) / len(polygon)
+        longitude = sum(lon for _, lon in polygon) / len(polygon)
+        radius = 0
+
+    async with in_transaction():
+        geofence = await Geofence.create(
+            user=user,
+            name=data.name,
+            type=data.type,
+            latitude=latitude,
+            longitude=longitude,
+            radius=radius,
+            polygon=polygon,
+        )
+        await geofence.index_cells()
+
+    return geofence.to_json()
+
+
+@router.delete("/{geofence_id}", status_code=204)
+async def delete_geofence(user: JwtAuthUserDep, geofence_id: int):
+    if (geofence := await Geofence.get_or_none(id=geofence_id, user=user)) is None:
+        raise CustomMessageException("Unknown geofence.", 404)
+
+    await geofence.delete()
@@ -1,46 +1,162 @@
 from datetime import datetime
 from time import time
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from pytz import UTC
+from s3lite.exceptions import S3Exception
 
-from kkp.config import config, S3
-from kkp.dependencies import JwtMaybeAuthUserDep
-from kkp.models import Media, MediaType, MediaStatus
-from kkp.schemas.media import MediaInfo, CreateMediaUploadResponse, CreateMediaUploadRequest
+from kkp.config import config, S3, S3_PUBLIC
+from kkp.dependencies import JwtMaybeAuthUserDep, RateLimitUser
+from kkp.models import Media, MediaType, MediaStatus, User
+from kkp.schemas.media import MediaInfo, CreateMediaUploadResponse, CreateMediaUploadRequest, MultipartUploadState, \
+    UploadPartUrl
 from kkp.utils.custom_exception import CustomMessageException
+from kkp.utils.media_processing import process_media, abort_multipart_upload
+from kkp.utils.media_types import SNIFF_SIZE, sniff_content_type, content_type_matches
+from kkp.utils.outbox import Outbox
 
 router = APIRouter(prefix="/media")
 
 
-@router.post("", response_model=CreateMediaUploadResponse)
+def _max_size(media_type: MediaType) -> int:
+    return config.max_photo_size if media_type is MediaType.PHOTO else config.max_video_size
+
+
+# Errors of CompleteMultipartUpload that mean that uploaded parts can never be completed
+_INVALID_UPLOAD_ERRORS = ("InvalidPart", "InvalidPartOrder", "EntityTooSmall")
+
+
+def _upload_ttl(media: Media) -> int:
+    return config.multipart_upload_ttl if media.upload_id is not None else 60 * 60
+
+
+async def _discard(media: Media) -> None:
+    if media.upload_id is not None:
+        await S3.abort_multipart_upload(config.s3_bucket_name, media.object_key(), media.upload_id)
+    if not await media.objects_shared():
+        await S3.delete_object(config.s3_bucket_name, media.object_key())
+    await media.delete()
+
+
+@router.post("", response_model=CreateMediaUploadResponse, dependencies=[Depends(RateLimitUser("media", 30, 60 * 10))])
 async def create_upload(user: JwtMaybeAuthUserDep, data: CreateMediaUploadRequest):
-    if (data.type is MediaType.PHOTO and data.size > config.max_photo_size) \
-            or (data.type is MediaType.VIDEO and data.size > config.max_video_size):
+    if data.size > _max_size(data.type):
         raise CustomMessageException(f"Maximum file size is exceeded!")
 
-    res = await Media.create(uploaded_by=user, type=data.type)
+    if not data.multipart:
+        res = await Media.create(uploaded_by=user, type=data.type, size=data.size)
+        return {
+            "id": res.id,
+            "upload_url": res.upload_url(),
+        }
+
+    res = Media(uploaded_by=user, type=data.type, size=data.size)
+    res.upload_id = await S3.create_multipart_upload(config.s3_bucket_name, res.object_key())
+    await res.save()
+    await Outbox.enqueue(abort_multipart_upload, delay=config.multipart_upload_ttl + 60 * 60, media_id=res.id)
+
     return {
         "id": res.id,
-        "upload_url": res.upload_url(),
+        "part_size": config.multipart_part_size,
+        "parts_count": res.parts_count(),
     }
 
 
+async def _get_multipart_upload(user: User | None, media_id: int) -> Media:
+    if (media := await Media.get_or_none(uploaded_by=user, id=media_id)) is None:
+        raise CustomMessageException(f"Unknown media!", 404)
+    if media.status is not MediaStatus.CREATED or media.upload_id is None:
+        raise CustomMessageException(f"Invalid media state!")
+    if (time() - media.uploaded_at.timestamp()) > _upload_ttl(media):
+        raise CustomMessageException(f"Upload time exceeded!")
+
+    return media
+
+
+@router.get("/{media_id}/parts", response_model=MultipartUploadState)
+async def get_upload_parts(user: JwtMaybeAuthUserDep, media_id: int):
+    media = await _get_multipart_upload(user, media_id)
+    parts = await S3.list_parts(config.s3_bucket_name, media.object_key(), media.upload_id)
+
+    return {
+        "part_size": config.multipart_part_size,
+        "parts_count": media.parts_count(),
+        "uploaded_parts": sorted(part for part, _, _ in parts),
+    }
+
+
+@router.get("/{media_id}/parts/{part}", response_model=UploadPartUrl)
+async def get_upload_part_url(user: JwtMaybeAuthUserDep, media_id: int, part: int):
+    media = await _get_multipart_upload(user, media_id)
+    if part < 1 or part > media.parts_count():
+        raise CustomMessageException(f"Invalid part number!")
+
+    return {
+        "url": S3_PUBLIC.share_upload_part(config.s3_bucket_name, media.object_key(), media.upload_id, part),
+    }
+
+
+async def _complete_multipart_upload(media: Media) -> None:
+    parts = await S3.list_parts(config.s3_bucket_name, media.object_key(), media.upload_id)
+    if sorted(part for part, _, _ in parts) != list(range(1, media.parts_count() + 1)):
+        raise CustomMessageException(f"Media is not uploaded!")
+    if sum(size for _, _, size in parts) > _max_size(media.type):
+        await _discard(media)
+        raise CustomMessageException(f"Maximum file size is exceeded!")
+
+    try:
+        await S3.finish_multipart_upload(
+            config.s3_bucket_name, media.object_key(), media.upload_id, [(part, etag) for part, etag, _ in parts],
+        )
+    except S3Exception as e:
+        # Other errors (e.g. InternalError, SlowDown or NoSuchUpload of concurrent finalize) don't mean
+        #  that uploaded parts are bad, so upload is kept and finalize can be retried
+        if e.code not in _INVALID_UPLOAD_ERRORS:
+            raise CustomMessageException(f"Failed to complete upload, try again later.", 503) from e
+        await _discard(media)
+        raise CustomMessageException(f"Invalid upload: {e.message}")
+
+    # Upload does not exist anymore, saved right away so retried finalize (if something below fails)
+    #  does not try to complete it again and abort job does not delete completed object.
+    #  Object is now uploaded as a regular one, so it gets a regular upload time window from now on.
+    media.upload_id = None
+    media.uploaded_at = datetime.now(UTC)
+    await media.save(update_fields=["upload_id", "uploaded_at"])
+
+
 @router.post("/{media_id}/finalize", response_model=MediaInfo)
 async def finalize_upload(user: JwtMaybeAuthUserDep, media_id: int):
     if (media := await Media.get_or_none(uploaded_by=user, id=media_id)) is None:
         raise CustomMessageException(f"Unknown media!", 404)
     if media.status is not MediaStatus.CREATED:
         raise CustomMessageException(f"Invalid media state!")
-    if (time() - media.uploaded_at.timestamp()) > 60 * 60:
-        await S3.delete_object(config.s3_bucket_name, media.object_key())
-        await media.delete()
+    if (time() - media.uploaded_at.timestamp()) > _upload_ttl(media):
+        await _discard(media)
         raise CustomMessageException(f"Upload time exceeded!")
-    if not await S3.get_object(config.s3_bucket_name, media.object_key()):
+    if media.upload_id is not None:
+        await _complete_multipart_upload(media)
+    # HEAD request, object itself is not downloaded
+    if (obj := await S3.get_object(config.s3_bucket_name, media.object_key())) is None:
         raise CustomMessageException(f"Media is not uploaded!")
 
+    if obj.size > _max_size(media.type):
+        await _discard(media)
+        raise CustomMessageException(f"Maximum file size is exceeded!")
+
+    content_type = None
+    if obj.size > 0:
+        header = await S3.download_object(config.s3_bucket_name, media.object_key(), in_memory=True, limit=SNIFF_SIZE)
+        content_type = sniff_content_type(header.getvalue())
+    if not content_type_matches(content_type, media.type):
+        await _discard(media)
+        raise CustomMessageException(f"Unsupported media file!")
+
     media.uploaded_at = datetime.now(UTC)
     media.status = MediaStatus.UPLOADED
-    await media.save(update_fields=["uploaded_at", "status"])
+    media.size = obj.size
+    media.content_type = content_type
+    await media.save(update_fields=["uploaded_at", "status", "size", "content_type", "upload_id"])
+    if media.type is MediaType.PHOTO:
+        await Outbox.enqueue(process_media, media_id=media.id)
 
     return media.to_json()
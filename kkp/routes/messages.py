@@ -1,17 +1,17 @@
 from datetime import datetime, UTC
 
-from fastapi import APIRouter, Query, BackgroundTasks
+from fastapi import APIRouter, Query, Depends
 from tortoise.expressions import Q, Subquery
 from tortoise.functions import Max
 
-from kkp.dependencies import JwtAuthUserDep
+from kkp.dependencies import JwtAuthUserDep, RateLimitUser
 from kkp.models import Dialog, Message, User, Media, MediaStatus
 from kkp.schemas.common import PaginationResponse, PaginationQuery
 from kkp.schemas.messages import DialogInfo, CreateMessageRequest, MessageInfo, MessagePaginationQuery, \
     GetLastMessagesRequest
 from kkp.utils.cache import Cache
+from kkp.utils.chat_notifications import ChatNotifications
 from kkp.utils.custom_exception import CustomMessageException
-from kkp.utils.notification_util import send_notification
 
 router = APIRouter(prefix="/messages")
 
@@ -84,6 +84,9 @@ async def get_messages(user_id: int, user: JwtAuthUserDep, query: MessagePaginat
     limit = min(max(query.limit, 1), 100)
     related = ("dialog__from_user", "dialog__to_user", "author", "media")
 
+    if user_id != user.id:
+        await ChatNotifications.dialog_read(user.id, user_id)
+
     Cache.suffix(f"u{user.id}")
 
     return {
@@ -95,19 +98,8 @@ async def get_messages(user_id: int, user: JwtAuthUserDep, query: MessagePaginat
     }
 
 
-async def _send_message_nofitication_task(to_user: User, from_user: User, text: str) -> None:
-    await send_notification(
-        to_user,
-        "New message",
-        (
-                f"You have new message from {from_user.first_name}!\n"
-                + (f"Comment: \n{text}" if text else "")
-        ),
-    )
-
-
-@router.post("/{user_id}", response_model=MessageInfo)
-async def send_message(user_id: int, user: JwtAuthUserDep, data: CreateMessageRequest, bg: BackgroundTasks):
+@router.post("/{user_id}", response_model=MessageInfo, dependencies=[Depends(RateLimitUser("messages", 30, 60))])
+async def send_message(user_id: int, user: JwtAuthUserDep, data: CreateMessageRequest):
     if (other_user := await User.get_or_none(id=user_id)) is None:
         raise CustomMessageException("Unknown dialog.", 404)
 
@@ -124,7 +116,8 @@ async def send_message(user_id: int, user: JwtAuthUserDep, data: CreateMessageRe
     await Cache.delete_obj(dialog)
 
     if user != other_user:
-        bg.add_task(_send_message_nofitication_task, other_user, user, message.text)
+        await ChatNotifications.dialog_read(user.id, other_user.id)
+        await ChatNotifications.message_sent(user.id, other_user.id)
 
     Cache.suffix(f"u{user.id}")
     return await message.to_json(user)
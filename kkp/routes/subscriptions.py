@@ -1,14 +1,11 @@
-from datetime import datetime
-
 from fastapi import APIRouter, Query
-from pytz import UTC
-from tortoise.expressions import Subquery
 
 from kkp.dependencies import JwtAuthUserDep, AnimalDep
 from kkp.models import AnimalUpdate
 from kkp.schemas.animal_updates import AnimalUpdatesQuery, AnimalUpdateInfo
 from kkp.schemas.animals import AnimalInfo
 from kkp.schemas.common import PaginationResponse, PaginationQuery
+from kkp.utils.timelines import SubscriptionTimeline
 
 router = APIRouter(prefix="/subscriptions")
 
@@ -28,26 +25,26 @@ async def get_user_subscriptions(user: JwtAuthUserDep, query: PaginationQuery =
 
 @router.get("/updates", response_model=PaginationResponse[AnimalUpdateInfo])
 async def get_user_subscriptions_updates(user: JwtAuthUserDep, query: AnimalUpdatesQuery = Query()):
-    updates_query = AnimalUpdate.filter(animal__id__in=Subquery(user.subscriptions.all().values_list("id", flat=True)))
-
-    if query.before_date is not None:
-        updates_query = updates_query.filter(date__lt=datetime.fromtimestamp(query.before_date, tz=UTC))
-    if query.after_date is not None:
-        updates_query = updates_query.filter(date__gt=datetime.fromtimestamp(query.after_date, tz=UTC))
-
-    order = query.order_by
-    if query.order == "desc":
-        order = f"-{order}"
-
-    updates_query = updates_query.order_by(order)
+    count, update_ids = await SubscriptionTimeline.get(
+        user, query.after_date, query.before_date, query.order == "desc",
+        query.page_size * (query.page - 1), query.page_size,
+    )
+
+    updates = {
+        update.id: update
+        for update in await AnimalUpdate.filter(id__in=update_ids)
+            .select_related("animal", "animal_report", "treatment_report")
+    }
+    if missing := [update_id for update_id in update_ids if update_id not in updates]:
+        await SubscriptionTimeline.remove(user.id, missing)
+        count -= len(missing)
 
     return {
-        "count": await updates_query.count(),
+        "count": count,
         "result": [
-            await update.to_json()
-            for update in await updates_query.select_related("animal", "animal_report", "treatment_report") \
-                .limit(query.page_size) \
-                .offset(query.page_size * (query.page - 1))
+            await updates[update_id].to_json()
+            for update_id in update_ids
+            if update_id in updates
         ],
     }
 
@@ -55,8 +52,10 @@ async def get_user_subscriptions_updates(user: JwtAuthUserDep, query: AnimalUpda
 @router.put("/{animal_id}", status_code=204)
 async def subscribe_to_animal(user: JwtAuthUserDep, animal: AnimalDep):
     await user.subscriptions.add(animal)
+    await SubscriptionTimeline.subscribed(user, animal)
 
 
 @router.delete("/{animal_id}", status_code=204)
 async def unsubscribe_from_animal(user: JwtAuthUserDep, animal: AnimalDep):
     await user.subscriptions.remove(animal)
+    await SubscriptionTimeline.unsubscribed(user, animal)
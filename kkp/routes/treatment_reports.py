@@ -2,13 +2,17 @@ from datetime import datetime
 
 from fastapi import APIRouter, BackgroundTasks
 from pytz import UTC
+from tortoise.transactions import in_transaction
 
 from kkp.dependencies import JwtAuthUserDep, JwtAuthVetDep, TreatmentReportDep
 from kkp.models import AnimalReport, UserRole, TreatmentReport, VetClinic, AnimalUpdate, AnimalUpdateType, PayoutStatus
 from kkp.schemas.treatment_reports import TreatmentReportInfo, CreateTreatmentReportRequest
 from kkp.utils.cache import Cache
 from kkp.utils.custom_exception import CustomMessageException
+from kkp.utils.notification_tasks import send_animal_update_notification
+from kkp.utils.outbox import Outbox
 from kkp.utils.payouts import check_payout_maybe
+from kkp.utils.timelines import SubscriptionTimeline
 
 router = APIRouter(prefix="/treatment-reports")
 
@@ -23,19 +27,24 @@ async def create_treatment_report(user: JwtAuthVetDep, data: CreateTreatmentRepo
 
     vet_clinic = await VetClinic.filter(employees__id=user.id).first()
 
-    treatment_report = await TreatmentReport.create(
-        report=report,
-        description=data.description,
-        money_spent=data.money_spent,
-        vet_clinic=vet_clinic,
-        payout_email=data.payout_email,
-        payout_status=PayoutStatus.REQUESTED if data.payout_email else PayoutStatus.NOT_REQUESTED,
-    )
-    report.animal.updated_at = datetime.now(UTC)
-    await report.animal.save(update_fields=["updated_at"])
+    async with in_transaction():
+        treatment_report = await TreatmentReport.create(
+            report=report,
+            description=data.description,
+            money_spent=data.money_spent,
+            vet_clinic=vet_clinic,
+            payout_email=data.payout_email,
+            payout_status=PayoutStatus.REQUESTED if data.payout_email else PayoutStatus.NOT_REQUESTED,
+        )
+        report.animal.updated_at = datetime.now(UTC)
+        await report.animal.save(update_fields=["updated_at"])
+
+        update = await AnimalUpdate.create(
+            animal=report.animal, type=AnimalUpdateType.TREATMENT, treatment_report=treatment_report,
+        )
+        await Outbox.enqueue(send_animal_update_notification, update_id=update.id)
     await Cache.delete_obj(report.animal)
-
-    await AnimalUpdate.create(animal=report.animal, type=AnimalUpdateType.TREATMENT, treatment_report=treatment_report)
+    await SubscriptionTimeline.append(update)
 
     return await treatment_report.to_json()
 
@@ -1,11 +1,9 @@
 from datetime import datetime
 from time import time
 
-import bcrypt
 from fastapi import APIRouter
 from pytz import UTC
 
-from kkp.config import config
 from kkp.db.point import Point
 from kkp.dependencies import JwtAuthUserDep, JwtSessionDep
 from kkp.models import Media, User, UserProfilePhoto, MediaStatus
@@ -14,6 +12,7 @@ from kkp.schemas.users import UserInfo, UserEditRequest, UserMfaEnableRequest, U
 from kkp.utils.cache import Cache
 from kkp.utils.custom_exception import CustomMessageException
 from kkp.utils.mfa import Mfa
+from kkp.utils.password import PasswordHasher
 
 router = APIRouter(prefix="/user")
 
@@ -50,11 +49,12 @@ async def update_user_info(user: JwtAuthUserDep, data: UserEditRequest):
 
 @router.post("/mfa/enable", response_model=UserInfo)
 async def enable_mfa(user: JwtAuthUserDep, data: UserMfaEnableRequest):
+    await user.load_fields()
     if user.mfa_key is not None:
         raise CustomMessageException("Mfa already enabled.")
     if data.code not in Mfa.get_codes(data.key):
         raise CustomMessageException("Invalid code.")
-    if not user.check_password(data.password):
+    if not await user.check_password(data.password):
         raise CustomMessageException("Wrong password!")
 
     user.mfa_key = data.key
@@ -66,11 +66,12 @@ async def enable_mfa(user: JwtAuthUserDep, data: UserMfaEnableRequest):
 
 @router.post("/mfa/disable", response_model=UserInfo)
 async def disable_mfa(user: JwtAuthUserDep, data: UserMfaDisableRequest):
+    await user.load_fields()
     if user.mfa_key is None:
         raise CustomMessageException("Mfa is not enabled.")
     if data.code not in Mfa.get_codes(user.mfa_key):
         raise CustomMessageException("Invalid code.")
-    if not user.check_password(data.password):
+    if not await user.check_password(data.password):
         raise CustomMessageException("Wrong password!")
 
     user.mfa_key = None
@@ -103,10 +104,10 @@ async def update_user_location(session: JwtSessionDep, data: UpdateLocationReque
 
 @router.patch("/password", response_model=UserInfo)
 async def change_user_password(user: JwtAuthUserDep, data: PasswordChangeRequest):
-    if not user.check_password(data.old_password):
+    if not await user.check_password(data.old_password):
         raise CustomMessageException("Wrong password!")
 
-    user.password = bcrypt.hashpw(data.new_password.encode("utf8"), bcrypt.gensalt(config.bcrypt_rounds)).decode("utf8")
+    user.password = await PasswordHasher.hash(data.new_password)
     await user.save(update_fields=["password"])
 
     return await user.to_json()
@@ -0,0 +1,25 @@
+from datetime import date
+
+from pydantic import BaseModel
+
+
+class ReportStatsQuery(BaseModel):
+    start: date | None = None
+    end: date | None = None
+    prefix: str = ""
+
+
+class HeatmapQuery(ReportStatsQuery):
+    precision: int = 4
+
+
+class HeatmapCellInfo(BaseModel):
+    cell: str
+    latitude: float
+    longitude: float
+    count: int
+
+
+class TimelineDayInfo(BaseModel):
+    day: date
+    count: int
@@ -19,6 +19,8 @@ class CreateAnimalReportsRequest(BaseModel):
     longitude: float
     media_ids: list[int]
     gender: AnimalGender = AnimalGender.UNKNOWN
+    # Set to true to attach report to the animal of probable duplicate report instead of creating new animal
+    link_duplicate: bool = False
 
 
 class AnimalReportInfo(BaseModel):
@@ -30,6 +32,7 @@ class AnimalReportInfo(BaseModel):
     notes: str
     media: list[MediaInfo]
     location: GeoPointInfo
+    duplicate_of: int | None = None
 
 
 class RecentReportsQuery(PaginationQuery):
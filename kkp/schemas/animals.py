@@ -1,8 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from kkp.models import AnimalStatus, AnimalGender
 from kkp.schemas.common import PaginationResponse, GeoPointInfo
 from kkp.schemas.media import MediaInfo
+from kkp.utils.phash import MAX_DISTANCE
 
 
 class AnimalInfo(BaseModel):
@@ -29,3 +30,15 @@ class EditAnimalRequest(BaseModel):
     current_latitude: float | None = None
     current_longitude: float | None = None
     gender: AnimalGender | None = None
+
+
+class SimilarAnimalsRequest(BaseModel):
+    # Uploaded photos of the animal that is being reported
+    media_ids: list[int] = Field(min_length=1, max_length=10)
+    max_distance: int | None = Field(default=None, ge=0, le=MAX_DISTANCE)
+
+
+class SimilarAnimalInfo(BaseModel):
+    animal: AnimalInfo
+    # Hamming distance between hashes of the closest photos, 0 means (almost) identical photos
+    distance: int
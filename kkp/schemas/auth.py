@@ -21,6 +21,8 @@ class LoginRequest(BaseModel):
 class RegisterResponse(BaseModel):
     token: str
     expires_at: int
+    refresh_token: str | None = None
+    refresh_expires_at: int | None = None
 
 
 class LoginResponse(RegisterResponse):
@@ -32,6 +34,10 @@ class MfaResponse(BaseModel):
     expires_at: int
 
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
 class MfaVerifyRequest(BaseModel):
     mfa_code: str = Field(min_length=6, max_length=6, pattern=r"^\d{6}$")
     mfa_token: str
@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field
+
+from kkp.models import GeofenceType
+
+
+class GeofencePoint(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+
+
+class GeofenceInfo(BaseModel):
+    id: int
+    name: str
+    type: GeofenceType
+    latitude: float
+    longitude: float
+    radius: int
+    polygon: list[GeofencePoint] | None
+    created_at: int
+
+
+class CreateGeofenceRequest(BaseModel):
+    name: str = Field(default="", max_length=128)
+    type: GeofenceType
+    latitude: float | None = Field(default=None, ge=-90, le=90)
+    longitude: float | None = Field(default=None, ge=-180, le=180)
+    radius: int | None = Field(default=None, ge=100, le=50000)
+    polygon: list[GeofencePoint] | None = Field(default=None, max_length=64)
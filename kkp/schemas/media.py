@@ -6,11 +6,29 @@ from kkp.models import MediaType
 class CreateMediaUploadRequest(BaseModel):
     type: MediaType
     size: int
+    multipart: bool = False
 
 
 class CreateMediaUploadResponse(BaseModel):
     id: int
-    upload_url: str
+    upload_url: str | None = None
+    part_size: int | None = None
+    parts_count: int | None = None
+
+
+class MultipartUploadState(BaseModel):
+    part_size: int
+    parts_count: int
+    uploaded_parts: list[int]
+
+
+class UploadPartUrl(BaseModel):
+    url: str
+
+
+class MediaVariant(BaseModel):
+    width: int
+    url: str
 
 
 class MediaInfo(BaseModel):
@@ -18,3 +36,7 @@ class MediaInfo(BaseModel):
     uploaded_at: int
     type: MediaType
     url: str
+    width: int | None = None
+    height: int | None = None
+    placeholder: str | None = None
+    variants: list[MediaVariant] = []
@@ -39,13 +39,19 @@ class Cache:
         if cls._cache is None:
             cls._cache = aiocache.caches.get("default")
 
+    @staticmethod
+    def _key(key: str) -> str:
+        # aiocache joins namespace and key without separator, but clears namespace with "{namespace}:*" pattern,
+        #  so key must start with ":" to be dropped by delete_obj (this also keeps "user-5" from matching "user-50")
+        return f":{key}"
+
     @classmethod
     async def set(cls, ns: str, key: str, obj: dict, ttl: int = 60 * 60) -> None:
         if cls._disabled.get() is _CacheDisabled.READWRITE:
             return None
 
         cls._init_maybe()
-        await cls._cache.set(key, obj, namespace=ns, ttl=ttl)
+        await cls._cache.set(cls._key(key), obj, namespace=ns, ttl=ttl)
 
     @classmethod
     async def get(cls, ns: str, key: str) -> dict | None:
@@ -53,7 +59,12 @@ class Cache:
             return None
 
         cls._init_maybe()
-        return await cls._cache.get(key, namespace=ns)
+        return await cls._cache.get(cls._key(key), namespace=ns)
+
+    @classmethod
+    async def delete(cls, ns: str, key: str) -> None:
+        cls._init_maybe()
+        await cls._cache.delete(cls._key(key), namespace=ns)
 
     @classmethod
     async def delete_obj(cls, obj: Cacheable) -> None:
@@ -0,0 +1,111 @@
+from time import time
+
+from kkp.config import REDIS, config
+from kkp.models import User, Message
+from kkp.utils.notification_util import send_notification
+from kkp.utils.outbox import Outbox
+
+
+class ChatNotifications:
+    """
+    Coalesces notifications about new chat messages.
+    First message from a user starts a window (one for push notifications and a longer one for email digest),
+    messages sent within the window are only counted and one notification about all of them is sent when window ends.
+    Notification is not sent at all if recipient opened the dialog after the last message was sent.
+    """
+
+    KEY_PREFIX = "chat-notify"
+    READ_KEY_PREFIX = "chat-read"
+
+    @classmethod
+    def _key(cls, kind: str, to_user_id: int, from_user_id: int) -> str:
+        return f"{cls.KEY_PREFIX}:{kind}:{to_user_id}:{from_user_id}"
+
+    @classmethod
+    def _read_key(cls, user_id: int, other_user_id: int) -> str:
+        return f"{cls.READ_KEY_PREFIX}:{user_id}:{other_user_id}"
+
+    @classmethod
+    async def message_sent(cls, from_user_id: int, to_user_id: int) -> None:
+        windows = (
+            ("push", send_chat_push_notification, config.chat_push_window),
+            ("email", send_chat_email_digest, config.chat_email_delay),
+        )
+
+        # Counter expires by itself if job was lost for some reason, so next message starts new window.
+        #  Ttl is set in the same transaction as increment (and only for new counter), so counter can not be left
+        #  without ttl
+        async with REDIS.pipeline(transaction=True) as pipe:
+            for kind, _, delay in windows:
+                key = cls._key(kind, to_user_id, from_user_id)
+                pipe.incr(key)
+                pipe.expire(key, delay + 60 * 60, nx=True)
+            results = await pipe.execute()
+
+        for count, (kind, task, delay) in zip(results[::2], windows):
+            if count != 1:
+                continue
+            await Outbox.enqueue(task, delay=delay, from_user_id=from_user_id, to_user_id=to_user_id)
+
+    @classmethod
+    async def dialog_read(cls, user_id: int, other_user_id: int) -> None:
+        await REDIS.set(cls._read_key(user_id, other_user_id), int(time() * 1000), ex=config.chat_email_delay + 60 * 60)
+
+    @classmethod
+    async def _last_unread_message(cls, to_user_id: int, from_user_id: int) -> Message | None:
+        last_message = await Message.filter(
+            dialog__from_user__id__in=(to_user_id, from_user_id), dialog__to_user__id__in=(to_user_id, from_user_id),
+            author__id=from_user_id,
+        ).order_by("-id").first()
+        if last_message is None:
+            return None
+
+        read_at = await REDIS.get(cls._read_key(to_user_id, from_user_id))
+        if read_at is not None and int(read_at) >= last_message.date.timestamp() * 1000:
+            return None
+
+        return last_message
+
+    @classmethod
+    async def send(cls, kind: str, from_user_id: int, to_user_id: int) -> None:
+        key = cls._key(kind, to_user_id, from_user_id)
+        if not (count := int(await REDIS.getdel(key) or 0)):
+            return
+        if (last_message := await cls._last_unread_message(to_user_id, from_user_id)) is None:
+            return
+
+        from_user = await User.get_or_none(id=from_user_id)
+        to_user = await User.get_or_none(id=to_user_id)
+        if from_user is None or to_user is None:
+            return
+
+        if count == 1:
+            title = "New message"
+            text = (
+                    f"You have new message from {from_user.first_name}!\n"
+                    + (f"Comment: \n{last_message.text}" if last_message.text else "")
+            )
+        else:
+            title = f"{count} new messages"
+            text = f"You have {count} new messages from {from_user.first_name}!"
+
+        try:
+            await send_notification(to_user, title, text, email=kind == "email", fcm=kind == "push")
+        except Exception:
+            # Counter is restored for retry of this job. If new window was started in the meantime,
+            #  whichever job runs first sends notification about all messages and the other one does nothing
+            async with REDIS.pipeline(transaction=True) as pipe:
+                pipe.incrby(key, count)
+                pipe.expire(key, config.chat_email_delay + 60 * 60)
+                await pipe.execute()
+            raise
+
+
+@Outbox.task
+async def send_chat_push_notification(from_user_id: int, to_user_id: int) -> None:
+    await ChatNotifications.send("push", from_user_id, to_user_id)
+
+
+@Outbox.task
+async def send_chat_email_digest(from_user_id: int, to_user_id: int) -> None:
+    await ChatNotifications.send("email", from_user_id, to_user_id)
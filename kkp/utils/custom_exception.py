@@ -1,4 +1,5 @@
 class CustomMessageException(Exception):
-    def __init__(self, messages: list[str] | str, status_code: int = 400):
+    def __init__(self, messages: list[str] | str, status_code: int = 400, headers: dict[str, str] | None = None):
         self.messages = messages if isinstance(messages, list) else [messages]
         self.status_code = status_code
+        self.headers = headers
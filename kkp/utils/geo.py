@@ -0,0 +1,182 @@
+from array import array
+from math import radians, sin, cos, asin, sqrt, floor
+from typing import Sequence
+
+# Same radius that is used by default in mysql's ST_Distance_Sphere
+EARTH_RADIUS_M = 6370986
+METERS_PER_DEGREE = 111320
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_MAX_PRECISION = 8
+
+
+def haversine(lon: float, lat: float, coords: Sequence[float]) -> array:
+    """
+    Calculates distances (in meters) from given point to every point in flat lon/lat array
+    (e.g. returned by kkp.db.point.decode_points).
+    """
+
+    lon1 = radians(lon)
+    lat1 = radians(lat)
+    cos_lat1 = cos(lat1)
+
+    result = array("d")
+    for i in range(0, len(coords) - 1, 2):
+        lon2 = radians(coords[i])
+        lat2 = radians(coords[i + 1])
+        a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+        result.append(2 * EARTH_RADIUS_M * asin(min(1., sqrt(a))))
+
+    return result
+
+
+def within_radius(lon: float, lat: float, coords: Sequence[float], radius: float) -> list[int]:
+    """Returns indexes (of points, not of coords array items) of points that are within given radius (in meters)."""
+
+    return [idx for idx, dist in enumerate(haversine(lon, lat, coords)) if dist < radius]
+
+
+def geohash_encode(lat: float, lon: float, precision: int = GEOHASH_MAX_PRECISION) -> str:
+    lat_min, lat_max = -90., 90.
+    lon_min, lon_max = -180., 180.
+
+    result = []
+    char = 0
+    bit = 0
+    even = True
+    while len(result) < precision:
+        if even:
+            mid = (lon_min + lon_max) / 2
+            if lon >= mid:
+                char = (char << 1) | 1
+                lon_min = mid
+            else:
+                char <<= 1
+                lon_max = mid
+        else:
+            mid = (lat_min + lat_max) / 2
+            if lat >= mid:
+                char = (char << 1) | 1
+                lat_min = mid
+            else:
+                char <<= 1
+                lat_max = mid
+
+        even = not even
+        bit += 1
+        if bit == 5:
+            result.append(GEOHASH_ALPHABET[char])
+            char = 0
+            bit = 0
+
+    return "".join(result)
+
+
+def geohash_decode(geohash: str) -> tuple[float, float]:
+    """Returns (latitude, longitude) of geohash cell center."""
+
+    lat_min, lat_max = -90., 90.
+    lon_min, lon_max = -180., 180.
+
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_min + lon_max) / 2
+                lon_min, lon_max = (mid, lon_max) if bit else (lon_min, mid)
+            else:
+                mid = (lat_min + lat_max) / 2
+                lat_min, lat_max = (mid, lat_max) if bit else (lat_min, mid)
+            even = not even
+
+    return (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+
+
+def geohash_cell_size(precision: int) -> tuple[float, float]:
+    """Returns (height, width) of geohash cell in degrees."""
+
+    lat_bits = precision * 5 // 2
+    lon_bits = precision * 5 - lat_bits
+    return 180 / (1 << lat_bits), 360 / (1 << lon_bits)
+
+
+def _geohash_cover_ranges(
+        min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int,
+) -> tuple[range, range, float, float]:
+    height, width = geohash_cell_size(precision)
+    max_lat_idx = round(180 / height) - 1
+    max_lon_idx = round(360 / width) - 1
+
+    lat_range = range(
+        max(floor((min_lat + 90) / height), 0),
+        min(floor((max_lat + 90) / height), max_lat_idx) + 1,
+    )
+    lon_range = range(
+        max(floor((min_lon + 180) / width), 0),
+        min(floor((max_lon + 180) / width), max_lon_idx) + 1,
+    )
+
+    return lat_range, lon_range, height, width
+
+
+def geohash_cover(
+        min_lat: float, min_lon: float, max_lat: float, max_lon: float, max_cells: int = 32,
+        max_precision: int = GEOHASH_MAX_PRECISION,
+) -> list[str]:
+    """
+    Returns geohash cells that fully cover given bounding box.
+    Precision is chosen as the highest one that needs no more than max_cells cells.
+    """
+
+    for precision in range(max_precision, 0, -1):
+        lat_range, lon_range, _, _ = _geohash_cover_ranges(min_lat, min_lon, max_lat, max_lon, precision)
+        if len(lat_range) * len(lon_range) > max_cells and precision > 1:
+            continue
+
+        return geohash_cells(min_lat, min_lon, max_lat, max_lon, precision)
+
+    return []  # pragma: no cover
+
+
+def geohash_cells(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int) -> list[str]:
+    """Returns all geohash cells of given precision that intersect given bounding box."""
+
+    lat_range, lon_range, height, width = _geohash_cover_ranges(min_lat, min_lon, max_lat, max_lon, precision)
+    return [
+        geohash_encode(-90 + (lat_idx + .5) * height, -180 + (lon_idx + .5) * width, precision)
+        for lat_idx in lat_range
+        for lon_idx in lon_range
+    ]
+
+
+def geohash_prefixes(geohash: str) -> list[str]:
+    return [geohash[:i] for i in range(1, len(geohash) + 1)]
+
+
+def circle_bbox(lat: float, lon: float, radius: float) -> tuple[float, float, float, float]:
+    """Returns (min_lat, min_lon, max_lat, max_lon) of bounding box of a circle with given radius (in meters)."""
+
+    d_lat = radius / METERS_PER_DEGREE
+    d_lon = radius / (METERS_PER_DEGREE * max(cos(radians(lat)), 0.01))
+    return max(lat - d_lat, -90), max(lon - d_lon, -180), min(lat + d_lat, 90), min(lon + d_lon, 180)
+
+
+def polygon_bbox(polygon: Sequence[Sequence[float]]) -> tuple[float, float, float, float]:
+    lats = [lat for lat, _ in polygon]
+    lons = [lon for _, lon in polygon]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def polygon_contains(polygon: Sequence[Sequence[float]], lat: float, lon: float) -> bool:
+    """Checks if point is inside of polygon (list of [lat, lon] vertices) using ray casting."""
+
+    inside = False
+    count = len(polygon)
+    for i in range(count):
+        lat1, lon1 = polygon[i]
+        lat2, lon2 = polygon[i - 1]
+        if (lat1 > lat) != (lat2 > lat) and lon < (lon2 - lon1) * (lat - lat1) / (lat2 - lat1) + lon1:
+            inside = not inside
+
+    return inside
@@ -1,27 +1,128 @@
+import json
+import re
+from asyncio import Task, create_task, get_running_loop, sleep
+from time import time
+
 from httpx import AsyncClient
+from loguru import logger
 
+from kkp.config import REDIS
 from kkp.utils.jwt import JWT
 
 # The URL that provides public certificates for verifying ID tokens issued
 # by Google's OAuth 2.0 authorization server.
 GOOGLE_OAUTH2_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
 GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
-_GOOGLE_CERTS = None
-
-
-async def _fetch_certs() -> dict[str, str]:
-    global _GOOGLE_CERTS
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
 
-    if _GOOGLE_CERTS is not None:
-        return _GOOGLE_CERTS
 
-    async with AsyncClient(follow_redirects=True) as cl:
-        resp = await cl.get(GOOGLE_OAUTH2_CERTS_URL)
-        if resp.status_code >= 400:
-            return {}
-        _GOOGLE_CERTS = resp.json()
+class GoogleCerts:
+    """
+    Cache of google signing certificates.
+    Certificates are kept for as long as Cache-Control: max-age allows and are refreshed in background
+    some time before they expire. Fetched certificates are shared between workers through redis,
+    so only one worker actually fetches them from google.
+    """
 
-    return _GOOGLE_CERTS
+    REDIS_KEY = "google-oauth2-certs"
+    REDIS_LOCK_KEY = "google-oauth2-certs-lock"
+    DEFAULT_MAX_AGE = 60 * 60
+    REFRESH_BEFORE = 60 * 5
+    # Minimum interval between fetches caused by tokens with unknown key ids
+    MIN_FETCH_INTERVAL = 60
+
+    def __init__(self, url: str) -> None:
+        self._url = url
+        self._certs: dict[str, str] = {}
+        self._expires_at = 0.
+        self._last_fetch = 0.
+        self._refresh_task: Task | None = None
+
+    def clear(self) -> None:
+        self._certs = {}
+        self._expires_at = 0.
+        self._last_fetch = 0.
+        self._refresh_task = None
+
+    def _should_fetch(self, kid: str | None = None) -> bool:
+        now = time()
+        if not self._certs or now >= self._expires_at - self.REFRESH_BEFORE:
+            return True
+        return kid is not None and kid not in self._certs and now - self._last_fetch >= self.MIN_FETCH_INTERVAL
+
+    async def _load_shared(self) -> bool:
+        if (data := await REDIS.get(self.REDIS_KEY)) is None:
+            return False
+
+        data = json.loads(data)
+        if data["expires_at"] <= time():
+            return False
+
+        self._certs = data["certs"]
+        self._expires_at = data["expires_at"]
+        return True
+
+    async def _fetch(self) -> None:
+        self._last_fetch = time()
+        async with AsyncClient(follow_redirects=True) as cl:
+            resp = await cl.get(self._url)
+            if resp.status_code >= 400:
+                logger.warning(f"Failed to fetch google certs, status code is {resp.status_code}")
+                return
+
+        max_age = self.DEFAULT_MAX_AGE
+        if (match := _MAX_AGE_RE.search(resp.headers.get("cache-control", ""))) is not None:
+            max_age = int(match.group(1))
+
+        self._certs = resp.json()
+        self._expires_at = time() + max_age
+        await REDIS.set(self.REDIS_KEY, json.dumps({
+            "certs": self._certs,
+            "expires_at": self._expires_at,
+        }), ex=max(max_age, 1))
+
+    async def _refresh(self, kid: str | None) -> None:
+        try:
+            if await self._load_shared() and not self._should_fetch(kid):
+                return
+
+            if not await REDIS.set(self.REDIS_LOCK_KEY, 1, nx=True, ex=10):
+                # Another worker is fetching certs right now, wait for it to put them in redis
+                for _ in range(10):
+                    await sleep(.2)
+                    if await self._load_shared() and (kid is None or kid in self._certs):
+                        return
+                return
+
+            try:
+                await self._fetch()
+            finally:
+                await REDIS.delete(self.REDIS_LOCK_KEY)
+        except Exception as e:
+            logger.opt(exception=e).warning("Failed to refresh google certs")
+
+    def refresh(self, kid: str | None = None) -> Task:
+        task = self._refresh_task
+        if task is None or task.done() or task.get_loop() is not get_running_loop():
+            self._refresh_task = task = create_task(self._refresh(kid))
+        return task
+
+    async def get(self, kid: str | None = None) -> dict[str, str]:
+        if not self._should_fetch(kid):
+            return self._certs
+
+        if self._certs and (kid is None or kid in self._certs):
+            # Certs that are about to expire (or even a bit stale) are still valid for known keys,
+            #  so request is not blocked while certs are refreshed
+            self.refresh()
+            return self._certs
+
+        # Certs are not loaded yet or token is signed by a new key
+        await self.refresh(kid)
+        return self._certs
+
+
+GOOGLE_CERTS = GoogleCerts(GOOGLE_OAUTH2_CERTS_URL)
 
 
 async def verify_token(id_token: str) -> dict[str, ...]:
@@ -33,7 +134,8 @@ async def verify_token(id_token: str) -> dict[str, ...]:
     Returns:
         Mapping[str, Any]: The decoded token.
     """
-    certs = await _fetch_certs()
+    header = JWT.unverified_header(id_token)
+    certs = await GOOGLE_CERTS.get(header.get("kid") if header is not None else None)
 
     return JWT.decode(
         id_token,
@@ -1,9 +1,11 @@
 import hmac
-import json
 from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import OrderedDict
+from functools import lru_cache
 from hashlib import sha256
 from time import time
 
+import orjson
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat import backends
 from cryptography.hazmat.primitives import hashes, serialization
@@ -21,13 +23,23 @@ def assert_(value: ..., exc_cls: type[Exception] = ValueError):  # pragma: no co
         raise exc_cls
 
 
+@lru_cache(maxsize=32)
+def _load_public_key(key: bytes):
+    # Keyed by pem itself and not by key id, so rotated keys are never confused and old ones are evicted
+    if _CERTIFICATE_MARKER in key:
+        return load_pem_x509_certificate(key, JWT_RS_BACKEND).public_key()
+    return serialization.load_pem_public_key(key, JWT_RS_BACKEND)
+
+
 class JWT:
-    _PUBKEY_CACHE = {}
+    # Recently verified HS256 tokens: signature -> (signed part, secret, exp, payload json)
+    _VERIFIED_CACHE: OrderedDict[str, tuple[str, bytes, int, bytes]] = OrderedDict()
+    VERIFIED_CACHE_SIZE = 1024
 
     @staticmethod
     def _b64encode(data: bytes | dict) -> str:
         if isinstance(data, dict):
-            data = json.dumps(data, separators=(',', ':')).encode("utf8")
+            data = orjson.dumps(data)
 
         return urlsafe_b64encode(data).decode("utf8").strip("=")
 
@@ -47,16 +59,8 @@ class JWT:
         return sig
 
     @staticmethod
-    def _verify_rs256(data: bytes, key: bytes, signature: bytes, kid: str) -> bytes:
-        if kid not in JWT._PUBKEY_CACHE:
-            if _CERTIFICATE_MARKER in key:
-                cert = load_pem_x509_certificate(key, JWT_RS_BACKEND)
-                pubkey = cert.public_key()
-            else:
-                pubkey = serialization.load_pem_public_key(key, JWT_RS_BACKEND)
-            JWT._PUBKEY_CACHE[kid] = pubkey
-
-        pubkey = JWT._PUBKEY_CACHE[kid]
+    def _verify_rs256(data: bytes, key: bytes, signature: bytes) -> bytes:
+        pubkey = _load_public_key(key)
 
         try:
             pubkey.verify(signature, data, JWT_RS_PADDING, JWT_RS_SHA256)
@@ -64,32 +68,83 @@ class JWT:
         except (ValueError, InvalidSignature):
             return b""
 
+    @staticmethod
+    def unverified_header(token: str) -> dict | None:
+        try:
+            header = orjson.loads(JWT._b64decode(token.split(".", 1)[0]))
+        except ValueError:
+            return None
+        return header if isinstance(header, dict) else None
+
+    @staticmethod
+    def _get_verified(token: str, signature: str, secret: str | bytes | dict[str, str]) -> dict | None:
+        if (cached := JWT._VERIFIED_CACHE.get(signature)) is None:
+            return None
+
+        signed, cached_secret, exp, payload = cached
+        if exp != 0 and exp <= time():
+            del JWT._VERIFIED_CACHE[signature]
+            return None
+        if not isinstance(secret, bytes) or not hmac.compare_digest(cached_secret, secret):
+            return None
+        # Token must be exactly the same, not just have the same signature
+        if len(token) != len(signed) + len(signature) + 1 or not token.startswith(signed):
+            return None
+
+        JWT._VERIFIED_CACHE.move_to_end(signature)
+        # Parsed again, so callers can't modify cached payload (including nested values)
+        return orjson.loads(payload)
+
+    @staticmethod
+    def _put_verified(signed: str, signature: str, secret: bytes, exp: int, payload: bytes) -> None:
+        JWT._VERIFIED_CACHE[signature] = (signed, secret, exp, payload)
+        if len(JWT._VERIFIED_CACHE) > JWT.VERIFIED_CACHE_SIZE:
+            JWT._VERIFIED_CACHE.popitem(last=False)
+
     @staticmethod
     def decode(token: str, secret: str | bytes | dict[str, str]) -> dict | None:
         try:
-            header, payload, signature = token.split(".")
-            header_dict = json.loads(JWT._b64decode(header).decode("utf8"))
+            header, payload, signature_b64 = token.split(".")
+        except ValueError:
+            return None
+
+        if (cached := JWT._get_verified(token, signature_b64, secret)) is not None:
+            return cached
+
+        try:
+            header_dict = orjson.loads(JWT._b64decode(header))
             assert_(header_dict.get("alg") in ("HS256", "RS256"))
             assert_(header_dict.get("typ") == "JWT")
             assert_((exp := header_dict.get("exp", 0)) > time() or exp == 0)
-            signature = JWT._b64decode(signature)
-        except (IndexError, ValueError):
+            signature = JWT._b64decode(signature_b64)
+        except (AttributeError, ValueError):
             return None
 
-        data = f"{header}.{payload}".encode("utf8")
+        signed = f"{header}.{payload}"
+        data = signed.encode("utf8")
         if header_dict["alg"] == "HS256":
             sig = JWT._verify_hs256(data, secret)
         elif header_dict["alg"] == "RS256":
             if (kid := header_dict.get("kid")) is None or not isinstance(secret, dict) or kid not in secret:
                 return None
 
-            sig = JWT._verify_rs256(data, secret[kid].encode("utf8"), signature, kid)
+            sig = JWT._verify_rs256(data, secret[kid].encode("utf8"), signature)
         else:
             return None
 
-        if sig == signature:
-            payload = JWT._b64decode(payload).decode("utf8")
-            return json.loads(payload)
+        if not hmac.compare_digest(sig, signature):
+            return None
+
+        try:
+            payload_json = JWT._b64decode(payload)
+            payload = orjson.loads(payload_json)
+        except ValueError:
+            return None
+
+        if header_dict["alg"] == "HS256" and isinstance(payload, dict):
+            JWT._put_verified(signed, signature_b64, secret, exp, payload_json)
+
+        return payload
 
     @staticmethod
     def encode(
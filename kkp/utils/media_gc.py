@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from asyncio import sleep
+from time import monotonic, time
+
+from loguru import logger
+
+from kkp.config import S3, config
+from kkp.models import Media, MediaStatus, NotificationJob, NotificationJobStatus
+from kkp.utils.media_processing import delete_media_objects
+from kkp.utils.outbox import Outbox
+
+# S3 DeleteObjects accepts at most 1000 keys
+_DELETE_CHUNK_SIZE = 1000
+
+
+class MediaGcStats:
+    def __init__(self, dry_run: bool) -> None:
+        self.dry_run = dry_run
+        self.found = 0
+        self.deleted_media = 0
+        self.deleted_objects = 0
+        self.failed_objects = 0
+        self.finished = False
+        self.started_at = monotonic()
+        self.elapsed = 0.
+
+    def stop(self) -> None:
+        self.elapsed = monotonic() - self.started_at
+
+    def __str__(self) -> str:
+        rate = self.found / self.elapsed if self.elapsed else 0
+        return (
+            f"{'[dry run] ' if self.dry_run else ''}found {self.found} orphaned media, "
+            f"deleted {self.deleted_media} media and {self.deleted_objects} objects "
+            f"({self.failed_objects} objects failed and will be retried) in {self.elapsed:.2f}s ({rate:.1f} media/s)"
+            f"{'' if self.finished else ', not finished'}"
+        )
+
+
+class MediaGc:
+    """
+    Deletes orphaned media: uploads that were never finalized and finalized media that is not referenced
+    by anything (animal, report, message, profile photo, volunteer request) for media_gc_grace seconds.
+    References are discovered from relations of Media model, so new referencing tables are taken into account.
+    Rows are deleted before objects, and deletion re-checks references, so media that was attached
+    after it was selected is not deleted.
+    """
+
+    @staticmethod
+    def _unreferenced_sql() -> str:
+        references = []
+        for name in Media._meta.m2m_fields:
+            field = Media._meta.fields_map[name]
+            references.append((field.through, field.backward_key))
+        for name in Media._meta.backward_fk_fields:
+            field = Media._meta.fields_map[name]
+            references.append((field.related_model._meta.db_table, field.relation_field))
+
+        return " AND ".join(
+            f"NOT EXISTS (SELECT 1 FROM `{table}` `ref` WHERE `ref`.`{column}`=`media`.`id`)"
+            for table, column in references
+        ) or "TRUE"
+
+    @classmethod
+    def _orphaned_sql(cls) -> str:
+        return (
+            f"((`media`.`status`={MediaStatus.CREATED.value} AND `media`.`uploaded_at` < "
+            f"IF(`media`.`upload_id` IS NULL, FROM_UNIXTIME(%s), FROM_UNIXTIME(%s))) "
+            f"OR (`media`.`status`={MediaStatus.UPLOADED.value} AND `media`.`uploaded_at` < FROM_UNIXTIME(%s) "
+            f"AND {cls._unreferenced_sql()}))"
+        )
+
+    @staticmethod
+    def _cutoffs() -> list[int]:
+        now = int(time())
+        return [
+            now - 60 * 60 * 2,
+            now - config.multipart_upload_ttl - 60 * 60 * 2,
+            now - config.media_gc_grace,
+        ]
+
+    @classmethod
+    async def _delete(cls, batch: list[Media], stats: MediaGcStats) -> None:
+        ids = [media.id for media in batch]
+        db = Media._choose_db()
+        await db.execute_query(
+            f"DELETE `media` FROM `{Media._meta.db_table}` `media` "
+            f"WHERE `media`.`id` IN ({','.join(['%s'] * len(ids))}) AND {cls._orphaned_sql()}",
+            [*ids, *cls._cutoffs()],
+        )
+        remaining = set(await Media.filter(id__in=ids).values_list("id", flat=True))
+        deleted = [media for media in batch if media.id not in remaining]
+        stats.deleted_media += len(deleted)
+
+        for media in deleted:
+            if media.upload_id is not None:
+                await S3.abort_multipart_upload(config.s3_bucket_name, media.object_key(), media.upload_id)
+
+        # Objects of deduplicated media are deleted only with the last media that uses them
+        shared = set(await Media.filter(media_id__in=[media.media_id for media in deleted]).values_list(
+            "media_id", flat=True,
+        ))
+        keys = [key for media in deleted if media.media_id not in shared for key in media.object_keys()]
+        for i in range(0, len(keys), _DELETE_CHUNK_SIZE):
+            chunk = keys[i:i + _DELETE_CHUNK_SIZE]
+            try:
+                failed = await S3.delete_objects(config.s3_bucket_name, chunk)
+            except Exception as e:
+                logger.opt(exception=e).warning(f"Failed to delete {len(chunk)} media objects")
+                failed = chunk
+            stats.deleted_objects += len(chunk) - len(failed)
+            stats.failed_objects += len(failed)
+            # Rows are already deleted, so nothing else references these objects, deletion is retried by outbox
+            if failed:
+                await Outbox.enqueue(delete_media_objects, keys=failed)
+
+    @classmethod
+    async def run(
+            cls, dry_run: bool = False, batch_size: int | None = None, max_time: float | None = None,
+    ) -> MediaGcStats:
+        batch_size = batch_size or config.media_gc_batch_size
+        stats = MediaGcStats(dry_run)
+        db = Media._choose_db()
+        last_id = 0
+
+        while max_time is None or monotonic() - stats.started_at < max_time:
+            rows = await db.execute_query_dict(
+                f"SELECT `media`.`id` FROM `{Media._meta.db_table}` `media` "
+                f"WHERE `media`.`id` > %s AND {cls._orphaned_sql()} "
+                f"ORDER BY `media`.`id` LIMIT %s",
+                [last_id, *cls._cutoffs(), batch_size],
+            )
+            if not rows:
+                stats.finished = True
+                break
+
+            ids = [row["id"] for row in rows]
+            last_id = ids[-1]
+            stats.found += len(ids)
+            if not dry_run:
+                await cls._delete(await Media.filter(id__in=ids), stats)
+
+        stats.stop()
+        logger.info(f"Media gc: {stats}")
+        return stats
+
+    @classmethod
+    async def schedule(cls) -> None:
+        """Starts periodic gc if it is not scheduled already."""
+
+        if config.media_gc_interval <= 0:
+            return
+        if await NotificationJob.filter(
+                task=collect_orphaned_media.__name__,
+                status__in=(NotificationJobStatus.PENDING, NotificationJobStatus.RUNNING),
+        ).exists():
+            return
+
+        await Outbox.enqueue(collect_orphaned_media)
+
+    @classmethod
+    async def supervise(cls) -> None:
+        """Runs in worker process and restarts periodic gc if chain of its jobs was broken (e.g. job died)."""
+
+        while config.media_gc_interval > 0:
+            try:
+                await cls.schedule()
+            except Exception as e:
+                logger.opt(exception=e).warning("Failed to schedule media gc")
+            await sleep(config.media_gc_interval)
+
+
+@Outbox.task
+async def collect_orphaned_media() -> None:
+    # Big backlog is processed in several jobs, so a job does not exceed outbox job timeout.
+    #  Errors are not retried by outbox, next run is scheduled anyway.
+    finished = True
+    try:
+        finished = (await MediaGc.run(max_time=config.outbox_job_timeout / 2)).finished
+    except Exception as e:
+        logger.opt(exception=e).error("Media gc failed")
+
+    if config.media_gc_interval > 0:
+        await Outbox.enqueue(collect_orphaned_media, delay=0 if not finished else config.media_gc_interval)
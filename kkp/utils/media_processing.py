@@ -0,0 +1,265 @@
+from asyncio import get_running_loop, gather
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+
+from PIL import Image, ImageOps, ExifTags
+from loguru import logger
+from tortoise.transactions import in_transaction
+
+from kkp.config import S3, config
+from kkp.models import Media, MediaStatus, MediaType, Animal, AnimalReport, Message, VolunteerRequest, \
+    UserProfilePhoto
+from kkp.utils.cache import Cache
+from kkp.utils.outbox import Outbox
+from kkp.utils.phash import dhash, set_phash
+
+
+class MediaProcessor:
+    """
+    Generates resized WebP variants of uploaded photos, so clients can download image of size they actually display,
+    and a tiny (16px) placeholder that is embedded into media json as data uri.
+    Photos with the same content (sha256) are deduplicated: duplicate media is pointed to the object
+    of the first one, and its own object is deleted.
+    Perceptual hash of every photo is stored too, so similar photos of animals can be found (see kkp.utils.phash).
+    Runs in outbox worker after upload is finalized, decoding and encoding is done in a dedicated thread pool
+    (Pillow releases the GIL while doing it), so it does not block the event loop.
+    """
+
+    PHASH_FIELDS = ("phash", "phash_0", "phash_1", "phash_2", "phash_3")
+    # Fields that are the same for media with the same content
+    COPIED_FIELDS = ("size", "content_type", "width", "height", "variants", "placeholder", *PHASH_FIELDS)
+
+    _executor: ThreadPoolExecutor | None = None
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=config.media_processing_workers, thread_name_prefix="media",
+            )
+        return cls._executor
+
+    @staticmethod
+    def _make_placeholder(img: Image.Image) -> str:
+        size = config.media_placeholder_size
+        placeholder = ImageOps.contain(img, (size, size), Image.Resampling.BOX)
+        out = BytesIO()
+        placeholder.save(out, "WEBP", quality=config.media_placeholder_quality)
+        return f"data:image/webp;base64,{b64encode(out.getvalue()).decode('ascii')}"
+
+    @staticmethod
+    def _check_pixels(img: Image.Image) -> None:
+        if img.width * img.height > config.media_max_pixels:
+            raise Image.DecompressionBombError(f"Image is too big: {img.width}x{img.height}")
+
+    @classmethod
+    def _make_variants(cls, data: bytes, widths: list[int]) -> tuple[int, int, dict[int, bytes], str, int]:
+        with Image.open(BytesIO(data)) as img:
+            cls._check_pixels(img)
+
+            # Exif orientations 5-8 are rotated by 90 degrees
+            width, height = img.size
+            if img.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+                width, height = height, width
+
+            # Jpeg is decoded at reduced scale if it is much bigger than the biggest variant,
+            #  size is requested for both sides because orientation may swap them
+            if widths:
+                img.draft("RGB", (max(widths), max(widths)))
+            img = ImageOps.exif_transpose(img)
+            phash = dhash(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+
+            variants = {}
+            for variant_width in widths:
+                if variant_width >= width:
+                    continue
+                variant_height = max(round(height * variant_width / width), 1)
+                out = BytesIO()
+                img.resize((variant_width, variant_height), Image.Resampling.LANCZOS, reducing_gap=3.0) \
+                    .save(out, "WEBP", quality=config.media_variant_quality, method=4)
+                variants[variant_width] = out.getvalue()
+
+            placeholder = cls._make_placeholder(img)
+
+        return width, height, variants, placeholder, phash
+
+    @classmethod
+    def _make_phash(cls, data: bytes) -> int:
+        with Image.open(BytesIO(data)) as img:
+            cls._check_pixels(img)
+            # Decoded the same way as in _make_variants, so hash does not depend on where it was computed
+            widths = config.media_variant_widths
+            if widths:
+                img.draft("RGB", (max(widths), max(widths)))
+            return dhash(ImageOps.exif_transpose(img))
+
+    @staticmethod
+    def _sha256(data: bytes) -> str:
+        return sha256(data).hexdigest()
+
+    @staticmethod
+    async def _invalidate_cached_json(media: Media) -> None:
+        # Media json (urls, size, placeholder) is embedded into cached json of objects that reference it
+        objects = [
+            *await Animal.filter(medias__id=media.id),
+            *await AnimalReport.filter(media__id=media.id),
+            *await Message.filter(media__id=media.id),
+            *await VolunteerRequest.filter(medias__id=media.id),
+        ]
+        for profile_photo in await UserProfilePhoto.filter(photo__id=media.id).select_related("user"):
+            objects.append(profile_photo.user)
+
+        for obj in objects:
+            await Cache.delete_obj(obj)
+
+    @classmethod
+    async def _deduplicate(cls, media: Media) -> bool:
+        async with in_transaction():
+            # Original row is locked until media is repointed to its objects, so media gc can't delete it
+            #  (and its objects, which are not shared yet) in the meantime. If gc deleted it already, it is not found.
+            #  Media gets sha256 only when it is processed, so original always has its variants already.
+            original = await Media.filter(
+                sha256=media.sha256, type=media.type, status=MediaStatus.UPLOADED,
+            ).exclude(media_id=media.media_id).order_by("id").select_for_update().first()
+            if original is None:
+                return False
+
+            old_keys = media.object_keys()
+            old_media_id = media.media_id
+            media.media_id = original.media_id
+            for field in cls.COPIED_FIELDS:
+                setattr(media, field, getattr(original, field))
+            await media.save(update_fields=["media_id", "sha256", *cls.COPIED_FIELDS])
+
+            # Urls of its own object were already given to the client, so it is deleted later
+            await Outbox.enqueue(
+                delete_media_objects, delay=config.media_dedup_delete_delay,
+                media_id=str(old_media_id), keys=old_keys,
+            )
+
+        await cls._invalidate_cached_json(media)
+        return True
+
+    @classmethod
+    async def process(cls, media: Media) -> None:
+        original = (await S3.download_object(config.s3_bucket_name, media.object_key(), in_memory=True)).getvalue()
+        loop = get_running_loop()
+
+        media.sha256 = await loop.run_in_executor(cls._get_executor(), cls._sha256, original)
+        if await cls._deduplicate(media):
+            return
+
+        try:
+            width, height, variants, placeholder, phash = await loop.run_in_executor(
+                cls._get_executor(), cls._make_variants, original, config.media_variant_widths,
+            )
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # Retrying will not help with a file Pillow can't decode, original is still served
+            logger.opt(exception=e).warning(f"Failed to generate variants of media {media.id}")
+            await media.save(update_fields=["sha256"])
+            return
+
+        await gather(*(
+            S3.upload_object(config.s3_bucket_name, media.variant_key(variant_width), BytesIO(data))
+            for variant_width, data in variants.items()
+        ))
+
+        media.width = width
+        media.height = height
+        media.variants = sorted(variants)
+        media.placeholder = placeholder
+        set_phash(media, phash)
+        await media.save(update_fields=["width", "height", "variants", "placeholder", "sha256", *cls.PHASH_FIELDS])
+        await cls._invalidate_cached_json(media)
+
+    @classmethod
+    async def ensure_phash(cls, media: Media) -> bool:
+        """
+        Computes perceptual hash of photo that was not processed yet (processing job is still pending).
+        Returns False if photo can't be decoded.
+        """
+
+        if media.phash is not None:
+            return True
+
+        data = (await S3.download_object(config.s3_bucket_name, media.object_key(), in_memory=True)).getvalue()
+        try:
+            phash = await get_running_loop().run_in_executor(cls._get_executor(), cls._make_phash, data)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.opt(exception=e).warning(f"Failed to compute perceptual hash of media {media.id}")
+            return False
+
+        set_phash(media, phash)
+        await media.save(update_fields=list(cls.PHASH_FIELDS))
+        return True
+
+    @classmethod
+    async def backfill_phash(cls, batch_size: int = 16) -> tuple[int, int]:
+        """
+        Computes perceptual hashes of photos that were processed before hashes were introduced.
+        Returns number of hashed photos and number of photos that failed (can't be downloaded or decoded).
+        """
+
+        hashed = failed = 0
+        last_id = 0
+        while True:
+            medias = await Media.filter(
+                id__gt=last_id, type=MediaType.PHOTO, status=MediaStatus.UPLOADED, phash__isnull=True,
+            ).order_by("id").limit(batch_size)
+            results = await gather(*(cls.ensure_phash(media) for media in medias), return_exceptions=True)
+            for media, result in zip(medias, results):
+                if isinstance(result, Exception):
+                    logger.opt(exception=result).warning(f"Failed to compute perceptual hash of media {media.id}")
+                if result is True:
+                    hashed += 1
+                else:
+                    failed += 1
+
+            if len(medias) < batch_size:
+                return hashed, failed
+            last_id = medias[-1].id
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
+
+
+@Outbox.task
+async def process_media(media_id: int) -> None:
+    media = await Media.get_or_none(id=media_id, status=MediaStatus.UPLOADED)
+    if media is None or media.type is not MediaType.PHOTO:
+        return
+
+    await MediaProcessor.process(media)
+
+
+@Outbox.task
+async def abort_multipart_upload(media_id: int) -> None:
+    """Aborts multipart upload that was not finalized in time, so its parts do not occupy storage forever."""
+
+    media = await Media.get_or_none(id=media_id, status=MediaStatus.CREATED, upload_id__not_isnull=True)
+    if media is None:
+        return
+
+    await S3.abort_multipart_upload(config.s3_bucket_name, media.object_key(), media.upload_id)
+    await media.delete()
+
+
+@Outbox.task
+async def delete_media_objects(keys: list[str], media_id: str | None = None) -> None:
+    """
+    Deletes objects of media that was deduplicated (unless other media uses them) or objects that media gc
+    failed to delete. Job fails if some objects were not deleted, so they are retried instead of being leaked.
+    """
+
+    if media_id is not None and await Media.filter(media_id=media_id).exists():
+        return
+
+    if failed := await S3.delete_objects(config.s3_bucket_name, keys):
+        raise RuntimeError(f"Failed to delete {len(failed)} media objects: {failed[:10]!r}")
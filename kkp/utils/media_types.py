@@ -0,0 +1,52 @@
+from kkp.models import MediaType
+
+# Number of bytes from the beginning of a file that is enough to detect its type
+SNIFF_SIZE = 64
+
+_IMAGE_FTYP_BRANDS = {
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"heim": "image/heic",
+    b"heis": "image/heic",
+    b"mif1": "image/heif",
+    b"msf1": "image/heif",
+    b"avif": "image/avif",
+    b"avis": "image/avif",
+}
+_VIDEO_FTYP_BRANDS = {
+    b"qt  ": "video/quicktime",
+    b"3gp4": "video/3gpp",
+    b"3gp5": "video/3gpp",
+    b"3gp6": "video/3gpp",
+    b"3g2a": "video/3gpp2",
+}
+
+
+def sniff_content_type(header: bytes) -> str | None:
+    """Detects content type of photo or video by its first SNIFF_SIZE bytes (magic numbers)."""
+
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video/webm"
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand in _IMAGE_FTYP_BRANDS:
+            return _IMAGE_FTYP_BRANDS[brand]
+        return _VIDEO_FTYP_BRANDS.get(brand, "video/mp4")
+
+    return None
+
+
+def content_type_matches(content_type: str | None, media_type: MediaType) -> bool:
+    if content_type is None:
+        return False
+    if media_type is MediaType.PHOTO:
+        return content_type.startswith("image/")
+    return content_type.startswith("video/")
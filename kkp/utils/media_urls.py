@@ -0,0 +1,45 @@
+from collections import OrderedDict
+from time import time
+
+from kkp.config import S3_PUBLIC, config
+
+
+class MediaUrls:
+    """
+    Builds urls of media objects.
+    In "public" mode (bucket has public-read policy) urls are plain unsigned urls, so they never change
+    and can be cached by clients and http caches. In "presigned" mode signed urls are cached in memory
+    and reused until they are close to expiring, so signing is not done on every serialization
+    and clients get the same url for the same object most of the time.
+    """
+
+    _presigned: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    @classmethod
+    def _public_url(cls, key: str) -> str:
+        base = config.media_url_base or f"{config.s3_endpoint_public.rstrip('/')}/{config.s3_bucket_name}"
+        return f"{base}/{key}"
+
+    @classmethod
+    def _presigned_url(cls, key: str) -> str:
+        now = time()
+        if (cached := cls._presigned.get(key)) is not None:
+            url, expires_at = cached
+            # Url is reused only while at least half of its ttl is left, so client always has time to use it
+            if expires_at - now > config.media_url_ttl / 2:
+                cls._presigned.move_to_end(key)
+                return url
+
+        url = S3_PUBLIC.share(config.s3_bucket_name, key, config.media_url_ttl)
+        cls._presigned[key] = (url, now + config.media_url_ttl)
+        cls._presigned.move_to_end(key)
+        while len(cls._presigned) > config.media_url_cache_size:
+            cls._presigned.popitem(last=False)
+
+        return url
+
+    @classmethod
+    def get(cls, key: str) -> str:
+        if config.media_url_mode == "public":
+            return cls._public_url(key)
+        return cls._presigned_url(key)
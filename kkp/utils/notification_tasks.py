@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+
+from pytz import UTC
+
+from kkp.config import config
+from kkp.db.point import mbr_contains_sql, decode_points
+from kkp.models import AnimalReport, Session, UserRole, Geofence, User, VolunteerRequest, VolRequestStatus, \
+    AnimalUpdate, AnimalUpdateType, Animal, TreatmentReport
+from kkp.utils.geo import within_radius
+from kkp.utils.jwt import JWT
+from kkp.utils.notification_util import send_notification, send_push, push_tokens
+from kkp.utils.outbox import Outbox
+
+
+@Outbox.task
+async def send_animal_report_notification(report_id: int) -> None:
+    report = await AnimalReport.get_or_none(id=report_id).select_related("animal", "location")
+    if report is None:
+        return
+
+    animal = report.animal
+    location = report.location
+
+    point = location.point
+    radius_m = 25000
+    before_time = int((datetime.now(UTC) - timedelta(days=14)).timestamp())
+
+    # Only columns needed for sending notification are selected, exact distance
+    #  is calculated for all candidates at once instead of calling ST_Distance_Sphere for every row.
+    #  Subscribers of the animal are skipped, they are notified about the report by send_animal_update_notification
+    subscriptions = User._meta.fields_map["subscriptions"]
+    db = Session._choose_db()
+    rows = await db.execute_query_dict(f"""
+            SELECT `session`.`id`,`session`.`fcm_token`,`session`.`location`
+            FROM `session`
+            LEFT OUTER JOIN `user` `session__user` ON `session__user`.`id`=`session`.`user_id`
+            WHERE {mbr_contains_sql(point, radius_m, 'location')}
+                AND `session`.`location_time` > FROM_UNIXTIME({before_time})
+                AND `session`.`fcm_token` IS NOT NULL
+                AND `session__user`.`role` IN ({UserRole.VET.value}, {UserRole.VOLUNTEER.value})
+                AND NOT EXISTS (
+                    SELECT 1 FROM `{subscriptions.through}` `sub`
+                    WHERE `sub`.`{subscriptions.backward_key}`=`session`.`user_id`
+                        AND `sub`.`{subscriptions.forward_key}`={animal.id}
+                )
+        """)
+
+    locations = decode_points([row["location"] for row in rows])
+    await send_push(
+        "New animal needs your help!",
+        f"Name: {animal.name}\nBreed: {animal.breed}\nNotes: {report.notes}",
+        {
+            rows[idx]["id"]: rows[idx]["fcm_token"]
+            for idx in within_radius(point.lon, point.lat, locations, radius_m)
+        },
+    )
+
+
+@Outbox.task
+async def send_animal_report_geofence_notification(report_id: int) -> None:
+    report = await AnimalReport.get_or_none(id=report_id).select_related("animal", "location")
+    if report is None:
+        return
+
+    animal = report.animal
+    location = report.location
+
+    geofences = await Geofence.get_matching(location.latitude, location.longitude)
+    user_ids = {geofence.user_id for geofence in geofences if geofence.user_id != report.reported_by_id}
+    if user_ids:
+        # Subscribers of the animal are notified about the report by send_animal_update_notification
+        user_ids -= set(await User.filter(id__in=user_ids, subscriptions__id=animal.id).values_list("id", flat=True))
+    if not user_ids:
+        return
+
+    await send_push(
+        "New animal reported in your area",
+        f"Name: {animal.name}\nBreed: {animal.breed}\nNotes: {report.notes}",
+        await push_tokens(user_ids),
+    )
+
+
+@Outbox.task
+async def send_animal_update_notification(update_id: int) -> None:
+    update = await AnimalUpdate.get_or_none(id=update_id).select_related("animal")
+    if update is None:
+        return
+
+    animal = update.animal
+    if update.type is AnimalUpdateType.REPORT:
+        title = f"New report about {animal.name}"
+    elif update.type is AnimalUpdateType.TREATMENT:
+        title = f"{animal.name} received treatment"
+    else:
+        title = f"{animal.name} was updated"
+    text = f"Name: {animal.name}\nBreed: {animal.breed}"
+
+    async for user_ids in Animal.subscriber_ids(animal.id, config.subscribers_chunk_size):
+        await send_push(title, text, await push_tokens(user_ids))
+
+
+@Outbox.task
+async def send_password_reset_email(user_id: int) -> None:
+    if (user := await User.get_or_none(id=user_id)) is None:
+        return
+
+    # Token is created when email is sent, so it is not stored in outbox
+    reset_token = JWT.encode({"u": user.id, "type": "password-reset"}, config.jwt_key, expires_in=60 * 30)
+    await send_notification(
+        user,
+        "Password reset",
+        (
+            f"Click the following link to reset your password: "
+            f"{config.public_host}/reset-password?reset_token={reset_token}\n"
+            f"Or enter this token in token field in reset password dialog window: {reset_token}"
+        ),
+        fcm=False,
+    )
+
+
+@Outbox.task
+async def send_volunteer_request_notification(volunteer_request_id: int, email: bool = True, fcm: bool = True) -> None:
+    vol_request = await VolunteerRequest.get_or_none(id=volunteer_request_id).select_related("user")
+    if vol_request is None or vol_request.status == VolRequestStatus.REQUESTED:
+        return
+
+    type_ = "approved" if vol_request.status == VolRequestStatus.APPROVED else "rejected"
+    comment = vol_request.review_text
+    await send_notification(
+        vol_request.user,
+        f"Volunteer request {type_}",
+        (
+                f"Your volunteer request has been {type_}!\n"
+                + (f"Comment: \n{comment}" if comment else "")
+        ),
+        email=email,
+        fcm=fcm,
+    )
+
+
+@Outbox.task
+async def send_payout_approved_notification(treatment_report_id: int, email: bool = True, fcm: bool = True) -> None:
+    t_report = await TreatmentReport.get_or_none(id=treatment_report_id).select_related("report__assigned_to")
+    if t_report is None or t_report.report.assigned_to is None:
+        return
+
+    await send_notification(
+        t_report.report.assigned_to,
+        "Payout approved",
+        "Payout for animal treatment report was approved",
+        email=email,
+        fcm=fcm,
+    )
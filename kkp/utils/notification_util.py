@@ -1,11 +1,116 @@
+from asyncio import Semaphore, gather
+from collections import defaultdict
 from email.message import EmailMessage
 
+import orjson
 from loguru import logger
 
-from kkp.config import SMTP, FCM
+from kkp.config import SMTP, FCM, config
 from kkp.models import User, Session
 
 
+def _fcm_error_body(exc: Exception) -> dict | None:
+    """Returns json error body of FCM HTTP v1 API response that caused given exception, if there is one."""
+
+    candidates = []
+    if (response := getattr(exc, "response", None)) is not None:
+        try:
+            candidates.append(response.json())
+        except Exception:
+            candidates.append(getattr(response, "text", None))
+    candidates.extend(exc.args)
+
+    for candidate in candidates:
+        if isinstance(candidate, (bytes, str)):
+            if isinstance(candidate, bytes):
+                candidate = candidate.decode("utf8", errors="replace")
+            if (start := candidate.find("{")) < 0:
+                continue
+            try:
+                candidate = orjson.loads(candidate[start:])
+            except orjson.JSONDecodeError:
+                continue
+        if isinstance(candidate, dict) and isinstance(candidate.get("error"), dict):
+            return candidate["error"]
+
+    return None
+
+
+def _is_invalid_token_error(exc: Exception) -> bool:
+    """
+    Checks whether FCM rejected the token itself: UNREGISTERED error code (app was uninstalled)
+    or INVALID_ARGUMENT about message.token field (malformed token).
+    Other errors (including INVALID_ARGUMENT caused by message content and 404 caused by project misconfiguration)
+    don't say anything about the token, so it is not removed.
+    """
+
+    error = _fcm_error_body(exc)
+    if error is None:
+        return False
+
+    error_codes = {error.get("status")}
+    token_violation = False
+    for detail in error.get("details") or []:
+        if not isinstance(detail, dict):
+            continue
+        error_codes.add(detail.get("errorCode"))
+        for violation in detail.get("fieldViolations") or []:
+            if isinstance(violation, dict) and violation.get("field") == "message.token":
+                token_violation = True
+
+    if "UNREGISTERED" in error_codes:
+        return True
+    return "INVALID_ARGUMENT" in error_codes and token_violation
+
+
+async def send_push(title: str, text: str, tokens: dict[int, str]) -> None:
+    """
+    Sends push notification to sessions (session id -> fcm token) concurrently.
+    Tokens rejected by FCM as invalid are removed from sessions.
+    """
+
+    if not tokens:
+        return
+
+    # FCM HTTP v1 API has no batch send, so messages are sent concurrently instead
+    semaphore = Semaphore(config.fcm_concurrency)
+    invalid: dict[int, str] = {}
+
+    async def _send(session_id: int, token: str) -> None:
+        async with semaphore:
+            try:
+                await FCM.send_notification(title, text, device_token=token)
+            except Exception as e:
+                if _is_invalid_token_error(e):
+                    invalid[session_id] = token
+                    return
+                logger.opt(exception=e).warning(f"Failed to send notification to session {session_id} ({token!r})")
+
+    await gather(*(_send(session_id, token) for session_id, token in tokens.items()))
+
+    if invalid:
+        logger.info(f"Removing {len(invalid)} invalid fcm tokens")
+        # Token is checked too, so token that was updated while notification was being sent is not removed
+        await Session.filter(id__in=list(invalid), fcm_token__in=list(set(invalid.values()))).update(
+            fcm_token=None, fcm_token_time=0,
+        )
+
+
+async def push_tokens(user_ids: list[int] | set[int], per_user: int = 10) -> dict[int, str]:
+    """Returns fcm tokens (session id -> fcm token) of latest sessions of given users."""
+
+    tokens = {}
+    per_user_count = defaultdict(int)
+    sessions = await Session.filter(user_id__in=user_ids, fcm_token__not_isnull=True) \
+        .order_by("-fcm_token_time").values_list("id", "user_id", "fcm_token")
+    for session_id, user_id, fcm_token in sessions:
+        if per_user_count[user_id] < per_user:
+            per_user_count[user_id] += 1
+            tokens[session_id] = fcm_token
+
+    return tokens
+
+
 async def send_notification(user: User, title: str, text: str, email: bool = True, fcm: bool = True) -> None:
     if email:
         message = EmailMessage()
@@ -14,16 +119,9 @@ async def send_notification(user: User, title: str, text: str, email: bool = Tru
         message["Subject"] = title
         message.set_content(text)
 
-        try:
-            await SMTP.send_message(message, timeout=5)
-        except Exception as e:  # pragma: no cover
-            logger.opt(exception=e).error(f"Failed to send email to {email}!")
+        # Errors are not suppressed, so outbox job that sends this notification is retried
+        #  (jobs that may fail to send email should send push in a separate job, so retry does not send it again)
+        await SMTP.send_message(message, timeout=5)
 
     if fcm:
-        for session in await Session.filter(user=user, fcm_token__not_isnull=True).order_by("-fcm_token_time").limit(10):
-            try:
-                await FCM.send_notification(title, text, device_token=session.fcm_token)
-            except Exception as e:
-                logger.opt(exception=e).warning(
-                    f"Failed to send notification to session {session.id} ({session.fcm_token!r})"
-                )
+        await send_push(title, text, await push_tokens([user.id]))
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from asyncio import Event, Task, create_task, wait, wait_for, FIRST_COMPLETED, gather
+from contextlib import suppress
+from datetime import datetime, timedelta
+from random import uniform
+from typing import Awaitable, Callable
+
+from loguru import logger
+from pytz import UTC
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+from kkp.config import config
+from kkp.models import NotificationJob, NotificationJobStatus
+
+OutboxTask = Callable[..., Awaitable[None]]
+
+
+class Outbox:
+    """
+    Notification jobs are persisted to database (in the same transaction as the change that caused them, if any)
+    and executed by OutboxWorker, which runs in a separate process (kkp.worker).
+    Tasks are registered by function name, so renaming a task function makes pending jobs of that task dead.
+    """
+
+    _tasks: dict[str, OutboxTask] = {}
+
+    @classmethod
+    def task(cls, func: OutboxTask) -> OutboxTask:
+        cls._tasks[func.__name__] = func
+        return func
+
+    @classmethod
+    async def enqueue(cls, func: OutboxTask, delay: int = 0, **payload) -> NotificationJob:
+        if cls._tasks.get(func.__name__) is not func:
+            raise ValueError(f"{func.__name__} is not registered as outbox task")
+
+        return await NotificationJob.create(
+            task=func.__name__, payload=payload, run_at=datetime.now(UTC) + timedelta(seconds=delay),
+        )
+
+
+class OutboxWorker:
+    def __init__(self, concurrency: int | None = None, poll_interval: float | None = None) -> None:
+        self._concurrency = concurrency or config.outbox_concurrency
+        self._poll_interval = poll_interval or config.outbox_poll_interval
+        self._running: set[Task] = set()
+        self._stopping = Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def _claim(self, limit: int) -> list[NotificationJob]:
+        now = datetime.now(UTC)
+        async with in_transaction():
+            # Running jobs with run_at in the past were abandoned by killed worker
+            jobs = await NotificationJob.filter(
+                status__in=(NotificationJobStatus.PENDING, NotificationJobStatus.RUNNING), run_at__lte=now,
+            ).order_by("run_at").limit(limit).select_for_update(skip_locked=True)
+            if not jobs:
+                return []
+
+            # Job is cancelled after outbox_job_timeout seconds, lease is a bit longer than that,
+            #  so job can not be claimed by other worker while it is still running
+            await NotificationJob.filter(id__in=[job.id for job in jobs]).update(
+                status=NotificationJobStatus.RUNNING,
+                run_at=now + timedelta(seconds=config.outbox_job_timeout + 30),
+                attempts=F("attempts") + 1,
+            )
+
+        for job in jobs:
+            job.attempts += 1
+
+        return jobs
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        delay = min(config.outbox_backoff_base * 2 ** (attempts - 1), config.outbox_backoff_max)
+        return delay * uniform(.8, 1.2)
+
+    async def _job_failed(self, job: NotificationJob, exc: Exception, retry: bool = True) -> None:
+        error = f"{exc.__class__.__name__}: {exc}"[:4096]
+        if not retry or job.attempts >= config.outbox_max_attempts:
+            logger.opt(exception=exc).error(f"Outbox job {job.id} ({job.task}) failed after {job.attempts} attempts")
+            await NotificationJob.filter(id=job.id).update(status=NotificationJobStatus.DEAD, last_error=error)
+            return
+
+        delay = self.backoff(job.attempts)
+        logger.opt(exception=exc).warning(f"Outbox job {job.id} ({job.task}) failed, retrying in {delay:.0f}s")
+        await NotificationJob.filter(id=job.id).update(
+            status=NotificationJobStatus.PENDING,
+            run_at=datetime.now(UTC) + timedelta(seconds=delay),
+            last_error=error,
+        )
+
+    async def _run_job(self, job: NotificationJob) -> None:
+        try:
+            if (func := Outbox._tasks.get(job.task)) is None:
+                return await self._job_failed(job, LookupError(f"Unknown task {job.task!r}"), False)
+
+            try:
+                await wait_for(func(**job.payload), config.outbox_job_timeout)
+            except Exception as e:
+                return await self._job_failed(job, e)
+
+            await NotificationJob.filter(id=job.id).delete()
+        except Exception as e:  # pragma: no cover
+            # Job will be claimed again when its lease expires
+            logger.opt(exception=e).error(f"Failed to update outbox job {job.id}")
+
+    async def run(self) -> None:
+        logger.info(f"Outbox worker started with concurrency {self._concurrency}")
+        while not self._stopping.is_set():
+            if len(self._running) >= self._concurrency:
+                await wait(set(self._running), return_when=FIRST_COMPLETED)
+                continue
+
+            try:
+                jobs = await self._claim(self._concurrency - len(self._running))
+            except Exception as e:  # pragma: no cover
+                logger.opt(exception=e).error("Failed to claim outbox jobs")
+                jobs = []
+
+            for job in jobs:
+                task = create_task(self._run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            if not jobs:
+                with suppress(TimeoutError):
+                    await wait_for(self._stopping.wait(), self._poll_interval)
+
+        await gather(*self._running, return_exceptions=True)
+        logger.info("Outbox worker stopped")
@@ -0,0 +1,68 @@
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+import bcrypt
+
+from kkp.config import config
+from kkp.utils.custom_exception import CustomMessageException
+
+T = TypeVar("T")
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated thread pool (bcrypt releases the GIL while hashing),
+    so hashing does not block the event loop. Number of pending operations is limited,
+    requests above the limit are rejected instead of waiting in an unbounded queue.
+    """
+
+    _executor: ThreadPoolExecutor | None = None
+    _pending: int = 0
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=config.bcrypt_workers, thread_name_prefix="bcrypt")
+        return cls._executor
+
+    @classmethod
+    async def _run(cls, func: Callable[..., T], *args) -> T:
+        if cls._pending >= config.bcrypt_max_pending:
+            raise CustomMessageException("Server is busy, try again later.", 503)
+
+        cls._pending += 1
+        try:
+            return await get_running_loop().run_in_executor(cls._get_executor(), func, *args)
+        finally:
+            cls._pending -= 1
+
+    @staticmethod
+    def _hash(password: str) -> str:
+        return bcrypt.hashpw(password.encode("utf8"), bcrypt.gensalt(config.bcrypt_rounds)).decode("utf8")
+
+    @staticmethod
+    def _verify(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode("utf8"), hashed.encode("utf8"))
+
+    @classmethod
+    async def hash(cls, password: str) -> str:
+        return await cls._run(cls._hash, password)
+
+    @classmethod
+    async def verify(cls, password: str, hashed: str) -> bool:
+        return await cls._run(cls._verify, password, hashed)
+
+    @staticmethod
+    def needs_rehash(hashed: str) -> bool:
+        # Hash format is $2b$<rounds>$<salt and hash>
+        try:
+            return int(hashed.split("$")[2]) != config.bcrypt_rounds
+        except (IndexError, ValueError):
+            return True
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
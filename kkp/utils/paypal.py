@@ -1,30 +1,25 @@
-from functools import wraps
+from asyncio import sleep
 from time import time
-from typing import ParamSpec, TypeVar, Callable, Awaitable, Concatenate
 
-from httpx import AsyncClient
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Timeout, Response, TransportError, ConnectError, \
+    ConnectTimeout, PoolTimeout
 from loguru import logger
 
 from .custom_exception import CustomMessageException
 from ..config import config
 
 
-P = ParamSpec("P")
-T = TypeVar("T")
-
-
-def with_httpx(func: Callable[Concatenate[AsyncClient, P], Awaitable[T]]) -> Callable[P, Awaitable[T]]:
-    @wraps(func)
-    async def httpx_wrapper(*args: P.args, **kwargs: P.kwargs):
-        async with AsyncClient() as client:
-            return await func(*args, client=client, **kwargs)
-
-    return httpx_wrapper
-
-
 class PayPal:
+    """
+    PayPal api client. All requests go through one long-lived pooled http client, so connections
+    (and their tls sessions) are kept alive and reused between requests instead of being opened for every call.
+    Requests that failed before they were sent are always retried, idempotent requests are also retried
+    on timeouts, network errors and 429/5xx responses, with exponential backoff.
+    """
+
     _access_token: str | None = None
     _access_token_expires_at: int = 0
+    _client: AsyncClient | None = None
 
     BASE = "https://api-m.sandbox.paypal.com"
     AUTHORIZE = f"{BASE}/v1/oauth2/token"
@@ -32,34 +27,88 @@ class PayPal:
     CAPTURES = f"{BASE}/v2/payments/captures"
     PAYOUTS = f"{BASE}/v1/payments/payouts"
 
+    @classmethod
+    def open(cls) -> None:
+        """Creates http client, called on application startup."""
+
+        cls._client = AsyncClient(
+            transport=AsyncHTTPTransport(
+                limits=Limits(
+                    max_connections=config.paypal_max_connections,
+                    max_keepalive_connections=config.paypal_max_connections,
+                    keepalive_expiry=config.paypal_keepalive_expiry,
+                ),
+            ),
+            timeout=Timeout(
+                config.paypal_read_timeout, connect=config.paypal_connect_timeout, pool=config.paypal_read_timeout,
+            ),
+        )
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    @classmethod
+    async def _request(cls, method: str, url: str, *, idempotent: bool, **kwargs) -> Response:
+        for attempt in range(config.paypal_retries + 1):
+            if attempt:
+                await sleep(config.paypal_retry_backoff * 2 ** (attempt - 1))
+
+            last = attempt == config.paypal_retries
+            if cls._client is None:
+                raise RuntimeError("PayPal client is not opened")
+            try:
+                resp = await cls._client.request(method, url, **kwargs)
+            except (ConnectError, ConnectTimeout, PoolTimeout) as e:
+                # Request was not sent, so it is safe to retry it even if it is not idempotent
+                if last:
+                    raise
+                logger.warning(f"PayPal request {method} {url} failed: {e!r}, retrying")
+                continue
+            except TransportError as e:
+                if not idempotent or last:
+                    raise
+                logger.warning(f"PayPal request {method} {url} failed: {e!r}, retrying")
+                continue
+
+            if idempotent and not last and (resp.status_code == 429 or resp.status_code >= 500):
+                logger.warning(f"PayPal request {method} {url} failed with code {resp.status_code}, retrying")
+                continue
+
+            return resp
+
+        raise RuntimeError("Unreachable")  # pragma: no cover
+
     @classmethod
     async def _get_access_token(cls) -> str:
         if cls._access_token is None or cls._access_token_expires_at < time():
-            async with AsyncClient() as client:
-                resp = await client.post(
-                    cls.AUTHORIZE,
-                    content="grant_type=client_credentials",
-                    auth=(config.paypal_id, config.paypal_secret),
-                )
+            # Getting a new token does not change anything, so it is retried as idempotent request
+            resp = await cls._request(
+                "POST", cls.AUTHORIZE, idempotent=True,
+                content="grant_type=client_credentials",
+                auth=(config.paypal_id, config.paypal_secret),
+            )
 
-                j = resp.json()
-                logger.debug(f"Paypal token response, code={resp.status_code!r}, body={j!r}")
+            j = resp.json()
+            logger.debug(f"Paypal token response, code={resp.status_code!r}, body={j!r}")
 
-                if "access_token" not in j or "expires_in" not in j:
-                    raise CustomMessageException(
-                        "Failed to obtain PayPal access token!" if config.is_debug else "An error occurred with PayPal"
-                    )
+            if "access_token" not in j or "expires_in" not in j:
+                raise CustomMessageException(
+                    "Failed to obtain PayPal access token!" if config.is_debug else "An error occurred with PayPal"
+                )
 
-                cls._access_token = j["access_token"]
-                cls._access_token_expires_at = time() + j["expires_in"]
+            cls._access_token = j["access_token"]
+            cls._access_token_expires_at = time() + j["expires_in"]
 
         return cls._access_token
 
     @classmethod
-    @with_httpx
-    async def create(cls, price: float, currency: str = "USD", *, client: AsyncClient) -> str:
-        resp = await client.post(
-            cls.CHECKOUT, headers={"Authorization": f"Bearer {await cls._get_access_token()}"},
+    async def create(cls, price: float, currency: str = "USD") -> str:
+        resp = await cls._request(
+            "POST", cls.CHECKOUT, idempotent=False,
+            headers={"Authorization": f"Bearer {await cls._get_access_token()}"},
             json={
                 "intent": "CAPTURE",
                 "purchase_units": [{
@@ -85,10 +134,9 @@ class PayPal:
         return j_resp["id"]
 
     @classmethod
-    @with_httpx
-    async def capture(cls, order_id: str, *, client: AsyncClient) -> str | None:
-        resp = await client.post(
-            f"{cls.CHECKOUT}/{order_id}/capture",
+    async def capture(cls, order_id: str) -> str | None:
+        resp = await cls._request(
+            "POST", f"{cls.CHECKOUT}/{order_id}/capture", idempotent=False,
             headers={"Authorization": f"Bearer {await cls._get_access_token()}"},
             json={},
         )
@@ -108,10 +156,10 @@ class PayPal:
             return None
 
     @classmethod
-    @with_httpx
-    async def create_payout(cls, treatment_id: int, email: str, amount: float, *, client: AsyncClient) -> str | None:
-        resp = await client.post(
-            cls.PAYOUTS, headers={"Authorization": f"Bearer {await cls._get_access_token()}"},
+    async def create_payout(cls, treatment_id: int, email: str, amount: float) -> str | None:
+        resp = await cls._request(
+            "POST", cls.PAYOUTS, idempotent=False,
+            headers={"Authorization": f"Bearer {await cls._get_access_token()}"},
             json={
                 "sender_batch_header": {
                     "sender_batch_id": f"treatment-{treatment_id}",
@@ -140,10 +188,9 @@ class PayPal:
         return j_resp["batch_header"]["payout_batch_id"]
 
     @classmethod
-    @with_httpx
-    async def check_payout(cls, payout_id: str, *, client: AsyncClient) -> bool:
-        resp = await client.get(
-            f"{cls.PAYOUTS}/{payout_id}",
+    async def check_payout(cls, payout_id: str) -> bool:
+        resp = await cls._request(
+            "GET", f"{cls.PAYOUTS}/{payout_id}", idempotent=True,
             headers={"Authorization": f"Bearer {await cls._get_access_token()}"},
         )
 
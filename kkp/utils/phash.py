@@ -0,0 +1,87 @@
+from itertools import combinations
+
+from PIL import Image
+
+from kkp import models
+from kkp.models import Media
+
+# 64-bit hash is split into 4 16-bit indexed chunks (multi-index hashing): if distance between two hashes
+#  is at most d, at least one of their chunks differs in at most d // 4 bits, so candidates are found
+#  with indexed lookups of chunk values within that radius and then checked with exact distance
+CHUNKS = 4
+CHUNK_BITS = 16
+MAX_DISTANCE = 11
+
+
+def dhash(img: Image.Image) -> int:
+    """Difference hash: 64 bits that tell whether each pixel of 9x8 grayscale image is brighter than the next one."""
+
+    small = img.convert("L").resize((9, 8), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+
+    return value
+
+
+def to_signed(value: int) -> int:
+    # Hash is stored in signed BIGINT column
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_chunks(value: int) -> list[int]:
+    value &= (1 << 64) - 1
+    return [(value >> (CHUNK_BITS * i)) & ((1 << CHUNK_BITS) - 1) for i in range(CHUNKS)]
+
+
+def _neighbours(chunk: int, radius: int) -> list[int]:
+    result = [chunk]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            result.append(flipped)
+
+    return result
+
+
+def set_phash(media: Media, value: int) -> None:
+    media.phash = to_signed(value)
+    media.phash_0, media.phash_1, media.phash_2, media.phash_3 = to_chunks(value)
+
+
+async def find_similar_animals(value: int, max_distance: int, limit: int) -> list[tuple[int, int]]:
+    """Returns (animal id, distance) of animals that have photos within max_distance from given hash, closest first."""
+
+    max_distance = min(max_distance, MAX_DISTANCE)
+    radius = max_distance // CHUNKS
+    media_table = Media._meta.db_table
+    animal_media = models.Animal._meta.fields_map["medias"]
+
+    # Union of per-chunk lookups, so every one of them uses its own index (OR of them may end up in full scan)
+    lookups = []
+    params = []
+    for idx, chunk in enumerate(to_chunks(value)):
+        neighbours = _neighbours(chunk, radius)
+        lookups.append(
+            f"SELECT `id` FROM `{media_table}` WHERE `phash_{idx}` IN ({','.join(['%s'] * len(neighbours))})"
+        )
+        params.extend(neighbours)
+
+    value = to_signed(value)
+    rows = await Media._choose_db().execute_query_dict(f"""
+        SELECT `am`.`{animal_media.backward_key}` `animal_id`, MIN(BIT_COUNT(`media`.`phash` ^ %s)) `distance`
+        FROM ({' UNION '.join(lookups)}) `candidates`
+        INNER JOIN `{media_table}` `media` ON `media`.`id`=`candidates`.`id`
+        INNER JOIN `{animal_media.through}` `am` ON `am`.`{animal_media.forward_key}`=`media`.`id`
+        WHERE BIT_COUNT(`media`.`phash` ^ %s) <= %s
+        GROUP BY `am`.`{animal_media.backward_key}`
+        ORDER BY `distance`
+        LIMIT %s
+    """, [value, *params, value, max_distance, limit])
+
+    return [(row["animal_id"], int(row["distance"])) for row in rows]
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
+from kkp.config import REDIS, config
+from kkp.utils.custom_exception import CustomMessageException
+
+# Token bucket: bucket holds up to `capacity` tokens and is refilled at `capacity / period` tokens per second.
+# Every request takes one token. State is kept in a hash that expires when bucket would be full again anyway.
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local period_ms = tonumber(ARGV[2]) * 1000
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local rate = capacity / period_ms
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+
+local allowed = 0
+local retry_after_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after_ms = math.ceil((1 - tokens) / rate)
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(period_ms))
+return {allowed, math.floor(tokens), retry_after_ms}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: int
+
+    def headers(self) -> dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class RateLimiter:
+    _script = REDIS.register_script(_TOKEN_BUCKET_LUA)
+
+    @classmethod
+    async def hit(cls, key: str, capacity: int, period: int) -> RateLimitResult:
+        allowed, remaining, retry_after_ms = await cls._script(keys=[f"ratelimit:{key}"], args=[capacity, period])
+        return RateLimitResult(bool(allowed), capacity, int(remaining), -(-int(retry_after_ms) // 1000))
+
+    @classmethod
+    async def hit_or_raise(cls, key: str, capacity: int, period: int) -> RateLimitResult | None:
+        if not config.rate_limit_enabled:
+            return None
+
+        result = await cls.hit(key, capacity, period)
+        if not result.allowed:
+            raise CustomMessageException("Too many requests, try again later.", 429, headers=result.headers())
+
+        return result
@@ -0,0 +1,96 @@
+from time import time
+from typing import NamedTuple
+
+from kkp.config import REDIS, config
+from kkp.utils.geo import geohash_encode, geohash_cells, circle_bbox, haversine
+
+
+class RecentReport(NamedTuple):
+    report_id: int
+    animal_id: int
+    reported_by_id: int | None
+    distance: float
+
+
+class RecentReportsIndex:
+    """
+    Index of recently created reports, used to find probable duplicates.
+    Reports are stored in redis lists keyed by geohash cell and time bucket,
+    so lookup only needs to read few small lists instead of querying the database.
+    """
+
+    PRECISION = 6
+    KEY_PREFIX = "recent-reports"
+
+    @staticmethod
+    def _bucket_size() -> int:
+        return config.duplicate_report_minutes * 60
+
+    @classmethod
+    def _key(cls, cell: str, bucket: int) -> str:
+        return f"{cls.KEY_PREFIX}:{cell}:{bucket}"
+
+    @classmethod
+    async def add(
+            cls, report_id: int, animal_id: int, reported_by_id: int | None, latitude: float, longitude: float,
+            timestamp: int | None = None,
+    ) -> None:
+        timestamp = int(time()) if timestamp is None else timestamp
+        bucket_size = cls._bucket_size()
+        key = cls._key(geohash_encode(latitude, longitude, cls.PRECISION), timestamp // bucket_size)
+
+        async with REDIS.pipeline(transaction=False) as pipe:
+            pipe.rpush(
+                key, f"{report_id}:{animal_id}:{latitude}:{longitude}:{timestamp}:{reported_by_id or 0}",
+            )
+            # Bucket is needed while lookups can reach it, i.e. until the end of next bucket
+            pipe.expire(key, bucket_size * 2)
+            await pipe.execute()
+
+    @classmethod
+    async def find_duplicate(
+            cls, latitude: float, longitude: float, timestamp: int | None = None, exclude_reporter_id: int | None = None,
+    ) -> RecentReport | None:
+        """
+        Returns closest report created within configured radius and time window, if any.
+        Reports made by exclude_reporter_id are skipped: the same person reporting again nearby
+        most likely reports another animal.
+        """
+
+        timestamp = int(time()) if timestamp is None else timestamp
+        bucket_size = cls._bucket_size()
+        bucket = timestamp // bucket_size
+        min_timestamp = timestamp - bucket_size
+        radius = config.duplicate_report_radius
+
+        cells = geohash_cells(*circle_bbox(latitude, longitude, radius), cls.PRECISION)
+        async with REDIS.pipeline(transaction=False) as pipe:
+            for cell in cells:
+                pipe.lrange(cls._key(cell, bucket), 0, -1)
+                pipe.lrange(cls._key(cell, bucket - 1), 0, -1)
+            results = await pipe.execute()
+
+        candidates = []
+        coords = []
+        for entry in (entry for entries in results for entry in entries):
+            # Entries added before reporter was stored have no reporter field
+            report_id, animal_id, lat, lon, created_at, *reporter = entry.decode("utf8").split(":")
+            reported_by_id = int(reporter[0]) if reporter and reporter[0] != "0" else None
+            if int(created_at) < min_timestamp:
+                continue
+            if exclude_reporter_id is not None and reported_by_id == exclude_reporter_id:
+                continue
+            candidates.append((int(report_id), int(animal_id), reported_by_id))
+            coords.extend((float(lon), float(lat)))
+
+        if not candidates:
+            return None
+
+        distance, idx = min(
+            (dist, idx)
+            for idx, dist in enumerate(haversine(longitude, latitude, coords))
+        )
+        if distance >= radius:
+            return None
+
+        return RecentReport(*candidates[idx], distance)
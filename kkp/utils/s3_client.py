@@ -0,0 +1,80 @@
+from base64 import b64encode
+from hashlib import md5
+from io import BytesIO
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from s3lite import Client
+from s3lite.exceptions import S3Exception
+from s3lite.utils import get_xml_attr, NS_URL
+
+
+class S3Client(Client):
+    """s3lite client with operations that s3lite does not provide (multipart upload management, bulk delete)."""
+
+    def share_upload_part(self, bucket: str, key: str, upload_id: str, part: int, ttl: int = 60 * 60) -> str:
+        key = key.lstrip("/")
+        return self._signer.presign(
+            f"{self._endpoint}/{bucket}/{key}", True, ttl, {"partNumber": part, "uploadId": upload_id},
+        )
+
+    async def list_parts(self, bucket: str, key: str, upload_id: str) -> list[tuple[int, str, int]]:
+        """Returns (part number, etag, size) of uploaded parts of multipart upload."""
+
+        key = key.lstrip("/")
+        parts = []
+        marker = 0
+        while True:
+            async with self._client_cls(self._signer) as client:
+                resp = await client.get(
+                    f"{self._endpoint}/{bucket}/{key}?part-number-marker={marker}&uploadId={upload_id}"
+                )
+                self._check_error(resp)
+
+            res = ElementTree.parse(BytesIO(resp.text.encode("utf8"))).getroot()
+            for part in get_xml_attr(res, "Part", get_all=True):
+                parts.append((
+                    int(get_xml_attr(part, "PartNumber").text),
+                    get_xml_attr(part, "ETag").text,
+                    int(get_xml_attr(part, "Size").text),
+                ))
+
+            truncated = get_xml_attr(res, "IsTruncated")
+            if truncated is None or truncated.text != "true":
+                return parts
+            marker = int(get_xml_attr(res, "NextPartNumberMarker").text)
+
+    async def abort_multipart_upload(self, bucket: str, key: str, upload_id: str) -> None:
+        key = key.lstrip("/")
+        async with self._client_cls(self._signer) as client:
+            resp = await client.delete(f"{self._endpoint}/{bucket}/{key}?uploadId={upload_id}")
+
+        try:
+            self._check_error(resp)
+        except S3Exception as e:
+            # Upload was already aborted or completed
+            if e.code != "NoSuchUpload":
+                raise
+
+    async def delete_objects(self, bucket: str, keys: list[str]) -> list[str]:
+        """Deletes up to 1000 objects with one request. Returns keys that were not deleted."""
+
+        if not keys:
+            return []
+
+        objects = "".join(f"<Object><Key>{escape(key.lstrip('/'))}</Key></Object>" for key in keys)
+        body = (f"<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+                f"<Delete xmlns=\"{NS_URL}\"><Quiet>true</Quiet>{objects}</Delete>").encode("utf8")
+
+        async with self._client_cls(self._signer) as client:
+            resp = await client.post(
+                f"{self._endpoint}/{bucket}?delete=", content=body,
+                headers={
+                    "Content-Type": "application/xml",
+                    "Content-MD5": b64encode(md5(body).digest()).decode("ascii"),
+                },
+            )
+            self._check_error(resp)
+
+        res = ElementTree.parse(BytesIO(resp.text.encode("utf8"))).getroot()
+        return [get_xml_attr(error, "Key").text for error in get_xml_attr(res, "Error", get_all=True)]
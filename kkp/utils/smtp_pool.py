@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from asyncio import Semaphore
+from email.message import EmailMessage
+from time import time
+
+from aiosmtplib import SMTP, SMTPException, SMTPResponse
+from loguru import logger
+
+
+class SmtpPool:
+    """
+    Pool of smtp connections. Connections are opened lazily, reused for consecutive messages
+    and checked with NOOP if they were idle for some time. Dropped connections are reopened transparently.
+    Number of messages waiting for a connection is limited, sending fails instead of waiting in an unbounded queue.
+    """
+
+    # Idle connections older than this are checked with NOOP before reuse
+    IDLE_CHECK_INTERVAL = 30
+
+    def __init__(
+            self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+            size: int = 4, max_pending: int = 256,
+    ) -> None:
+        self._connect_kwargs = {"hostname": hostname, "port": port, "username": username, "password": password}
+        self._size = size
+        self._max_pending = max_pending
+        self._idle: list[tuple[SMTP, float]] = []
+        self._semaphore: Semaphore | None = None
+        self._pending = 0
+
+    async def __aenter__(self) -> SmtpPool:
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            try:
+                await conn.quit(timeout=5)
+            except Exception:
+                conn.close()
+
+        self._semaphore = None
+
+    async def _acquire(self) -> SMTP:
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if not conn.is_connected:
+                continue
+            if time() - last_used < self.IDLE_CHECK_INTERVAL:
+                return conn
+
+            try:
+                await conn.noop(timeout=5)
+            except (SMTPException, OSError):
+                conn.close()
+                continue
+
+            return conn
+
+        conn = SMTP(**self._connect_kwargs)
+        await conn.connect()
+        return conn
+
+    def _release(self, conn: SMTP) -> None:
+        if conn.is_connected:
+            self._idle.append((conn, time()))
+
+    async def send_message(
+            self, message: EmailMessage, timeout: float | None = None,
+    ) -> tuple[dict[str, SMTPResponse], str]:
+        if self._pending >= self._max_pending:
+            raise SMTPException("Too many emails are waiting to be sent")
+
+        if self._semaphore is None:
+            self._semaphore = Semaphore(self._size)
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                return await self._send(message, timeout)
+        finally:
+            self._pending -= 1
+
+    async def _send(self, message: EmailMessage, timeout: float | None) -> tuple[dict[str, SMTPResponse], str]:
+        for attempt in range(2):
+            conn = await self._acquire()
+            try:
+                result = await conn.send_message(message, timeout=timeout)
+            except ConnectionError:
+                # Server closed connection (e.g. because of its idle timeout), retry once with new connection
+                conn.close()
+                if attempt:
+                    raise
+                logger.debug("Smtp connection was dropped, reconnecting")
+                continue
+            except Exception:
+                # Connection may be in the middle of a transaction
+                conn.close()
+                raise
+
+            self._release(conn)
+            return result
+
+        raise RuntimeError("Unreachable")  # pragma: no cover
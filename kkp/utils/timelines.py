@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from loguru import logger
+from tortoise.expressions import Subquery
+from tortoise.queryset import QuerySet
+
+from kkp.config import REDIS, config
+from kkp.models import AnimalUpdate, User, Animal
+
+# Adds update to timeline only if timeline is already built (otherwise it will be built from database when read)
+#  and removes oldest updates above the limit. Rank 0 is always occupied by the marker.
+_APPEND_LUA = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+redis.call("ZREMRANGEBYRANK", KEYS[1], 1, -(tonumber(ARGV[3]) + 1))
+return 1
+"""
+
+
+class SubscriptionTimeline:
+    """
+    Per-user timeline of updates of subscribed animals (fan-out on write).
+    Timeline is a redis sorted set of "<update id>:<animal id>" members scored by update timestamp,
+    limited to timeline_max_length latest updates. Timelines are built from database on first read
+    (or after they expired) and then updated when AnimalUpdate is created or user (un)subscribes.
+    Sorted set always contains MARKER member with score 0, so empty timeline is distinguishable from missing one.
+    """
+
+    KEY_PREFIX = "timeline"
+    MARKER = "-"
+
+    _append_script = REDIS.register_script(_APPEND_LUA)
+
+    @classmethod
+    def _key(cls, user_id: int) -> str:
+        return f"{cls.KEY_PREFIX}:{user_id}"
+
+    @staticmethod
+    def _member(update_id: int, animal_id: int) -> str:
+        return f"{update_id}:{animal_id}"
+
+    @staticmethod
+    def _subscribed_updates(user: User) -> QuerySet[AnimalUpdate]:
+        return AnimalUpdate.filter(animal__id__in=Subquery(user.subscriptions.all().values_list("id", flat=True)))
+
+    @classmethod
+    async def _build(cls, user: User) -> None:
+        rows = await cls._subscribed_updates(user).order_by("-date") \
+            .limit(config.timeline_max_length).values_list("id", "animal_id", "date")
+
+        # Timeline is built in temporary key and then renamed, so readers never see it partially built
+        key = cls._key(user.id)
+        tmp_key = f"{key}:build"
+        async with REDIS.pipeline(transaction=True) as pipe:
+            pipe.delete(tmp_key)
+            pipe.zadd(tmp_key, {
+                cls.MARKER: 0,
+                **{
+                    cls._member(update_id, animal_id): date.timestamp()
+                    for update_id, animal_id, date in rows
+                },
+            })
+            pipe.expire(tmp_key, config.timeline_ttl)
+            pipe.rename(tmp_key, key)
+            await pipe.execute()
+
+        # Updates created after rows were read were not appended, because timeline did not exist then
+        newer = cls._subscribed_updates(user)
+        if rows:
+            newer = newer.filter(date__gte=rows[0][2])
+        newer_rows = await newer.order_by("-date").limit(config.timeline_max_length) \
+            .values_list("id", "animal_id", "date")
+        if newer_rows:
+            await cls._add([user.id], [
+                (update_id, animal_id, date.timestamp())
+                for update_id, animal_id, date in newer_rows
+            ])
+
+    @classmethod
+    async def _add(cls, user_ids: list[int], updates: list[tuple[int, int, float]]) -> None:
+        async with REDIS.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                for update_id, animal_id, timestamp in updates:
+                    await cls._append_script(
+                        keys=[cls._key(user_id)],
+                        args=[cls._member(update_id, animal_id), timestamp, config.timeline_max_length],
+                        client=pipe,
+                    )
+            await pipe.execute()
+
+    @classmethod
+    async def append(cls, update: AnimalUpdate) -> None:
+        # Called after update is committed, so failure must not fail the request,
+        #  timelines that missed the update get it when they are rebuilt after timeline_ttl
+        entry = (update.id, update.animal_id, update.date.timestamp())
+        try:
+            async for user_ids in Animal.subscriber_ids(update.animal_id, config.subscribers_chunk_size):
+                await cls._add(user_ids, [entry])
+        except Exception as e:
+            logger.opt(exception=e).warning(f"Failed to append update {update.id} to subscription timelines")
+
+    @classmethod
+    async def subscribed(cls, user: User, animal: Animal) -> None:
+        rows = await AnimalUpdate.filter(animal=animal).order_by("-date") \
+            .limit(config.timeline_max_length).values_list("id", "animal_id", "date")
+        if rows:
+            await cls._add([user.id], [(update_id, animal_id, date.timestamp()) for update_id, animal_id, date in rows])
+
+    @classmethod
+    async def unsubscribed(cls, user: User, animal: Animal) -> None:
+        key = cls._key(user.id)
+        suffix = f":{animal.id}".encode("utf8")
+        if to_remove := [member for member in await REDIS.zrange(key, 0, -1) if member.endswith(suffix)]:
+            await REDIS.zrem(key, *to_remove)
+
+    @classmethod
+    async def get(
+            cls, user: User, min_date: int | None, max_date: int | None, desc: bool, offset: int, limit: int,
+    ) -> tuple[int, list[int]]:
+        """Returns number of updates in timeline within given dates (exclusive) and ids of requested page of them."""
+
+        # Ttl is not extended on reads, so timeline is periodically rebuilt from database
+        key = cls._key(user.id)
+        if not await REDIS.exists(key):
+            await cls._build(user)
+
+        # Marker has score 0, so it is always excluded
+        min_score = f"({min_date if min_date is not None and min_date > 0 else 0}"
+        max_score = f"({max_date}" if max_date is not None else "+inf"
+
+        async with REDIS.pipeline(transaction=False) as pipe:
+            pipe.zcount(key, min_score, max_score)
+            if desc:
+                pipe.zrevrangebyscore(key, max_score, min_score, start=offset, num=limit)
+            else:
+                pipe.zrangebyscore(key, min_score, max_score, start=offset, num=limit)
+            count, members = await pipe.execute()
+
+        return count, [int(member.split(b":")[0]) for member in members]
+
+    @classmethod
+    async def remove(cls, user_id: int, update_ids: list[int]) -> None:
+        """Removes updates that no longer exist from timeline."""
+
+        key = cls._key(user_id)
+        update_ids = set(update_ids)
+        if to_remove := [
+            member for member in await REDIS.zrange(key, 0, -1)
+            if member != cls.MARKER.encode("utf8") and int(member.split(b":")[0]) in update_ids
+        ]:
+            await REDIS.zrem(key, *to_remove)
@@ -0,0 +1,34 @@
+from asyncio import get_event_loop, create_task
+from signal import SIGINT, SIGTERM
+
+from tortoise import Tortoise
+
+from .config import SMTP, REDIS, setup_cache, orm_config
+from .utils import notification_tasks, chat_notifications  # noqa: F401 - registers outbox tasks
+from .utils.media_gc import MediaGc
+from .utils.media_processing import MediaProcessor
+from .utils.outbox import OutboxWorker
+
+
+async def run_worker():
+    setup_cache()
+    await Tortoise.init(config=orm_config())
+    gc_task = create_task(MediaGc.supervise())
+
+    worker = OutboxWorker()
+    loop = get_event_loop()
+    for sig in (SIGINT, SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        async with SMTP:
+            await worker.run()
+    finally:
+        gc_task.cancel()
+        await Tortoise.close_connections()
+        await REDIS.aclose()
+        MediaProcessor.shutdown()
+
+
+if __name__ == "__main__":
+    get_event_loop().run_until_complete(run_worker())
@@ -5,6 +5,7 @@ from kkp.models import UserRole, MediaType
 from kkp.schemas.animal_reports import AnimalReportInfo
 from kkp.schemas.common import PaginationResponse
 from kkp.schemas.media import CreateMediaUploadResponse, MediaInfo
+from kkp.utils.recent_reports import RecentReportsIndex
 from tests.conftest import create_token
 from tests.test_media import IMG_1x1_PIXEL_RED
 
@@ -285,3 +286,100 @@ async def test_create_animal_report_no_auth_media(client: AsyncClient):
     assert resp.animal.media.count == 1
     assert len(resp.animal.media.result) == 1
     assert resp.animal.media.result[0].id == media_id
+
+
+@pytest.mark.asyncio
+async def test_create_duplicate_animal_report(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+    user2_token = await create_token(UserRole.REGULAR)
+
+    response = await client.post("/animal-reports", headers={"authorization": user_token}, json={
+        "name": "test animal",
+        "breed": "idk breed",
+        "notes": "first",
+        "latitude": LAT,
+        "longitude": LON,
+        "media_ids": [],
+    })
+    assert response.status_code == 200, response.json()
+    report = AnimalReportInfo(**response.json())
+    assert report.duplicate_of is None
+
+    response = await client.post("/animal-reports", headers={"authorization": user2_token}, json={
+        "name": "some animal",
+        "breed": "some breed",
+        "notes": "second",
+        "latitude": LAT + 0.0005,
+        "longitude": LON,
+        "media_ids": [],
+    })
+    assert response.status_code == 200, response.json()
+    duplicate = AnimalReportInfo(**response.json())
+    assert duplicate.duplicate_of == report.id
+    # Report is only flagged, submitted animal is kept
+    assert duplicate.animal.id != report.animal.id
+    assert duplicate.animal.name == "some animal"
+
+    response = await client.post("/animal-reports", headers={"authorization": user2_token}, json={
+        "name": "some animal",
+        "breed": "some breed",
+        "notes": "third",
+        "latitude": LAT + 0.01,
+        "longitude": LON,
+        "media_ids": [],
+    })
+    assert response.status_code == 200, response.json()
+    other = AnimalReportInfo(**response.json())
+    assert other.duplicate_of is None
+    assert other.animal.id != report.animal.id
+
+    # Client knows that it is the same animal
+    response = await client.post("/animal-reports", headers={"authorization": user2_token}, json={
+        "name": "another animal",
+        "breed": "another breed",
+        "notes": "fourth",
+        "latitude": LAT + 0.0005,
+        "longitude": LON,
+        "media_ids": [],
+        "link_duplicate": True,
+    })
+    assert response.status_code == 200, response.json()
+    linked = AnimalReportInfo(**response.json())
+    assert linked.duplicate_of == report.id
+    assert linked.animal.id == report.animal.id
+
+    # The same person reporting again nearby reports another animal
+    response = await client.post("/animal-reports", headers={"authorization": user_token}, json={
+        "name": "another animal",
+        "breed": "another breed",
+        "notes": "fifth",
+        "latitude": LAT + 0.0005,
+        "longitude": LON,
+        "media_ids": [],
+        "link_duplicate": True,
+    })
+    assert response.status_code == 200, response.json()
+    another = AnimalReportInfo(**response.json())
+    assert another.duplicate_of is None
+    assert another.animal.id != report.animal.id
+    assert another.animal.name == "another animal"
+
+
+@pytest.mark.asyncio
+async def test_create_animal_report_index_unavailable(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    user_token = await create_token(UserRole.REGULAR)
+
+    async def _fail(*args, **kwargs) -> None:
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(RecentReportsIndex, "add", _fail)
+    response = await client.post("/animal-reports", headers={"authorization": user_token}, json={
+        "name": "test animal",
+        "breed": "idk breed",
+        "notes": "",
+        "latitude": LAT - 1,
+        "longitude": LON,
+        "media_ids": [],
+    })
+    assert response.status_code == 200, response.json()
+    assert AnimalReportInfo(**response.json()).duplicate_of is None
@@ -1,13 +1,15 @@
 import pytest
 from httpx import AsyncClient
 
+from kkp.config import REDIS
 from kkp.models import UserRole, Animal, AnimalStatus, AnimalUpdateType
 from kkp.schemas.animal_reports import AnimalReportInfo
 from kkp.schemas.animal_updates import AnimalUpdateInfo
 from kkp.schemas.animals import AnimalInfo
 from kkp.schemas.common import PaginationResponse
 from kkp.schemas.treatment_reports import TreatmentReportInfo
-from tests.conftest import create_token
+from kkp.utils.timelines import SubscriptionTimeline
+from tests.conftest import create_token, create_user
 
 
 LON = 42.42424242
@@ -169,3 +171,86 @@ async def test_subscriptions_updates(client: AsyncClient):
     assert resp.result[1].animal_report is not None
     assert resp.result[1].treatment_report is None
     assert resp.result[1].animal_report.id == report_id
+
+
+@pytest.mark.asyncio
+async def test_subscriptions_updates_timeline(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+    vet_token = await create_token(UserRole.VET)
+    animal1 = await Animal.create(name="test animal 1", breed="some breed", status=AnimalStatus.FOUND)
+    animal2 = await Animal.create(name="test animal 2", breed="some breed", status=AnimalStatus.FOUND)
+
+    response = await client.patch(f"/animals/{animal2.id}", headers={"authorization": vet_token}, json={
+        "description": "before subscription",
+    })
+    assert response.status_code == 200, response.json()
+
+    response = await client.put(f"/subscriptions/{animal1.id}", headers={"authorization": user_token})
+    assert response.status_code == 204, response.json()
+
+    # Timeline is built on first read
+    response = await client.get("/subscriptions/updates", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    assert UpdatePaginationResponse(**response.json()).count == 0
+
+    # Existing updates are added to timeline on subscribe
+    response = await client.put(f"/subscriptions/{animal2.id}", headers={"authorization": user_token})
+    assert response.status_code == 204, response.json()
+
+    for idx in range(3):
+        response = await client.patch(f"/animals/{animal1.id}", headers={"authorization": vet_token}, json={
+            "description": f"update {idx}",
+        })
+        assert response.status_code == 200, response.json()
+
+    response = await client.get("/subscriptions/updates", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    resp = UpdatePaginationResponse(**response.json())
+    assert resp.count == 4
+    assert [update.animal.id for update in resp.result] == [animal1.id, animal1.id, animal1.id, animal2.id]
+    assert all(resp.result[i].date >= resp.result[i + 1].date for i in range(3))
+
+    response = await client.get(
+        "/subscriptions/updates", params={"order": "asc", "page_size": 2, "page": 2},
+        headers={"authorization": user_token},
+    )
+    assert response.status_code == 200, response.json()
+    resp_asc = UpdatePaginationResponse(**response.json())
+    assert resp_asc.count == 4
+    assert [update.id for update in resp_asc.result] == [resp.result[1].id, resp.result[0].id]
+
+    response = await client.delete(f"/subscriptions/{animal1.id}", headers={"authorization": user_token})
+    assert response.status_code == 204, response.json()
+
+    response = await client.get("/subscriptions/updates", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    resp = UpdatePaginationResponse(**response.json())
+    assert resp.count == 1
+    assert resp.result[0].animal.id == animal2.id
+
+
+@pytest.mark.asyncio
+async def test_timeline_append_failure(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    user = await create_user()
+    vet_token = await create_token(UserRole.VET)
+    animal = await Animal.create(name="test animal", breed="some breed", status=AnimalStatus.FOUND)
+    await user.subscriptions.add(animal)
+    await SubscriptionTimeline.get(user, None, None, True, 0, 10)
+    ttl = await REDIS.ttl(SubscriptionTimeline._key(user.id))
+
+    async def _fail(*args, **kwargs) -> None:
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(SubscriptionTimeline, "_add", _fail)
+    response = await client.patch(f"/animals/{animal.id}", headers={"authorization": vet_token}, json={
+        "description": "missed update",
+    })
+    assert response.status_code == 200, response.json()
+    monkeypatch.undo()
+
+    # Reads do not extend ttl, so timeline that missed the update is rebuilt when it expires
+    assert await SubscriptionTimeline.get(user, None, None, True, 0, 10) == (0, [])
+    assert await REDIS.ttl(SubscriptionTimeline._key(user.id)) <= ttl
+    await REDIS.delete(SubscriptionTimeline._key(user.id))
+    count, _ = await SubscriptionTimeline.get(user, None, None, True, 0, 10)
+    assert count == 1
@@ -1,10 +1,17 @@
+from io import BytesIO
+from os import urandom
+
 import pytest
 from httpx import AsyncClient
+from PIL import Image
 
+from kkp.config import config, S3
 from kkp.models import UserRole, Animal, AnimalStatus, Media, MediaType, MediaStatus
-from kkp.schemas.animals import AnimalInfo
+from kkp.schemas.animals import AnimalInfo, SimilarAnimalInfo
 from kkp.schemas.common import PaginationResponse
-from tests.conftest import create_token, check_sorted
+from kkp.utils.media_processing import MediaProcessor
+from tests.conftest import create_token, check_sorted, wait_for_outbox
+from tests.test_media import _upload_and_finalize
 
 STATUSES = [
     AnimalStatus.FOUND,
@@ -107,3 +114,48 @@ async def test_edit_animal(client: AsyncClient):
     assert resp.media.count == 2
     assert len(resp.media.result) == 2
     assert {media.id for media in resp.media.result} == {media3.id, media2.id}
+
+
+def _smooth_image() -> Image.Image:
+    # Upscaled random 8x6 image has smooth gradients like a real photo, unlike random noise
+    return Image.frombytes("RGB", (8, 6), urandom(8 * 6 * 3)).resize((1600, 1200), Image.Resampling.BICUBIC)
+
+
+def _jpeg(img: Image.Image, quality: int = 90) -> bytes:
+    photo = BytesIO()
+    img.save(photo, "JPEG", quality=quality)
+    return photo.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_similar_animals(client: AsyncClient):
+    img = _smooth_image()
+    animal = await Animal.create(name="test", breed="idk", status=AnimalStatus.FOUND)
+    other_animal = await Animal.create(name="other", breed="idk", status=AnimalStatus.FOUND)
+    await animal.medias.add(await Media.get(id=(await _upload_and_finalize(client, _jpeg(img))).id))
+    await other_animal.medias.add(await Media.get(id=(await _upload_and_finalize(client, _jpeg(_smooth_image()))).id))
+    await wait_for_outbox("process_media")
+
+    # Hash of a photo that was not processed yet is computed on demand
+    new_photo = await _upload_and_finalize(client, _jpeg(img.resize((640, 480)), quality=50))
+    response = await client.post("/animals/similar", json={"media_ids": [new_photo.id]})
+    assert response.status_code == 200, response.json()
+    resp = [SimilarAnimalInfo(**item) for item in response.json()]
+    assert [item.animal.id for item in resp] == [animal.id]
+    assert resp[0].distance <= config.similar_animals_max_distance
+    assert (await Media.get(id=new_photo.id)).phash is not None
+
+    response = await client.post("/animals/similar", json={"media_ids": [new_photo.id], "max_distance": 100})
+    assert response.status_code == 422, response.json()
+
+
+@pytest.mark.asyncio
+async def test_backfill_phash(client: AsyncClient):
+    photo = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED)
+    await S3.upload_object(config.s3_bucket_name, photo.object_key(), BytesIO(_jpeg(_smooth_image())))
+    broken = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED)
+    await S3.upload_object(config.s3_bucket_name, broken.object_key(), BytesIO(b"not an image"))
+
+    assert await MediaProcessor.backfill_phash(batch_size=1) == (1, 1)
+    assert (await Media.get(id=photo.id)).phash is not None
+    assert (await Media.get(id=broken.id)).phash is None
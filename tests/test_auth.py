@@ -1,6 +1,7 @@
 from time import time
 
 import pytest
+from bcrypt import hashpw, gensalt
 from httpx import AsyncClient
 from pytest_httpx import HTTPXMock
 
@@ -8,8 +9,9 @@ from kkp.config import config
 from kkp.models import User
 from kkp.schemas.auth import GoogleAuthUrlData, ConnectGoogleData, GoogleClientIdData, LoginResponse
 from kkp.schemas.users import UserInfo
-from kkp.utils.google_id_token import GOOGLE_OAUTH2_CERTS_URL
+from kkp.utils.google_id_token import GOOGLE_OAUTH2_CERTS_URL, GOOGLE_CERTS
 from kkp.utils.google_oauth import GOOGLE_TOKEN_URL, GOOGLE_USERINFO_URL
+from kkp.utils.jwt import JWT
 from kkp.utils.mfa import Mfa
 from tests.conftest import PWD_HASH_123456789, httpx_mock_decorator, get_reset_token
 from tests.google_mock import GoogleMockState
@@ -76,6 +78,43 @@ async def test_login(client: AsyncClient):
     assert response.status_code == 200, response.json()
 
 
+@pytest.mark.asyncio
+async def test_login_rehashes_password(client: AsyncClient):
+    user = await User.create(
+        email=f"test{time()}@gmail.com", password=hashpw(b"123456789", gensalt(5)).decode("utf8"),
+        first_name="f", last_name="l",
+    )
+
+    response = await client.post("/auth/login", json={
+        "email": user.email,
+        "password": "123456789",
+    })
+    assert response.status_code == 200, response.json()
+
+    await user.refresh_from_db(fields=["password"])
+    assert user.password.startswith(f"$2b${config.bcrypt_rounds:02d}$")
+
+    response = await client.post("/auth/login", json={
+        "email": user.email,
+        "password": "123456789",
+    })
+    assert response.status_code == 200, response.json()
+
+
+@pytest.mark.asyncio
+async def test_login_hasher_overloaded(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    user = await User.create(
+        email=f"test{time()}@gmail.com", password=PWD_HASH_123456789, first_name="f", last_name="l",
+    )
+
+    monkeypatch.setattr(config, "bcrypt_max_pending", 0)
+    response = await client.post("/auth/login", json={
+        "email": user.email,
+        "password": "123456789",
+    })
+    assert response.status_code == 503, response.json()
+
+
 @pytest.mark.asyncio
 async def test_login_wrong_password(client: AsyncClient):
     email = f"test{time()}@gmail.com"
@@ -413,10 +452,6 @@ async def test_register_login_with_google_id_invalid_signature(client: AsyncClie
 @httpx_mock_decorator
 @pytest.mark.asyncio
 async def test_register_login_with_google_id_certs_fail(client: AsyncClient, httpx_mock: HTTPXMock):
-    from kkp.utils import google_id_token
-
-    google_id_token._GOOGLE_CERTS = None
-
     mock_state = GoogleMockState()
     httpx_mock.add_callback(mock_state.certs_callback_fail, method="GET", url=GOOGLE_OAUTH2_CERTS_URL)
 
@@ -466,3 +501,124 @@ async def test_register_login_with_google_id_invalid_aud(client: AsyncClient, ht
 
     response = await client.post("/auth/google/mobile-callback", json={"id_token": id_token})
     assert response.status_code == 400, response.json()
+
+
+@httpx_mock_decorator
+@pytest.mark.asyncio
+async def test_google_certs_cache(client: AsyncClient, httpx_mock: HTTPXMock):
+    mock_state = GoogleMockState()
+    httpx_mock.add_callback(mock_state.certs_callback, method="GET", url=GOOGLE_OAUTH2_CERTS_URL)
+    kid = JWT.unverified_header(mock_state.get_id_token_for_user("test@example.com"))["kid"]
+
+    assert kid in await GOOGLE_CERTS.get(kid)
+    assert len(httpx_mock.get_requests()) == 1
+    assert kid in await GOOGLE_CERTS.get(kid)
+    assert len(httpx_mock.get_requests()) == 1
+
+    # Certs fetched by another worker are loaded from redis
+    GOOGLE_CERTS.clear()
+    assert kid in await GOOGLE_CERTS.get(kid)
+    assert len(httpx_mock.get_requests()) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    user = await User.create(
+        email=f"test{time()}@gmail.com", password=PWD_HASH_123456789, first_name="f", last_name="l",
+    )
+
+    monkeypatch.setattr(config, "jwt_refresh_tokens", True)
+    response = await client.post("/auth/login", json={
+        "email": user.email,
+        "password": "123456789",
+    })
+    assert response.status_code == 200, response.json()
+    resp = LoginResponse(**response.json())
+    assert resp.refresh_token is not None
+    assert resp.expires_at < resp.refresh_expires_at
+
+    response = await client.get("/user/info", headers={"authorization": resp.token})
+    assert response.status_code == 200, response.json()
+    response = await client.get("/user/info", headers={"authorization": resp.refresh_token})
+    assert response.status_code == 401, response.json()
+
+    response = await client.post("/auth/refresh", json={"refresh_token": resp.refresh_token})
+    assert response.status_code == 200, response.json()
+    new_resp = LoginResponse(**response.json())
+
+    # Refresh token can be used only once
+    response = await client.post("/auth/refresh", json={"refresh_token": resp.refresh_token})
+    assert response.status_code == 401, response.json()
+
+    response = await client.get("/user/info", headers={"authorization": new_resp.token})
+    assert response.status_code == 200, response.json()
+
+    response = await client.post("/auth/logout", headers={"authorization": new_resp.token})
+    assert response.status_code == 204, response.json()
+
+    response = await client.get("/user/info", headers={"authorization": resp.token})
+    assert response.status_code == 401, response.json()
+    response = await client.post("/auth/refresh", json={"refresh_token": new_resp.refresh_token})
+    assert response.status_code == 401, response.json()
+
+
+@pytest.mark.asyncio
+async def test_access_token_of_deleted_user(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "jwt_refresh_tokens", True)
+    user = await User.create(
+        email=f"test{time()}@gmail.com", password=PWD_HASH_123456789, first_name="f", last_name="l",
+    )
+
+    response = await client.post("/auth/login", json={
+        "email": user.email,
+        "password": "123456789",
+    })
+    assert response.status_code == 200, response.json()
+    resp = LoginResponse(**response.json())
+
+    response = await client.get("/user/info", headers={"authorization": resp.token})
+    assert response.status_code == 200, response.json()
+
+    # Sessions are deleted with the user, access token stops working before it expires
+    await user.delete()
+    response = await client.get("/user/info", headers={"authorization": resp.token})
+    assert response.status_code == 401, response.json()
+
+
+@pytest.mark.asyncio
+async def test_login_rate_limit(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    email = f"test{time()}@gmail.com"
+
+    monkeypatch.setattr(config, "rate_limit_enabled", True)
+    for _ in range(5):
+        response = await client.post("/auth/login", json={
+            "email": email,
+            "password": "123456789",
+        })
+        assert response.status_code == 400, response.json()
+
+    response = await client.post("/auth/login", json={
+        "email": email,
+        "password": "123456789",
+    })
+    assert response.status_code == 429, response.json()
+    assert int(response.headers["Retry-After"]) > 0
+    assert response.headers["X-RateLimit-Remaining"] == "0"
+
+
+@pytest.mark.asyncio
+async def test_login_mfa_rate_limit_headers(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    user = await User.create(
+        email=f"test{time()}@gmail.com", password=PWD_HASH_123456789,
+        first_name="first", last_name="last", mfa_key="A" * 16,
+    )
+
+    monkeypatch.setattr(config, "rate_limit_enabled", True)
+    response = await client.post("/auth/login", json={
+        "email": user.email,
+        "password": "123456789",
+    })
+    assert response.status_code == 400, response.json()
+    assert "mfa_token" in response.json()
+    assert response.headers["X-RateLimit-Limit"] == "10"
+    assert int(response.headers["X-RateLimit-Remaining"]) < 10
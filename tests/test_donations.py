@@ -1,9 +1,10 @@
 from time import time
 
 import pytest
-from httpx import AsyncClient
+from httpx import AsyncClient, ReadTimeout, ConnectError, Request, Response
 from pytest_httpx import HTTPXMock
 
+from kkp.config import config
 from kkp.models import UserRole, DonationGoal
 from kkp.schemas.common import PaginationResponse
 from kkp.schemas.donations import DonationGoalInfo, DonationInfo, DonationCreatedInfo
@@ -263,3 +264,51 @@ async def test_create_donation_ended_goal(client: AsyncClient, httpx_mock: HTTPX
         "comment": "test 123",
     })
     assert response.status_code == 400, response.json()
+
+
+@httpx_mock_decorator
+@pytest.mark.asyncio
+async def test_create_donation_paypal_retries(
+        client: AsyncClient, httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "paypal_retry_backoff", .01)
+    monkeypatch.setattr(PayPal, "_access_token", None)
+
+    mock_state = PaypalMockState()
+    failures = {"auth": 0, "order": 0}
+
+    async def flaky_auth_callback(request: Request) -> Response:
+        if failures["auth"] < config.paypal_retries:
+            failures["auth"] += 1
+            raise ReadTimeout("Read timed out", request=request)
+        return await mock_state.auth_callback(request)
+
+    async def flaky_order_callback(request: Request) -> Response:
+        # Creating an order is not idempotent, so only connection errors are retried
+        if not failures["order"]:
+            failures["order"] += 1
+            raise ConnectError("Connection refused", request=request)
+        return await mock_state.order_callback(request)
+
+    httpx_mock.add_callback(flaky_auth_callback, method="POST", url=PayPal.AUTHORIZE)
+    httpx_mock.add_callback(flaky_order_callback, method="POST", url=PayPal.CHECKOUT)
+    httpx_mock.add_callback(mock_state.capture_callback, method="POST", url=PaypalMockState.CAPTURE_RE)
+
+    goal = await DonationGoal.create(name="test", description="test goal", need_amount=100)
+
+    response = await client.post(f"/donations/{goal.id}/donate", json={
+        "amount": 10,
+        "anonymous": False,
+        "comment": "test",
+    })
+    assert response.status_code == 200, response.json()
+    donation_created = DonationCreatedInfo(**response.json())
+    assert failures == {"auth": config.paypal_retries, "order": 1}
+
+    paypal_client = PayPal._client
+    assert paypal_client is not None
+
+    mock_state.mark_as_payed(donation_created.paypal_id)
+    response = await client.post(f"/donations/{goal.id}/donations/{donation_created.id}")
+    assert response.status_code == 200, response.json()
+    assert PayPal._client is paypal_client
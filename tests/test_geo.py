@@ -0,0 +1,42 @@
+import pytest
+from tortoise.exceptions import FieldError
+
+from kkp.db.point import Point, decode_points, encode_points
+from kkp.utils.geo import haversine, within_radius
+
+LON = 42.42424242
+LAT = 24.24242424
+
+
+def test_decode_encode_points():
+    points = [Point(LON + i / 100, LAT - i / 100) for i in range(10)]
+
+    coords = decode_points([point.to_sql_wkb_bin() for point in points])
+    assert len(coords) == len(points) * 2
+    for idx, point in enumerate(points):
+        assert coords[idx * 2] == point.lon
+        assert coords[idx * 2 + 1] == point.lat
+
+    assert decode_points([point.to_sql_wkb_bin().hex() for point in points]) == coords
+    assert encode_points(coords) == [point.to_sql_wkb_bin() for point in points]
+
+
+def test_decode_points_invalid():
+    with pytest.raises(FieldError):
+        decode_points([Point(LON, LAT).to_sql_wkb_bin()[:-1]])
+
+    wkb = bytearray(Point(LON, LAT).to_sql_wkb_bin())
+    wkb[4] = 0
+    with pytest.raises(FieldError):
+        decode_points([bytes(wkb)])
+
+
+def test_haversine():
+    coords = [LON, LAT, LON, LAT + 1, LON + 1, LAT, LON + 0.001, LAT]
+    distances = haversine(LON, LAT, coords)
+
+    assert len(distances) == 4
+    assert distances[0] == 0
+    assert 111_000 < distances[1] < 111_400
+    assert distances[2] < distances[1]
+    assert within_radius(LON, LAT, coords, 1000) == [0, 3]
@@ -0,0 +1,127 @@
+import pytest
+from httpx import AsyncClient
+
+from kkp.models import UserRole, GeofenceType, Geofence
+from kkp.schemas.geofences import GeofenceInfo
+from tests.conftest import create_token
+
+LON = 42.42424242
+LAT = 24.24242424
+
+
+@pytest.mark.asyncio
+async def test_create_circle_geofence(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+
+    response = await client.post("/geofences", headers={"authorization": user_token}, json={
+        "name": "home",
+        "type": GeofenceType.CIRCLE.value,
+        "latitude": LAT,
+        "longitude": LON,
+        "radius": 1000,
+    })
+    assert response.status_code == 200, response.json()
+    geofence = GeofenceInfo(**response.json())
+    assert geofence.name == "home"
+    assert geofence.radius == 1000
+    assert geofence.polygon is None
+
+    response = await client.get("/geofences", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    assert [GeofenceInfo(**info) for info in response.json()] == [geofence]
+
+    matching = await Geofence.get_matching(LAT + 0.005, LON)
+    assert geofence.id in [fence.id for fence in matching]
+    matching = await Geofence.get_matching(LAT + 0.02, LON)
+    assert geofence.id not in [fence.id for fence in matching]
+
+
+@pytest.mark.asyncio
+async def test_create_circle_geofence_invalid_radius(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+
+    for radius in (99, 50001):
+        response = await client.post("/geofences", headers={"authorization": user_token}, json={
+            "name": "home",
+            "type": GeofenceType.CIRCLE.value,
+            "latitude": LAT,
+            "longitude": LON,
+            "radius": radius,
+        })
+        assert response.status_code == 422, response.json()
+
+
+@pytest.mark.asyncio
+async def test_create_polygon_geofence(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+
+    response = await client.post("/geofences", headers={"authorization": user_token}, json={
+        "type": GeofenceType.POLYGON.value,
+        "polygon": [
+            {"latitude": LAT, "longitude": LON},
+            {"latitude": LAT + 0.1, "longitude": LON},
+            {"latitude": LAT + 0.1, "longitude": LON + 0.1},
+            {"latitude": LAT, "longitude": LON + 0.1},
+        ],
+    })
+    assert response.status_code == 200, response.json()
+    geofence = GeofenceInfo(**response.json())
+    assert len(geofence.polygon) == 4
+
+    matching = await Geofence.get_matching(LAT + 0.05, LON + 0.05)
+    assert geofence.id in [fence.id for fence in matching]
+    matching = await Geofence.get_matching(LAT + 0.05, LON + 0.15)
+    assert geofence.id not in [fence.id for fence in matching]
+
+
+@pytest.mark.asyncio
+async def test_create_geofence_invalid(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+
+    response = await client.post("/geofences", headers={"authorization": user_token}, json={
+        "type": GeofenceType.CIRCLE.value,
+        "latitude": LAT,
+    })
+    assert response.status_code == 400, response.json()
+
+    response = await client.post("/geofences", headers={"authorization": user_token}, json={
+        "type": GeofenceType.POLYGON.value,
+        "polygon": [{"latitude": LAT, "longitude": LON}, {"latitude": LAT + 0.1, "longitude": LON}],
+    })
+    assert response.status_code == 400, response.json()
+
+    response = await client.post("/geofences", headers={"authorization": user_token}, json={
+        "type": GeofenceType.POLYGON.value,
+        "polygon": [
+            {"latitude": LAT, "longitude": LON},
+            {"latitude": LAT + 5, "longitude": LON},
+            {"latitude": LAT + 5, "longitude": LON + 5},
+        ],
+    })
+    assert response.status_code == 400, response.json()
+
+
+@pytest.mark.asyncio
+async def test_delete_geofence(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+    user2_token = await create_token(UserRole.REGULAR)
+
+    response = await client.post("/geofences", headers={"authorization": user_token}, json={
+        "type": GeofenceType.CIRCLE.value,
+        "latitude": LAT,
+        "longitude": LON,
+        "radius": 1000,
+    })
+    assert response.status_code == 200, response.json()
+    geofence = GeofenceInfo(**response.json())
+
+    response = await client.delete(f"/geofences/{geofence.id}", headers={"authorization": user2_token})
+    assert response.status_code == 404, response.json()
+
+    response = await client.delete(f"/geofences/{geofence.id}", headers={"authorization": user_token})
+    assert response.status_code == 204, response.json()
+
+    response = await client.get("/geofences", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    assert response.json() == []
+    assert geofence.id not in [fence.id for fence in await Geofence.get_matching(LAT, LON)]
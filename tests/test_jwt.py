@@ -0,0 +1,31 @@
+from os import urandom
+
+from kkp.utils.jwt import JWT
+
+
+def test_jwt_encode_decode():
+    key = urandom(16)
+    token = JWT.encode({"a": 1}, key, expires_in=60)
+
+    assert JWT.decode(token, key) == {"a": 1}
+    assert JWT.decode(token, urandom(16)) is None
+    assert JWT.decode(token[:-2], key) is None
+    assert JWT.decode("not.a-jwt", key) is None
+
+
+def test_jwt_verified_cache():
+    key = urandom(16)
+    token = JWT.encode({"a": 1, "b": {"c": [1]}}, key, expires_in=60)
+
+    payload = JWT.decode(token, key)
+    payload["a"] = 2
+    payload["b"]["c"].append(2)
+    assert JWT.decode(token, key) == {"a": 1, "b": {"c": [1]}}
+    assert JWT.decode(token, urandom(16)) is None
+
+    # Cached signature must not be accepted for different payload
+    header, _, signature = token.split(".")
+    assert JWT.decode(f"{header}.{JWT._b64encode({'a': 2, 'b': {'c': [1]}})}.{signature}", key) is None
+
+    expired = JWT.encode({"a": 1}, key, expire_timestamp=1)
+    assert JWT.decode(expired, key) is None
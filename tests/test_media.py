@@ -1,13 +1,21 @@
+from base64 import b64decode
 from datetime import timedelta, datetime
+from hashlib import sha256
+from io import BytesIO
+from os import urandom
 
 import pytest
 from httpx import AsyncClient
+from PIL import Image
 from pytz import UTC
+from s3lite.exceptions import S3Exception
 
-from kkp.config import config
-from kkp.models import UserRole, MediaType, Media
-from kkp.schemas.media import CreateMediaUploadResponse, MediaInfo
-from tests.conftest import create_token
+from kkp.config import config, S3
+from kkp.models import UserRole, MediaType, Media, NotificationJob, MediaStatus, Animal, AnimalStatus
+from kkp.schemas.media import CreateMediaUploadResponse, MediaInfo, MultipartUploadState, UploadPartUrl
+from kkp.utils.media_gc import MediaGc
+from kkp.utils.media_processing import MediaProcessor
+from tests.conftest import create_token, wait_for, wait_for_outbox
 
 IMG_1x1_PIXEL_RED = bytes.fromhex(
     "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753"
@@ -16,6 +24,30 @@ IMG_1x1_PIXEL_RED = bytes.fromhex(
 )
 
 
+async def _upload(
+        client: AsyncClient, content: bytes, media_type: MediaType = MediaType.PHOTO,
+) -> CreateMediaUploadResponse:
+    response = await client.post("/media", json={
+        "type": media_type.value,
+        "size": len(content),
+    })
+    assert response.status_code == 200, response.json()
+    resp = CreateMediaUploadResponse(**response.json())
+
+    async with AsyncClient() as cl:
+        upload_response = await cl.put(resp.upload_url, content=content)
+        assert upload_response.status_code == 200
+
+    return resp
+
+
+async def _upload_and_finalize(client: AsyncClient, content: bytes) -> MediaInfo:
+    resp = await _upload(client, content)
+    response = await client.post(f"/media/{resp.id}/finalize")
+    assert response.status_code == 200, response.json()
+    return MediaInfo(**response.json())
+
+
 @pytest.mark.asyncio
 async def test_upload_photo(client: AsyncClient):
     user_token = await create_token(UserRole.REGULAR)
@@ -138,3 +170,284 @@ async def test_finalize_media_expired(client: AsyncClient):
 
     response = await client.post(f"/media/{resp.id}/finalize")
     assert response.status_code == 400, response.json()
+
+
+@pytest.mark.asyncio
+async def test_finalize_media_too_big(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    resp = await _upload(client, IMG_1x1_PIXEL_RED)
+    monkeypatch.setattr(config, "max_photo_size", len(IMG_1x1_PIXEL_RED) - 1)
+
+    response = await client.post(f"/media/{resp.id}/finalize")
+    assert response.status_code == 400, response.json()
+    assert not await Media.filter(id=resp.id).exists()
+
+
+@pytest.mark.asyncio
+async def test_finalize_media_invalid_content(client: AsyncClient):
+    for media_type, content in (
+            (MediaType.PHOTO, b"definitely not an image"),
+            (MediaType.VIDEO, IMG_1x1_PIXEL_RED),
+    ):
+        resp = await _upload(client, content, media_type)
+        response = await client.post(f"/media/{resp.id}/finalize")
+        assert response.status_code == 400, response.json()
+        assert not await Media.filter(id=resp.id).exists()
+
+
+@pytest.mark.asyncio
+async def test_finalize_media_stores_size_and_type(client: AsyncClient):
+    resp = await _upload_and_finalize(client, IMG_1x1_PIXEL_RED)
+
+    media = await Media.get(id=resp.id)
+    assert media.size == len(IMG_1x1_PIXEL_RED)
+    assert media.content_type == "image/png"
+
+
+@pytest.mark.asyncio
+async def test_photo_variants(client: AsyncClient):
+    photo = BytesIO()
+    Image.new("RGB", (1200, 600), (255, 0, 0)).save(photo, "JPEG")
+    resp = await _upload_and_finalize(client, photo.getvalue())
+    await wait_for_outbox()
+
+    info = MediaInfo(**(await Media.get(id=resp.id)).to_json())
+    assert (info.width, info.height) == (1200, 600)
+    assert [variant.width for variant in info.variants] == [
+        width for width in sorted(config.media_variant_widths) if width < 1200
+    ]
+
+    async with AsyncClient() as cl:
+        for variant in info.variants:
+            variant_response = await cl.get(variant.url)
+            assert variant_response.status_code == 200
+            with Image.open(BytesIO(await variant_response.aread())) as img:
+                assert img.format == "WEBP"
+                assert img.size == (variant.width, variant.width // 2)
+
+    assert info.placeholder.startswith("data:image/webp;base64,")
+    with Image.open(BytesIO(b64decode(info.placeholder.split(",", 1)[1]))) as img:
+        assert img.size == (config.media_placeholder_size, config.media_placeholder_size // 2)
+
+
+@pytest.mark.asyncio
+async def test_photo_processing_invalidates_cached_json(client: AsyncClient):
+    photo = BytesIO()
+    Image.new("RGB", (1200, 600), (0, 255, 0)).save(photo, "JPEG")
+    media = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED, size=len(photo.getvalue()))
+    await S3.upload_object(config.s3_bucket_name, media.object_key(), photo)
+    animal = await Animal.create(name="test", breed="idk", status=AnimalStatus.FOUND)
+    await animal.medias.add(media)
+
+    cached = await animal.to_json()
+    assert cached["media"]["result"][0]["variants"] == []
+
+    await MediaProcessor.process(media)
+    animal_json = await (await Animal.get(id=animal.id)).to_json()
+    assert animal_json["media"]["result"][0]["variants"]
+    assert animal_json["media"]["result"][0]["placeholder"] is not None
+
+
+@pytest.mark.asyncio
+async def test_upload_video_multipart(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "multipart_part_size", 5 * 1024 * 1024)
+    video = b"\x00\x00\x00\x18ftypmp42" + urandom(5 * 1024 * 1024 + 1000)
+
+    user_token = await create_token(UserRole.REGULAR)
+    response = await client.post("/media", headers={"authorization": user_token}, json={
+        "type": MediaType.VIDEO.value,
+        "size": len(video),
+        "multipart": True,
+    })
+    assert response.status_code == 200, response.json()
+    resp = CreateMediaUploadResponse(**response.json())
+    assert resp.upload_url is None
+    assert resp.parts_count == 2
+    parts = [video[:resp.part_size], video[resp.part_size:]]
+
+    response = await client.get(f"/media/{resp.id}/parts/3", headers={"authorization": user_token})
+    assert response.status_code == 400, response.json()
+
+    response = await client.get(f"/media/{resp.id}/parts/1", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    async with AsyncClient() as cl:
+        upload_response = await cl.put(UploadPartUrl(**response.json()).url, content=parts[0])
+        assert upload_response.status_code == 200
+
+    # Upload is not complete, finalizing fails but upload can be resumed
+    response = await client.post(f"/media/{resp.id}/finalize", headers={"authorization": user_token})
+    assert response.status_code == 400, response.json()
+
+    response = await client.get(f"/media/{resp.id}/parts", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    state = MultipartUploadState(**response.json())
+    assert state.parts_count == 2
+    assert state.uploaded_parts == [1]
+
+    response = await client.get(f"/media/{resp.id}/parts/2", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    async with AsyncClient() as cl:
+        upload_response = await cl.put(UploadPartUrl(**response.json()).url, content=parts[1])
+        assert upload_response.status_code == 200
+
+    response = await client.post(f"/media/{resp.id}/finalize", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    info = MediaInfo(**response.json())
+
+    media = await Media.get(id=resp.id)
+    assert media.upload_id is None
+    assert media.size == len(video)
+
+    async with AsyncClient() as cl:
+        media_response = await cl.get(info.url)
+        assert media_response.status_code == 200
+        assert await media_response.aread() == video
+
+
+@pytest.mark.asyncio
+async def test_upload_multipart_transient_error(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    video = b"\x00\x00\x00\x18ftypmp42" + urandom(1000)
+
+    user_token = await create_token(UserRole.REGULAR)
+    response = await client.post("/media", headers={"authorization": user_token}, json={
+        "type": MediaType.VIDEO.value,
+        "size": len(video),
+        "multipart": True,
+    })
+    assert response.status_code == 200, response.json()
+    resp = CreateMediaUploadResponse(**response.json())
+
+    response = await client.get(f"/media/{resp.id}/parts/1", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+    async with AsyncClient() as cl:
+        upload_response = await cl.put(UploadPartUrl(**response.json()).url, content=video)
+        assert upload_response.status_code == 200
+
+    finish_multipart_upload = S3.finish_multipart_upload
+
+    async def _failing_finish(*args, **kwargs) -> None:
+        raise S3Exception("InternalError", "We encountered an internal error. Please try again.")
+
+    # Transient error does not discard uploaded parts
+    monkeypatch.setattr(S3, "finish_multipart_upload", _failing_finish)
+    response = await client.post(f"/media/{resp.id}/finalize", headers={"authorization": user_token})
+    assert response.status_code == 503, response.json()
+    assert (await Media.get(id=resp.id)).upload_id is not None
+
+    monkeypatch.setattr(S3, "finish_multipart_upload", finish_multipart_upload)
+    response = await client.post(f"/media/{resp.id}/finalize", headers={"authorization": user_token})
+    assert response.status_code == 200, response.json()
+
+
+@pytest.mark.asyncio
+async def test_abort_abandoned_multipart_upload(client: AsyncClient):
+    response = await client.post("/media", json={
+        "type": MediaType.VIDEO.value,
+        "size": 1024,
+        "multipart": True,
+    })
+    assert response.status_code == 200, response.json()
+    resp = CreateMediaUploadResponse(**response.json())
+
+    await NotificationJob.filter(task="abort_multipart_upload").update(run_at=datetime.now(UTC))
+    async def _deleted() -> bool:
+        return not await Media.filter(id=resp.id).exists()
+
+    await wait_for(_deleted)
+
+
+@pytest.mark.asyncio
+async def test_media_urls_are_stable(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    media = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED)
+
+    url = media.to_json()["url"]
+    assert "X-Amz-Signature" not in url
+    assert media.to_json()["url"] == url
+
+    monkeypatch.setattr(config, "media_url_mode", "presigned")
+    url = media.to_json()["url"]
+    assert "X-Amz-Signature" in url
+    assert media.to_json()["url"] == url
+
+
+@pytest.mark.asyncio
+async def test_media_gc(client: AsyncClient):
+    old = datetime.now(UTC) - timedelta(days=3)
+
+    orphaned = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED, variants=[160])
+    referenced = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED)
+    fresh = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED)
+    not_finalized = await Media.create(type=MediaType.PHOTO, status=MediaStatus.CREATED)
+    animal = await Animal.create(name="test", breed="idk", status=AnimalStatus.FOUND, description="")
+    await animal.medias.add(referenced)
+    await Media.filter(id__in=[orphaned.id, referenced.id, not_finalized.id]).update(uploaded_at=old)
+
+    for key in (orphaned.object_key(), orphaned.variant_key(160), referenced.object_key()):
+        await S3.upload_object(config.s3_bucket_name, key, BytesIO(IMG_1x1_PIXEL_RED))
+
+    all_ids = {orphaned.id, referenced.id, fresh.id, not_finalized.id}
+
+    stats = await MediaGc.run(dry_run=True, batch_size=1)
+    assert stats.finished
+    assert stats.found >= 2
+    assert stats.deleted_media == 0
+    assert set(await Media.filter(id__in=all_ids).values_list("id", flat=True)) == all_ids
+
+    stats = await MediaGc.run(batch_size=1)
+    assert stats.finished
+    assert stats.deleted_media >= 2
+    assert set(await Media.filter(id__in=all_ids).values_list("id", flat=True)) == {referenced.id, fresh.id}
+
+    assert await S3.get_object(config.s3_bucket_name, orphaned.object_key()) is None
+    assert await S3.get_object(config.s3_bucket_name, orphaned.variant_key(160)) is None
+    assert await S3.get_object(config.s3_bucket_name, referenced.object_key()) is not None
+
+
+@pytest.mark.asyncio
+async def test_media_gc_retries_failed_deletes(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    orphaned = await Media.create(type=MediaType.PHOTO, status=MediaStatus.UPLOADED)
+    await Media.filter(id=orphaned.id).update(uploaded_at=datetime.now(UTC) - timedelta(days=3))
+
+    async def _failing_delete_objects(bucket: str, keys: list[str]) -> list[str]:
+        raise ConnectionError("S3 is not available")
+
+    monkeypatch.setattr(S3, "delete_objects", _failing_delete_objects)
+    stats = await MediaGc.run()
+    assert stats.failed_objects >= 1
+    assert not await Media.filter(id=orphaned.id).exists()
+
+    # Row is deleted, so object deletion is persisted as outbox job instead of being lost
+    jobs = await NotificationJob.filter(task="delete_media_objects")
+    assert any(orphaned.object_key() in job.payload["keys"] for job in jobs)
+
+
+@pytest.mark.asyncio
+async def test_media_deduplication(client: AsyncClient):
+    photo = BytesIO()
+    Image.new("RGB", (800, 600), tuple(urandom(3))).save(photo, "JPEG")
+    photo = photo.getvalue()
+
+    first = await _upload_and_finalize(client, photo)
+    await wait_for_outbox("process_media")
+
+    second = await _upload_and_finalize(client, photo)
+    second_old_key = (await Media.get(id=second.id)).object_key()
+    await wait_for_outbox("process_media")
+
+    first_media = await Media.get(id=first.id)
+    second_media = await Media.get(id=second.id)
+    assert first_media.sha256 == sha256(photo).hexdigest()
+    assert second_media.sha256 == first_media.sha256
+    assert second_media.media_id == first_media.media_id
+    assert second_media.to_json()["variants"] == first_media.to_json()["variants"]
+    assert await NotificationJob.filter(task="delete_media_objects").exists()
+    # Old object is kept for a while, its url was already returned to the client
+    assert await S3.get_object(config.s3_bucket_name, second_old_key) is not None
+
+    # Hash sent by client is not trusted, content has to be uploaded anyway
+    response = await client.post("/media", json={
+        "type": MediaType.PHOTO.value,
+        "size": len(photo),
+        "sha256": sha256(photo).hexdigest(),
+    })
+    assert response.status_code == 200, response.json()
+    assert CreateMediaUploadResponse(**response.json()).upload_url is not None
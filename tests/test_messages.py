@@ -1,10 +1,12 @@
 import pytest
 from httpx import AsyncClient
 
+from kkp.config import config, REDIS
 from kkp.models import UserRole, Session, MediaStatus, MediaType, Media
 from kkp.schemas.common import PaginationResponse
 from kkp.schemas.messages import DialogInfo, MessageInfo
-from tests.conftest import create_token, create_user
+from kkp.utils.chat_notifications import ChatNotifications
+from tests.conftest import create_token, create_user, wait_for_outbox, MAILCATCHER_PORT, MailCatcherEmailMetadataList
 
 
 class DialogPaginationResponse(PaginationResponse[DialogInfo]):
@@ -227,3 +229,59 @@ async def test_messages_dialogs_ordering_by_last_message(client: AsyncClient):
     assert resp.count == 2
     assert resp.result[0].user.id == user1.id
     assert resp.result[1].user.id == user2.id
+
+
+async def _get_email_subjects(email: str) -> list[str]:
+    async with AsyncClient() as cl:
+        resp = await cl.get(f"http://127.0.0.1:{MAILCATCHER_PORT}/messages")
+        emails = MailCatcherEmailMetadataList(resp.json())
+
+    return [message.subject for message in emails.root if f"<{email}>" in message.recipients]
+
+
+@pytest.mark.asyncio
+async def test_message_notifications_coalesced(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "chat_push_window", 1)
+    monkeypatch.setattr(config, "chat_email_delay", 1)
+
+    user1 = await create_user(UserRole.REGULAR)
+    user_token1 = (await Session.create(user=user1)).to_jwt()
+    user2 = await create_user(UserRole.REGULAR)
+    user_token2 = (await Session.create(user=user2)).to_jwt()
+
+    for i in range(3):
+        response = await client.post(f"/messages/{user2.id}", headers={"authorization": user_token1}, json={
+            "text": f"test {i}",
+        })
+        assert response.status_code == 200, response.json()
+
+    await wait_for_outbox()
+    assert await _get_email_subjects(user2.email) == ["3 new messages"]
+
+    response = await client.post(f"/messages/{user2.id}", headers={"authorization": user_token1}, json={
+        "text": "test read",
+    })
+    assert response.status_code == 200, response.json()
+    response = await client.get(f"/messages/{user1.id}", headers={"authorization": user_token2})
+    assert response.status_code == 200, response.json()
+
+    await wait_for_outbox()
+    assert await _get_email_subjects(user2.email) == ["3 new messages"]
+
+
+@pytest.mark.asyncio
+async def test_message_notification_counters_expire(client: AsyncClient):
+    user1 = await create_user(UserRole.REGULAR)
+    user_token1 = (await Session.create(user=user1)).to_jwt()
+    user2 = await create_user(UserRole.REGULAR)
+
+    for i in range(2):
+        response = await client.post(f"/messages/{user2.id}", headers={"authorization": user_token1}, json={
+            "text": f"test {i}",
+        })
+        assert response.status_code == 200, response.json()
+
+    for kind, window in (("push", config.chat_push_window), ("email", config.chat_email_delay)):
+        key = ChatNotifications._key(kind, user2.id, user1.id)
+        assert int(await REDIS.get(key)) == 2
+        assert 0 < await REDIS.ttl(key) <= window + 60 * 60
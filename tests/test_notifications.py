@@ -0,0 +1,222 @@
+import json
+from asyncio import sleep, gather
+from email.message import EmailMessage
+from os import urandom
+
+import pytest
+from aiosmtplib import SMTPServerDisconnected
+from httpx import AsyncClient
+
+from kkp.config import SMTP, config
+from kkp.models import Session, Animal, AnimalStatus, UserRole, NotificationJob
+from kkp.utils import notification_util
+from kkp.schemas.volunteer_requests import VolunteerRequestInfo
+from kkp.utils.notification_util import send_notification
+from tests.conftest import create_user, create_token, wait_for, wait_for_outbox, MAILCATCHER_PORT, \
+    MailCatcherEmailMetadataList
+from tests.test_volunteer_requests import VOL_REQUEST_DATA
+
+
+def _fcm_error(code: int, status: str, error_code: str, field: str | None = None) -> RuntimeError:
+    details = [{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": error_code}]
+    if field is not None:
+        details.append({
+            "@type": "type.googleapis.com/google.rpc.BadRequest",
+            "fieldViolations": [{"field": field, "description": "Invalid value"}],
+        })
+    return RuntimeError(json.dumps({"error": {"code": code, "message": "error", "status": status, "details": details}}))
+
+
+class FakeFCM:
+    def __init__(self, invalid: set[str], error: Exception | None = None) -> None:
+        self.invalid = invalid
+        self.error = error
+        self.sent: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_notification(self, title: str, text: str, device_token: str) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await sleep(.01)
+        self.in_flight -= 1
+
+        if self.error is not None:
+            raise self.error
+        if device_token in self.invalid:
+            raise _fcm_error(404, "NOT_FOUND", "UNREGISTERED")
+        if device_token == "malformed":
+            raise _fcm_error(400, "INVALID_ARGUMENT", "INVALID_ARGUMENT", "message.token")
+        if device_token == "broken":
+            raise _fcm_error(503, "UNAVAILABLE", "UNAVAILABLE")
+        self.sent.append(device_token)
+
+
+@pytest.mark.asyncio
+async def test_send_push_prunes_invalid_tokens(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    fcm = FakeFCM({"invalid1", "invalid2"})
+    monkeypatch.setattr(notification_util, "FCM", fcm)
+
+    user = await create_user()
+    sessions = [
+        await Session.create(user=user, fcm_token=token, fcm_token_time=idx)
+        for idx, token in enumerate(("valid1", "invalid1", "valid2", "invalid2", "broken", "malformed"))
+    ]
+
+    await send_notification(user, "test", "test", email=False)
+
+    assert sorted(fcm.sent) == ["valid1", "valid2"]
+    assert fcm.max_in_flight > 1
+
+    tokens = dict(await Session.filter(id__in=[session.id for session in sessions]).values_list("id", "fcm_token"))
+    assert tokens == {
+        sessions[0].id: "valid1",
+        sessions[1].id: None,
+        sessions[2].id: "valid2",
+        sessions[3].id: None,
+        sessions[4].id: "broken",
+        sessions[5].id: None,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [
+    # Message is too big or has invalid content, token is fine
+    _fcm_error(400, "INVALID_ARGUMENT", "INVALID_ARGUMENT", "message.notification.body"),
+    _fcm_error(400, "INVALID_ARGUMENT", "INVALID_ARGUMENT"),
+    # Misconfigured project
+    _fcm_error(404, "NOT_FOUND", "SENDER_ID_MISMATCH"),
+    RuntimeError("404 NOT_FOUND"),
+])
+async def test_send_push_keeps_tokens_on_message_errors(
+        client: AsyncClient, monkeypatch: pytest.MonkeyPatch, error: Exception,
+):
+    fcm = FakeFCM(set(), error)
+    monkeypatch.setattr(notification_util, "FCM", fcm)
+
+    user = await create_user()
+    session = await Session.create(user=user, fcm_token="valid", fcm_token_time=1)
+
+    await send_notification(user, "test", "test", email=False)
+
+    await session.refresh_from_db()
+    assert session.fcm_token == "valid"
+
+
+@pytest.mark.asyncio
+async def test_smtp_pool_concurrent_send(client: AsyncClient):
+    prefix = urandom(4).hex()
+    recipients = [f"<{prefix}{idx}@example.com>" for idx in range(20)]
+
+    def _message(recipient: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = "kkp@example.com"
+        message["To"] = recipient
+        message["Subject"] = "test"
+        message.set_content("test")
+        return message
+
+    await gather(*(SMTP.send_message(_message(recipient), timeout=5) for recipient in recipients))
+    # Closed connections are replaced with new ones
+    for conn, _ in SMTP._idle:
+        conn.close()
+    await SMTP.send_message(_message(recipients[0]), timeout=5)
+
+    async with AsyncClient() as cl:
+        resp = await cl.get(f"http://127.0.0.1:{MAILCATCHER_PORT}/messages")
+        emails = MailCatcherEmailMetadataList(resp.json())
+
+    received = [recipient for email in emails.root for recipient in email.recipients if recipient in recipients]
+    assert sorted(received) == sorted(recipients + recipients[:1])
+
+
+@pytest.mark.asyncio
+async def test_animal_update_fan_out(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    fcm = FakeFCM(set())
+    monkeypatch.setattr(notification_util, "FCM", fcm)
+    monkeypatch.setattr(config, "subscribers_chunk_size", 2)
+
+    vet_token = await create_token(UserRole.VET)
+    animal = await Animal.create(name="test", breed="idk", status=AnimalStatus.ON_TREATMENT, description="")
+
+    tokens = []
+    for idx in range(5):
+        user = await create_user()
+        await user.subscriptions.add(animal)
+        await Session.create(user=user, fcm_token=f"sub{idx}", fcm_token_time=1)
+        tokens.append(f"sub{idx}")
+    not_subscribed = await create_user()
+    await Session.create(user=not_subscribed, fcm_token="not-subscribed", fcm_token_time=1)
+
+    response = await client.patch(f"/animals/{animal.id}", headers={"authorization": vet_token}, json={
+        "name": "test edited",
+    })
+    assert response.status_code == 200, response.json()
+
+    await wait_for_outbox()
+
+    assert sorted(fcm.sent) == tokens
+
+
+@pytest.mark.asyncio
+async def test_report_push_not_duplicated_for_subscribers(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    fcm = FakeFCM(set())
+    monkeypatch.setattr(notification_util, "FCM", fcm)
+
+    user_token = await create_token(UserRole.REGULAR)
+    animal = await Animal.create(name="test", breed="idk", status=AnimalStatus.FOUND, description="")
+    location = {"latitude": 24.24242424, "longitude": 42.42424242}
+    for token, subscribed in (("vet-subscribed", True), ("vet", False)):
+        vet = await create_user(UserRole.VET)
+        if subscribed:
+            await vet.subscriptions.add(animal)
+        session = await Session.create(user=vet, fcm_token=token, fcm_token_time=1)
+        response = await client.post("/user/location", headers={"authorization": session.to_jwt()}, json=location)
+        assert response.status_code == 204, response.json()
+
+    response = await client.post("/animal-reports", headers={"authorization": user_token}, json={
+        "animal_id": animal.id,
+        "notes": "seen again",
+        "media_ids": [],
+        **location,
+    })
+    assert response.status_code == 200, response.json()
+
+    await wait_for_outbox()
+    assert sorted(fcm.sent) == ["vet", "vet-subscribed"]
+
+
+@pytest.mark.asyncio
+async def test_push_is_sent_when_email_fails(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    fcm = FakeFCM(set())
+    monkeypatch.setattr(notification_util, "FCM", fcm)
+
+    async def _fail(*args, **kwargs) -> None:
+        raise SMTPServerDisconnected("smtp server is down")
+
+    monkeypatch.setattr(SMTP, "send_message", _fail)
+
+    user = await create_user()
+    session = await Session.create(user=user, fcm_token="volunteer", fcm_token_time=1)
+    admin_token = await create_token(UserRole.GLOBAL_ADMIN)
+
+    response = await client.post(
+        "/volunteer-requests", headers={"authorization": session.to_jwt()}, json=VOL_REQUEST_DATA,
+    )
+    assert response.status_code == 200, response.json()
+    vol_request = VolunteerRequestInfo(**response.json())
+
+    response = await client.post(
+        f"/admin/volunteer-requests/{vol_request.id}/approve", headers={"authorization": admin_token},
+        json={"text": "welcome"},
+    )
+    assert response.status_code == 200, response.json()
+
+    async def _sent() -> bool:
+        return bool(fcm.sent)
+
+    await wait_for(_sent)
+    assert fcm.sent == ["volunteer"]
+    # Only email job is left to be retried
+    jobs = await NotificationJob.filter(task="send_volunteer_request_notification")
+    assert [job.payload["fcm"] for job in jobs] == [False]
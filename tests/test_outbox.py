@@ -0,0 +1,59 @@
+import pytest
+from httpx import AsyncClient
+
+from kkp.config import config
+from kkp.models import NotificationJob, NotificationJobStatus
+from kkp.utils.outbox import Outbox
+from tests.conftest import wait_for
+
+_calls: list[int] = []
+
+
+@Outbox.task
+async def _outbox_test_task(value: int) -> None:
+    _calls.append(value)
+
+
+@Outbox.task
+async def _outbox_test_failing_task(value: int) -> None:
+    _calls.append(value)
+    raise RuntimeError("test error")
+
+
+@pytest.mark.asyncio
+async def test_outbox_job_executed(client: AsyncClient):
+    _calls.clear()
+    job = await Outbox.enqueue(_outbox_test_task, value=123)
+
+    async def _is_done() -> bool:
+        return not await NotificationJob.filter(id=job.id).exists()
+
+    await wait_for(_is_done)
+    assert _calls == [123]
+
+
+@pytest.mark.asyncio
+async def test_outbox_job_retried_and_dead_lettered(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "outbox_max_attempts", 3)
+    monkeypatch.setattr(config, "outbox_backoff_base", 0)
+
+    _calls.clear()
+    job = await Outbox.enqueue(_outbox_test_failing_task, value=456)
+
+    async def _is_dead() -> bool:
+        return await NotificationJob.filter(id=job.id, status=NotificationJobStatus.DEAD).exists()
+
+    await wait_for(_is_dead)
+    await job.refresh_from_db()
+    assert job.attempts == 3
+    assert job.last_error == "RuntimeError: test error"
+    assert _calls == [456, 456, 456]
+
+
+@pytest.mark.asyncio
+async def test_outbox_enqueue_unregistered_task(client: AsyncClient):
+    async def _not_registered() -> None:  # pragma: no cover
+        ...
+
+    with pytest.raises(ValueError):
+        await Outbox.enqueue(_not_registered)
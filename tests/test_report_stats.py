@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from pytz import UTC
+
+from kkp.models import UserRole, ReportRollup
+from kkp.schemas.admin.report_stats import HeatmapCellInfo, TimelineDayInfo
+from kkp.schemas.animal_reports import AnimalReportInfo
+from tests.conftest import create_token
+
+LON = 42.42424242
+LAT = 24.24242424
+
+
+async def _create_report(client: AsyncClient, token: str, lat: float, lon: float) -> AnimalReportInfo:
+    response = await client.post("/animal-reports", headers={"authorization": token}, json={
+        "name": "test animal",
+        "breed": "idk breed",
+        "notes": "",
+        "latitude": lat,
+        "longitude": lon,
+        "media_ids": [],
+    })
+    assert response.status_code == 200, response.json()
+    return AnimalReportInfo(**response.json())
+
+
+@pytest.mark.asyncio
+async def test_reports_heatmap(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+    admin_token = await create_token(UserRole.VET_ADMIN)
+
+    await _create_report(client, user_token, LAT, LON)
+    await _create_report(client, user_token, LAT + 0.01, LON)
+    await _create_report(client, user_token, LAT + 1, LON)
+
+    response = await client.get("/admin/report-stats/heatmap", headers={"authorization": user_token})
+    assert response.status_code == 403, response.json()
+
+    response = await client.get("/admin/report-stats/heatmap?precision=4", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    cells = [HeatmapCellInfo(**cell) for cell in response.json()]
+    assert [cell.count for cell in cells] == [2, 1]
+    assert abs(cells[0].latitude - LAT) < 0.2
+    assert abs(cells[0].longitude - LON) < 0.2
+
+    response = await client.get(
+        f"/admin/report-stats/heatmap?precision=6&prefix={cells[0].cell}", headers={"authorization": admin_token},
+    )
+    assert response.status_code == 200, response.json()
+    cells = [HeatmapCellInfo(**cell) for cell in response.json()]
+    assert sorted(cell.count for cell in cells) == [1, 1]
+
+    response = await client.get("/admin/report-stats/heatmap?prefix=a", headers={"authorization": admin_token})
+    assert response.status_code == 400, response.json()
+
+
+@pytest.mark.asyncio
+async def test_reports_timeline(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+    admin_token = await create_token(UserRole.GLOBAL_ADMIN)
+
+    report = await _create_report(client, user_token, LAT, LON)
+    await _create_report(client, user_token, LAT + 1, LON)
+
+    today = datetime.now(UTC).date()
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert [TimelineDayInfo(**day) for day in response.json()] == [TimelineDayInfo(day=today, count=2)]
+
+    response = await client.delete(f"/admin/animal-reports/{report.id}", headers={"authorization": admin_token})
+    assert response.status_code == 204
+
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert [TimelineDayInfo(**day) for day in response.json()] == [TimelineDayInfo(day=today, count=1)]
+
+    response = await client.get(
+        f"/admin/report-stats/timeline?start={today + timedelta(days=1)}&end={today}",
+        headers={"authorization": admin_token},
+    )
+    assert response.status_code == 400, response.json()
+
+
+@pytest.mark.asyncio
+async def test_rebuild_report_rollups(client: AsyncClient):
+    user_token = await create_token(UserRole.REGULAR)
+    admin_token = await create_token(UserRole.GLOBAL_ADMIN)
+
+    await _create_report(client, user_token, LAT, LON)
+    await _create_report(client, user_token, LAT + 1, LON)
+
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    expected = response.json()
+
+    # Reports created before rollups were introduced
+    await ReportRollup.all().delete()
+    await ReportRollup.rebuild(batch_size=1)
+
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert response.json() == expected
+
+
+@pytest.mark.asyncio
+async def test_delete_original_report_with_duplicates(client: AsyncClient):
+    admin_token = await create_token(UserRole.GLOBAL_ADMIN)
+
+    report = await _create_report(client, await create_token(UserRole.REGULAR), LAT, LON)
+    duplicate = await _create_report(client, await create_token(UserRole.REGULAR), LAT, LON)
+    assert duplicate.duplicate_of == report.id
+
+    today = datetime.now(UTC).date()
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert [TimelineDayInfo(**day) for day in response.json()] == [TimelineDayInfo(day=today, count=1)]
+
+    # Duplicate is not a duplicate anymore once original is deleted, so it is counted instead
+    response = await client.delete(f"/admin/animal-reports/{report.id}", headers={"authorization": admin_token})
+    assert response.status_code == 204
+
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert [TimelineDayInfo(**day) for day in response.json()] == [TimelineDayInfo(day=today, count=1)]
+
+    await ReportRollup.rebuild()
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert [TimelineDayInfo(**day) for day in response.json()] == [TimelineDayInfo(day=today, count=1)]
+
+    response = await client.delete(f"/admin/animal-reports/{duplicate.id}", headers={"authorization": admin_token})
+    assert response.status_code == 204
+
+    response = await client.get("/admin/report-stats/timeline", headers={"authorization": admin_token})
+    assert response.status_code == 200, response.json()
+    assert [TimelineDayInfo(**day) for day in response.json()] == [TimelineDayInfo(day=today, count=0)]
@@ -3,16 +3,19 @@ from asyncio import sleep
 from datetime import datetime, UTC, timedelta
 
 import pytest
+from aiosmtplib import SMTPServerDisconnected
 from httpx import AsyncClient
 from pytest_httpx import HTTPXMock
 
-from kkp.models import UserRole, Animal, AnimalReport, GeoPoint, AnimalStatus, PayoutStatus, TreatmentReport
+from kkp.config import SMTP
+from kkp.models import UserRole, Animal, AnimalReport, GeoPoint, AnimalStatus, PayoutStatus, TreatmentReport, \
+    NotificationJob
 from kkp.schemas.animal_reports import AnimalReportInfo
 from kkp.schemas.common import PaginationResponse
 from kkp.schemas.treatment_reports import TreatmentReportInfo
 from kkp.utils.cache import Cache
 from kkp.utils.paypal import PayPal
-from tests.conftest import create_token, httpx_mock_decorator
+from tests.conftest import create_token, httpx_mock_decorator, wait_for
 from tests.paypal_mock import PaypalMockState
 
 LON = 42.42424242
@@ -184,3 +187,54 @@ async def test_treatment_report_payout_multiple_times_at_once(client: AsyncClien
 
     status_codes = {result.status_code for result in results}
     assert status_codes == {200, 400}
+
+
+@httpx_mock_decorator
+@pytest.mark.asyncio
+async def test_treatment_report_payout_email_fails(
+        client: AsyncClient, httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch,
+):
+    Cache.disable()
+    mock_state = PaypalMockState()
+    httpx_mock.add_callback(mock_state.auth_callback, method="POST", url=PayPal.AUTHORIZE)
+    httpx_mock.add_callback(mock_state.payout_create_callback, method="POST", url=PayPal.PAYOUTS)
+
+    async def _fail(*args, **kwargs) -> None:
+        raise SMTPServerDisconnected("smtp server is down")
+
+    monkeypatch.setattr(SMTP, "send_message", _fail)
+
+    admin_token = await create_token(UserRole.GLOBAL_ADMIN)
+    vet_token = await create_token(UserRole.VET)
+
+    report = await AnimalReport.create(
+        animal=await Animal.create(name="test 123", breed="test idk", status=AnimalStatus.FOUND),
+        location=await GeoPoint.create(latitude=LAT, longitude=LON),
+    )
+
+    response = await client.post(f"/animal-reports/{report.id}/assign", headers={"authorization": vet_token})
+    assert response.status_code == 200, response.json()
+
+    response = await client.post("/treatment-reports", headers={"authorization": vet_token}, json={
+        "animal_report_id": report.id,
+        "description": "test treatment report",
+        "money_spent": 123.5,
+        "payout_email": "asd@example.com",
+    })
+    assert response.status_code == 200, response.json()
+    treatment_report = TreatmentReportInfo(**response.json())
+
+    # Payout is created even if notification email can not be sent
+    response = await client.post(
+        f"/admin/treatment-reports/{treatment_report.id}/payout", headers={"authorization": admin_token},
+    )
+    assert response.status_code == 200, response.json()
+    assert TreatmentReportInfo(**response.json()).payout_status is PayoutStatus.PENDING
+    assert mock_state.payouts_count == 1
+
+    async def _only_email_left() -> bool:
+        jobs = await NotificationJob.filter(task="send_payout_approved_notification")
+        jobs = [job for job in jobs if job.payload["treatment_report_id"] == treatment_report.id]
+        return [job.payload.get("fcm", True) for job in jobs] == [False]
+
+    await wait_for(_only_email_left)
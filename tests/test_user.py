@@ -3,10 +3,11 @@ from time import time
 import pytest
 from httpx import AsyncClient
 
-from kkp.models import User, Session, Media, MediaType, MediaStatus
+from kkp.models import User, Session, Media, MediaType, MediaStatus, UserRole
 from kkp.schemas.users import UserInfo
+from kkp.utils.cache import Cache
 from kkp.utils.mfa import Mfa
-from tests.conftest import PWD_HASH_123456789, create_token
+from tests.conftest import PWD_HASH_123456789, create_token, create_user
 
 IMG_1x1_PIXEL_RED = bytes.fromhex(
     "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753"
@@ -192,6 +193,81 @@ async def test_change_password(client: AsyncClient):
     assert response.status_code == 200, response.json()
 
 
+@pytest.mark.asyncio
+async def test_change_password_twice_with_cached_session(client: AsyncClient):
+    user = await User.create(
+        email=f"test{int(time())}@gmail.com", password=PWD_HASH_123456789, first_name="first", last_name="last",
+    )
+    token = (await Session.create(user=user)).to_jwt()
+
+    response = await client.get("/user/info", headers={"authorization": token})
+    assert response.status_code == 200, response.json()
+    assert await Session.from_jwt(token) is not None
+
+    response = await client.patch("/user/password", headers={"authorization": token}, json={
+        "old_password": "123456789",
+        "new_password": "987654321",
+    })
+    assert response.status_code == 200, response.json()
+
+    response = await client.patch("/user/password", headers={"authorization": token}, json={
+        "old_password": "987654321",
+        "new_password": "123456789",
+    })
+    assert response.status_code == 200, response.json()
+
+
+@pytest.mark.asyncio
+async def test_auth_cache_has_no_secrets(client: AsyncClient):
+    user = await User.create(
+        email=f"test{int(time())}@gmail.com", password=PWD_HASH_123456789, first_name="first", last_name="last",
+        mfa_key="A" * 16,
+    )
+    session = await Session.create(user=user)
+
+    response = await client.get("/user/info", headers={"authorization": session.to_jwt()})
+    assert response.status_code == 200, response.json()
+    assert response.json()["mfa_enabled"]
+
+    cached = await Cache.get(f"user-{user.id}", f"session-{session.id}-{session.nonce}")
+    assert cached is not None
+    assert "password" not in cached["user"]
+    assert "mfa_key" not in cached["user"]
+
+    # Secrets of user authenticated from cache are loaded from database
+    response = await client.post("/user/mfa/disable", headers={"authorization": session.to_jwt()}, json={
+        "password": "123456789",
+        "code": Mfa.get_code("A" * 16),
+    })
+    assert response.status_code == 200, response.json()
+    assert not response.json()["mfa_enabled"]
+
+
+@pytest.mark.asyncio
+async def test_cached_session_of_changed_and_deleted_user(client: AsyncClient):
+    user = await create_user(UserRole.GLOBAL_ADMIN)
+    session = await Session.create(user=user)
+    token = session.to_jwt()
+
+    response = await client.get("/admin/users", headers={"authorization": token})
+    assert response.status_code == 200, response.json()
+    assert await Cache.get(f"user-{user.id}", f"session-{session.id}-{session.nonce}") is not None
+
+    # Cached session must not keep rights of demoted user
+    user.role = UserRole.REGULAR
+    await user.save()
+    response = await client.get("/admin/users", headers={"authorization": token})
+    assert response.status_code == 403, response.json()
+
+    response = await client.get("/user/info", headers={"authorization": token})
+    assert response.status_code == 200, response.json()
+    assert await Cache.get(f"user-{user.id}", f"session-{session.id}-{session.nonce}") is not None
+
+    await user.delete()
+    response = await client.get("/user/info", headers={"authorization": token})
+    assert response.status_code == 401, response.json()
+
+
 @pytest.mark.asyncio
 async def test_edit_user(client: AsyncClient):
     token = await create_token()